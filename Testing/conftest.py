@@ -0,0 +1,21 @@
+"""
+Synthetic studies shared by the tests.
+"""
+import pytest
+
+from pumpia.file_handling.dicom_structures import Series
+
+from pumpia_acr_med.synthetic import generate_study
+from pumpia_acr_med.lazy_series import load_series
+from pumpia_acr_med.batch import find_studies
+
+
+@pytest.fixture(scope="session")
+def repeat_study(tmp_path_factory: pytest.TempPathFactory) -> list[Series]:
+    """
+    A 256 matrix study with 4 repeats, loaded with `load_series`.
+    """
+    folder = tmp_path_factory.mktemp("repeat_study")
+    generate_study(folder, num_repeats=4, seed=0)
+    files = find_studies(folder).popitem()[1]
+    return sorted(load_series(files), key=lambda s: s.series_number)
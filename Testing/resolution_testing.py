@@ -16,6 +16,7 @@ if str(Path(__file__).resolve().parent.parent) not in sys.path:
     sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 from pumpia_acr_med.med_acr_context import MedACRContextManager
+from pumpia_acr_med.resolution_utils import offset_sweep
 
 
 def square_wave_integral(x: np.ndarray | float, amp: float = 1, width: float = 1, offset: float = 0):
@@ -251,35 +252,20 @@ class ResolutionTest(BaseModule):
         min_offsets = self.min_offset
         max_offsets = self.max_offset
 
-        pixel_width_indices: np.ndarray = np.arange(0, num_widths, 1)
-        offset_indices: np.ndarray = np.arange(0, num_offsets, 1)
-
-        results = np.zeros((num_widths, num_offsets))
-
-        max_points = np.zeros(num_widths)
-        pixel_widths = np.zeros(num_widths)
-
-        for p_i in pixel_width_indices:
-            pixel_width = min_widths + (p_i * (max_widths - min_widths) / num_widths)
-            if pixel_width > 0:
-                max_points[p_i] = ((8 // pixel_width) * 0.5
-                                   - (3.5 / pixel_width)
-                                   ) % 1 - 0.5
-                pixel_widths[p_i] = pixel_width
-                for o_i in offset_indices:
-                    offset = min_offsets + (o_i * (max_offsets - min_offsets) / num_offsets)
-                    signal = model_signal(pixel_width,
-                                          offset,
-                                          1,
-                                          1,
-                                          4,
-                                          8)
-                    fft_signal = np.fft.rfft(signal, 2 * signal.shape[0])
-                    abs_fft = np.abs(fft_signal)
-                    if abs_fft[0] != 0:
-                        abs_fft = abs_fft / abs_fft[0]
-                        locs = np.fft.rfftfreq(2 * signal.shape[0], d=pixel_width)
-                        results[p_i, o_i] = np.interp(0.5, locs, abs_fft)
+        pixel_widths = min_widths + (np.arange(0, num_widths, 1) * (max_widths - min_widths) / num_widths)
+        offsets = min_offsets + (np.arange(0, num_offsets, 1) * (max_offsets - min_offsets) / num_offsets)
+        valid = pixel_widths > 0
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            max_points = np.where(valid,
+                                  ((8 // pixel_widths) * 0.5
+                                   - (3.5 / pixel_widths)
+                                   ) % 1 - 0.5,
+                                  0)
+            num_samples = np.where(valid, 8 // pixel_widths, 0).astype(int)
+        pixel_widths = np.where(valid, pixel_widths, 0)
+
+        results = offset_sweep(pixel_widths, offsets, 1, 4, num_samples, "FFT", 0.5)
 
         results = results[::-1]
         fig = plt.gcf()
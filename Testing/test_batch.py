@@ -0,0 +1,80 @@
+"""
+Checks the batch analysis of synthetic studies and compares it with their ground truth.
+"""
+import csv
+from pathlib import Path
+
+import pytest
+
+from pumpia_acr_med.batch import RESULT_COLUMNS, analyse_study, find_studies, run_batch
+from pumpia_acr_med.synthetic import generate_study
+
+# (column, ground truth key, absolute tolerance, relative tolerance) of the results of each image
+IMAGE_CHECKS = [("phantom_width{num}.average_width", "average_width", 1, 0),
+                ("slice_width{num}.slice_width", "slice_width", 0, 0.1),
+                ("slice_pos{num}.slice_1_pos", "slice_1_pos", 0.5, 0),
+                ("slice_pos{num}.slice_11_pos", "slice_11_pos", 0.5, 0),
+                # the ghosting is biased low, see `generate_study`
+                ("ghosting{num}.ghosting", "ghosting", 0.5, 0.3)]
+
+STUDIES = [{},
+           {"inserts_slice_pos": "last",
+            "res_insert_side": "bottom",
+            "circle_insert_side": "left",
+            "slice_width": 4,
+            "slice_1_pos": 3,
+            "slice_11_pos": -2,
+            "ghost_level": 0.05,
+            "phase_direction": "COL"},
+           {"res_insert_side": "left",
+            "circle_insert_side": "bottom",
+            "slice_1_pos": -4,
+            "slice_11_pos": 5},
+           {"res_insert_side": "top",
+            "circle_insert_side": "left",
+            "slice_1_pos": 2,
+            "slice_11_pos": -3},
+           {"matrix": 512,
+            "res_insert_side": "right",
+            "circle_insert_side": "top",
+            "slice_width": 3,
+            "slice_1_pos": 1.5,
+            "slice_11_pos": -1}]
+
+
+def test_run_batch_writes_each_study(tmp_path: Path):
+    folder = tmp_path / "studies"
+    generate_study(folder / "study1", seed=0)
+    generate_study(folder / "study2", res_insert_side="top", circle_insert_side="left", seed=1)
+    output = tmp_path / "results.csv"
+
+    assert run_batch(folder, output, workers=1) == 2
+
+    with open(output, newline="", encoding="utf-8") as csv_file:
+        reader = csv.DictReader(csv_file)
+        rows = list(reader)
+    assert reader.fieldnames == RESULT_COLUMNS
+    assert sorted(row["res_insert_side"] for row in rows) == ["bottom", "top"]
+    for row in rows:
+        assert row["series2"] != ""
+        assert float(row["snr.snr"]) > 0
+
+
+@pytest.mark.parametrize("settings", STUDIES)
+def test_batch_matches_ground_truth(tmp_path: Path, settings: dict):
+    truth = generate_study(tmp_path, seed=0, **settings)
+    rows = analyse_study(find_studies(tmp_path).popitem()[1])
+    assert len(rows) == 1
+    row = rows[0]
+
+    assert row["inserts_slice"] == truth["inserts_slice"]
+    assert row["res_insert_side"] == truth["res_insert_side"]
+    assert row["circle_insert_side"] == truth["circle_insert_side"]
+    assert row["rotation"] == pytest.approx(truth["rotation"], abs=0.5)
+    assert row["snr.signal"] == pytest.approx(truth["signal"], rel=0.01)
+    assert row["snr.noise"] == pytest.approx(truth["noise"], rel=0.05)
+    assert row["snr.snr"] == pytest.approx(truth["snr"], rel=0.05)
+    for num in (1, 2):
+        for column, key, absolute, relative in IMAGE_CHECKS:
+            assert row[column.format(num=num)] == pytest.approx(truth[key], abs=absolute, rel=relative), column
+
@@ -0,0 +1,21 @@
+"""
+Checks the insert sides and rotation found on synthetic studies.
+"""
+from pathlib import Path
+
+import pytest
+
+from pumpia_acr_med.batch import find_studies, series_context
+from pumpia_acr_med.lazy_series import load_series
+from pumpia_acr_med.synthetic import generate_study
+
+
+@pytest.mark.parametrize("rotation", [-30, 15, 40])
+def test_rotated_insert_sides(tmp_path: Path, rotation: float):
+    truth = generate_study(tmp_path, rotation=rotation, res_insert_side="top", circle_insert_side="right", seed=0)
+    series = load_series(find_studies(tmp_path).popitem()[1])[0]
+    context = series_context(series)
+
+    assert context.res_insert_side == truth["res_insert_side"]
+    assert context.circle_insert_side == truth["circle_insert_side"]
+    assert context.rotation == pytest.approx(rotation, abs=0.5)
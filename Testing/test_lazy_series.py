@@ -0,0 +1,17 @@
+"""
+Checks the lazily loaded series against the files read in full.
+"""
+import numpy as np
+from pydicom import dcmread
+
+from pumpia.file_handling.dicom_structures import Series
+
+from pumpia_acr_med.context_utils import find_inserts_slice
+
+
+def test_lazy_series_match_files(repeat_study: list[Series]):
+    series = repeat_study[0]
+    for instance in series.instances:
+        np.testing.assert_array_equal(instance.array[0], dcmread(instance.filepath).pixel_array)
+    full_profile = np.array([np.sum(dcmread(instance.filepath).pixel_array) for instance in series.instances])
+    assert find_inserts_slice(series.z_profile) == find_inserts_slice(full_profile)
@@ -0,0 +1,280 @@
+"""
+Checks the batched resolution functions give the same results as the loops they replaced
+and that refining the lines improves on them.
+"""
+import math
+from typing import Literal
+
+import numpy as np
+import pytest
+
+from pumpia.file_handling.dicom_structures import Series
+from pumpia.image_handling.roi_structures import RectangleROI
+
+from pumpia_acr_med import resolution_utils
+from pumpia_acr_med.batch import find_studies, series_context
+from pumpia_acr_med.context_utils import inserts_slices
+from pumpia_acr_med.lazy_series import load_series
+from pumpia_acr_med.synthetic import generate_study
+from pumpia_acr_med.resolution_utils import (ResolutionMethod,
+                                             get_contrast,
+                                             get_contrasts,
+                                             _segment_means,
+                                             fft_contrast,
+                                             fft_contrasts,
+                                             model_signal,
+                                             offset_sweep,
+                                             profile_contrasts,
+                                             search_lines,
+                                             search_angled_lines,
+                                             sampled_contrasts,
+                                             refine_line)
+from pumpia_acr_med.modules.resolution import (POINT_SEP,
+                                               NUM_PINS,
+                                               resolution_rois,
+                                               resolution_contrasts)
+
+
+def loop_contrast(profile: np.ndarray) -> float:
+    """
+    `get_contrast`, with profiles it fails on given a contrast of 0 as `get_contrasts` does.
+    """
+    try:
+        return get_contrast(profile)
+    except (ValueError, IndexError):
+        return 0
+
+
+def loop_search(array: np.ndarray,
+                pixel_size: tuple[float, float],
+                line_min_vals: float,
+                method: str) -> tuple[float, tuple[int, int], float, tuple[int, int]]:
+    """
+    The line search of `MedACRResolution.analyse` before it was vectorised.
+    """
+    pixel_height, pixel_width = pixel_size
+    contrast_frequency = 1 / (2 * POINT_SEP)
+    horizontal_line_length = math.floor(2 * NUM_PINS * POINT_SEP / pixel_width)
+    vertical_line_length = math.floor(2 * NUM_PINS * POINT_SEP / pixel_height)
+    height, width = array.shape
+    xmax = width - horizontal_line_length
+    ymax = height - vertical_line_length
+
+    horizontal_max_contrast: float = 0
+    vertical_max_contrast: float = 0
+    horizontal_max_position = 0, 0
+    vertical_max_position = 0, 0
+    for x in range(width):
+        for y in range(height):
+            if x <= xmax:
+                profile = array[y, x:x + horizontal_line_length]
+                pin_locs = profile >= line_min_vals
+                within_loc = math.ceil(2 * POINT_SEP / pixel_width)
+                if np.sum(pin_locs[:within_loc]) >= 1 and np.sum(pin_locs[-within_loc:]) >= 1:
+                    if method == "FFT":
+                        contrast = fft_contrast(profile, pixel_width, contrast_frequency)
+                    else:
+                        contrast = loop_contrast(profile)
+                    if contrast > horizontal_max_contrast:
+                        horizontal_max_contrast = contrast
+                        horizontal_max_position = x, y
+            if y <= ymax:
+                profile = array[y:y + vertical_line_length, x]
+                pin_locs = profile >= line_min_vals
+                within_loc = math.ceil(2 * POINT_SEP / pixel_height)
+                if np.sum(pin_locs[:within_loc]) >= 1 and np.sum(pin_locs[-within_loc:]) >= 1:
+                    if method == "FFT":
+                        contrast = fft_contrast(profile, pixel_height, contrast_frequency)
+                    else:
+                        contrast = loop_contrast(profile)
+                    if contrast > vertical_max_contrast:
+                        vertical_max_contrast = contrast
+                        vertical_max_position = x, y
+    return horizontal_max_contrast, horizontal_max_position, vertical_max_contrast, vertical_max_position
+
+
+@pytest.mark.parametrize("method", ["FFT", "contrast"])
+def test_search_matches_loop(repeat_study: list[Series], method: str):
+    series = repeat_study[0]
+    context = series_context(series)
+    image = series.instances[inserts_slices(context)[0]]
+    pixel_size = (image.pixel_spacing[0], image.pixel_spacing[1])
+    main_roi, _, _ = resolution_rois(image, context, pixel_size)
+
+    results, lines = resolution_contrasts(main_roi, None, None, pixel_size, "ROW", True, False, 50, method)
+    assert lines is not None
+    horizontal, vertical = lines
+
+    array = main_roi.pixel_array
+    line_min_vals = np.max(array) * 50 / 100
+    (horizontal_contrast,
+     horizontal_position,
+     vertical_contrast,
+     vertical_position) = loop_search(array, pixel_size, line_min_vals, method)
+
+    assert horizontal_contrast > 0
+    assert vertical_contrast > 0
+    assert results["phase_contrast"] == pytest.approx(100 * horizontal_contrast, rel=1e-12)
+    assert results["freq_contrast"] == pytest.approx(100 * vertical_contrast, rel=1e-12)
+    assert (horizontal.x1 - main_roi.xmin, horizontal.y1 - main_roi.ymin) == horizontal_position
+    assert (vertical.x1 - main_roi.xmin, vertical.y1 - main_roi.ymin) == vertical_position
+
+
+def test_get_contrasts_matches_loop():
+    rng = np.random.default_rng(0)
+    # square waves with noise like lines across the pins, and pure noise
+    points = np.arange(12)
+    phases = rng.integers(0, 4, size=(2000, 1))
+    waves = 100 * ((points + phases) // 2 % 2) + 20
+    profiles = np.concatenate([waves + rng.normal(0, 15, waves.shape),
+                               rng.normal(100, 30, (2000, 12))])
+
+    expected = np.array([loop_contrast(profile) for profile in profiles])
+    np.testing.assert_array_equal(get_contrasts(profiles), expected)
+
+
+def test_segment_means_match_np_mean():
+    rng = np.random.default_rng(1)
+    values = rng.normal(0, 1, 500)
+    starts = rng.integers(0, 480, 300)
+    lengths = rng.integers(1, 20, 300)
+
+    expected = np.array([np.mean(values[start:start + length]) for start, length in zip(starts, lengths)])
+    np.testing.assert_array_equal(_segment_means(values, starts, lengths), expected)
+
+
+@pytest.mark.parametrize("pixel_width", [0.25, 0.49, 0.7, 0.98])
+def test_fft_contrast_matches_dft(pixel_width: float):
+    rng = np.random.default_rng(2)
+    num_points = math.floor(8 / pixel_width)
+    positions = np.arange(num_points) * pixel_width
+    profiles = 100 * (positions // 1 % 2) + rng.normal(50, 10, (50, num_points))
+
+    dft = np.array([abs(np.sum(profile * np.exp(-1j * np.pi * positions))) / np.sum(profile)
+                    for profile in profiles])
+    # the zero padded rfft interpolated at the frequency that was replaced
+    padded = np.array([np.interp(0.5,
+                                 np.fft.rfftfreq(10 * num_points, d=pixel_width),
+                                 np.abs(np.fft.rfft(profile, 10 * num_points)))
+                       / np.sum(profile)
+                       for profile in profiles])
+    contrasts = np.array([fft_contrast(profile, pixel_width, 0.5) for profile in profiles])
+
+    np.testing.assert_allclose(contrasts, dft, rtol=1e-10)
+    np.testing.assert_allclose(fft_contrasts(profiles, pixel_width, 0.5), contrasts, rtol=1e-10)
+    np.testing.assert_allclose(contrasts, padded, atol=0.01)
+
+
+@pytest.mark.parametrize("method", ["FFT", "contrast"])
+def test_offset_sweep_matches_loop(method: str):
+    pixel_widths = np.linspace(0.3, 1.6, 14)
+    offsets = np.linspace(0, 2, 11)
+    num_samples = (8 // pixel_widths).astype(int)
+
+    expected = np.zeros((pixel_widths.shape[0], offsets.shape[0]))
+    for w_i, pixel_width in enumerate(pixel_widths):
+        for o_i, offset in enumerate(offsets):
+            signal = model_signal(offset, pixel_width, 1, 4, num_samples[w_i])
+            if method == "FFT":
+                expected[w_i, o_i] = fft_contrast(signal, pixel_width, 0.5)
+            else:
+                expected[w_i, o_i] = loop_contrast(signal)
+
+    # a small chunk size so the sweep is split across several chunks
+    results = offset_sweep(pixel_widths, offsets, 1, 4, num_samples, method, 0.5, chunk_size=500)
+    if method == "FFT":
+        np.testing.assert_allclose(results, expected, rtol=1e-10, atol=1e-12)
+    else:
+        np.testing.assert_array_equal(results, expected)
+
+
+@pytest.fixture(scope="module")
+def rotated_insert(tmp_path_factory: pytest.TempPathFactory) -> tuple[RectangleROI, tuple[float, float]]:
+    """
+    The resolution insert of a 256 matrix study rotated by -2 degrees and its pixel size.
+    """
+    folder = tmp_path_factory.mktemp("rotated_study")
+    generate_study(folder, rotation=-2, seed=0)
+    series = load_series(find_studies(folder).popitem()[1])[0]
+    context = series_context(series)
+    image = series.instances[inserts_slices(context)[0]]
+    pixel_size = (image.pixel_spacing[0], image.pixel_spacing[1])
+    main_roi, _, _ = resolution_rois(image, context, pixel_size)
+    return main_roi, pixel_size
+
+
+@pytest.fixture
+def evaluations(monkeypatch: pytest.MonkeyPatch) -> list[int]:
+    """
+    Counts the line profiles the contrast is calculated for.
+    """
+    count = [0]
+
+    def counted_contrasts(profiles: np.ndarray, *args, **kwargs) -> np.ndarray:
+        count[0] += profiles.shape[0]
+        return profile_contrasts(profiles, *args, **kwargs)
+
+    monkeypatch.setattr(resolution_utils, "profile_contrasts", counted_contrasts)
+    return count
+
+
+@pytest.mark.parametrize("method", ["FFT", "contrast"])
+def test_refined_lines_rotated_phantom(rotated_insert: tuple[RectangleROI, tuple[float, float]], method: str):
+    main_roi, pixel_size = rotated_insert
+    results, _ = resolution_contrasts(main_roi, None, None, pixel_size, "ROW", True, False, 50, method)
+    refined_results, lines = resolution_contrasts(main_roi, None, None, pixel_size, "ROW", True, True, 50, method)
+    assert lines is not None
+
+    for key in ("phase_contrast", "freq_contrast"):
+        assert type(refined_results[key]) is float
+        assert refined_results[key] >= results[key]
+    assert refined_results["total_contrast"] > results["total_contrast"] + 1
+
+
+@pytest.mark.parametrize("method", ["FFT", "contrast"])
+@pytest.mark.parametrize("direction", ["horizontal", "vertical"])
+def test_refine_line_matches_grid(rotated_insert: tuple[RectangleROI, tuple[float, float]],
+                                  evaluations: list[int],
+                                  method: ResolutionMethod,
+                                  direction: Literal["horizontal", "vertical"]):
+    main_roi, pixel_size = rotated_insert
+    array = main_roi.pixel_array
+    line_min_val = np.max(array) * 50 / 100
+    if direction == "horizontal":
+        pixel_width = pixel_size[1]
+    else:
+        pixel_width = pixel_size[0]
+    line_length = math.floor(2 * NUM_PINS * POINT_SEP / pixel_width)
+    within_loc = math.ceil(2 * POINT_SEP / pixel_width)
+    angles = [-5, -2.5, 0, 2.5, 5]
+
+    contrast, position = search_lines(array, line_length, direction, pixel_width, line_min_val, method,
+                                      within_loc=within_loc)
+    angled_contrast, angled_position, angle = search_angled_lines(array, line_length, direction, pixel_size,
+                                                                  line_min_val, angles, method,
+                                                                  within_loc=within_loc)
+    assert search_angled_lines(array, line_length, direction, pixel_size, line_min_val, [0], method,
+                               within_loc=within_loc) == (contrast, position, 0)
+    assert angled_contrast >= contrast
+
+    evaluations[0] = 0
+    refined_contrast, _, refined_angle = refine_line(array, angled_position, line_length, direction, pixel_size,
+                                                     line_min_val, method, within_loc=within_loc, angle=angle)
+    refine_evaluations = evaluations[0]
+    assert refined_contrast >= angled_contrast
+    assert abs(refined_angle) <= 5
+
+    # every line within the bounds of `refine_line` on a grid with 1/8 pixel and 0.625 degree steps
+    evaluations[0] = 0
+    offsets = np.linspace(-1, 1, 17)
+    grid_positions = np.stack(np.meshgrid(angled_position[0] + offsets,
+                                          angled_position[1] + offsets,
+                                          indexing="ij"),
+                              axis=-1).reshape(-1, 2)
+    grid_contrast = max(np.max(sampled_contrasts(array, grid_positions, grid_angle, line_length, direction,
+                                                 pixel_size, line_min_val, method, within_loc=within_loc))
+                        for grid_angle in np.clip(np.linspace(angle - 2.5, angle + 2.5, 9), -5, 5))
+    grid_evaluations = evaluations[0]
+
+    assert refined_contrast >= grid_contrast - 0.005
+    assert refine_evaluations < grid_evaluations / 4
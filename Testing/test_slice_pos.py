@@ -0,0 +1,145 @@
+"""
+Compares the slice position wedge ROIs with those placed before the ROI offset was in mm.
+"""
+from pathlib import Path
+
+import pytest
+
+from pumpia.file_handling.dicom_structures import Instance
+from pumpia.image_handling.roi_structures import RectangleROI
+
+from pumpia_acr_med.batch import find_studies, series_context
+from pumpia_acr_med.context_utils import inserts_slices
+from pumpia_acr_med.lazy_series import load_series
+from pumpia_acr_med.med_acr_context import MedACRContext
+from pumpia_acr_med.synthetic import generate_study
+from pumpia_acr_med.modules.slice_pos import (ROI_OFFSET,
+                                              ROI_WIDTH,
+                                              ROI_HEIGHT,
+                                              LEFT_OFFSET,
+                                              RIGHT_OFFSET,
+                                              wedge_rois,
+                                              slice_positions)
+
+
+def baseline_wedge_rois(image1: Instance,
+                        image2: Instance,
+                        context: MedACRContext,
+                        pixel_size: tuple[float, float]
+                        ) -> tuple[RectangleROI, RectangleROI, RectangleROI, RectangleROI, str, str]:
+    """
+    `wedge_rois` as it was before, with the ROIs `ROI_OFFSET` pixels from the centre of the phantom
+    and with the resolution insert at the top the extent along the wedges from the ROI width.
+    """
+    pixel_height, pixel_width = pixel_size
+
+    if context.res_insert_side == "right" or context.res_insert_side == "left":
+        wedge_dir = "Horizontal"
+        box_height = ROI_WIDTH / pixel_height
+        box_width = ROI_HEIGHT / pixel_width
+        left_pix_offset = LEFT_OFFSET / pixel_height
+        right_pix_offset = RIGHT_OFFSET / pixel_height
+
+        if context.res_insert_side == "right":
+            wedge_side = "left"
+            left_xmin = right_xmin = round(context.xcent - box_width - ROI_OFFSET)
+            left_xmax = right_xmax = round(context.xcent + box_width - ROI_OFFSET)
+            left_ymin = round(context.ycent + left_pix_offset)
+            left_ymax = round(context.ycent + left_pix_offset + box_height)
+            right_ymin = round(context.ycent + right_pix_offset)
+            right_ymax = round(context.ycent + right_pix_offset + box_height)
+        else:
+            wedge_side = "right"
+            left_xmin = right_xmin = round(context.xcent - box_width + ROI_OFFSET)
+            left_xmax = right_xmax = round(context.xcent + box_width + ROI_OFFSET)
+            left_ymin = round(context.ycent - left_pix_offset - box_height)
+            left_ymax = round(context.ycent - left_pix_offset)
+            right_ymin = round(context.ycent - right_pix_offset - box_height)
+            right_ymax = round(context.ycent - right_pix_offset)
+    else:
+        wedge_dir = "Vertical"
+        box_height = ROI_HEIGHT / pixel_height
+        box_width = ROI_WIDTH / pixel_width
+        left_pix_offset = LEFT_OFFSET / pixel_width
+        right_pix_offset = RIGHT_OFFSET / pixel_width
+
+        if context.res_insert_side == "bottom":
+            wedge_side = "top"
+            left_ymin = right_ymin = round(context.ycent - box_height - ROI_OFFSET)
+            left_ymax = right_ymax = round(context.ycent + box_height - ROI_OFFSET)
+            left_xmin = round(context.xcent + left_pix_offset)
+            left_xmax = round(context.xcent + left_pix_offset + box_width)
+            right_xmin = round(context.xcent + right_pix_offset)
+            right_xmax = round(context.xcent + right_pix_offset + box_width)
+        else:
+            wedge_side = "bottom"
+            left_ymin = right_ymin = round(context.ycent - box_width + ROI_OFFSET)
+            left_ymax = right_ymax = round(context.ycent + box_width + ROI_OFFSET)
+            left_xmin = round(context.xcent - left_pix_offset - box_width)
+            left_xmax = round(context.xcent - left_pix_offset)
+            right_xmin = round(context.xcent - right_pix_offset - box_width)
+            right_xmax = round(context.xcent - right_pix_offset)
+
+    left_roi = RectangleROI(image1, left_xmin, left_ymin, left_xmax - left_xmin, left_ymax - left_ymin,
+                            slice_num=image1.current_slice, replace=True)
+    right_roi = RectangleROI(image1, right_xmin, right_ymin, right_xmax - right_xmin, right_ymax - right_ymin,
+                             slice_num=image1.current_slice, replace=True)
+    return (left_roi,
+            right_roi,
+            left_roi.copy_to_image(image2, image2.current_slice, replace=True),
+            right_roi.copy_to_image(image2, image2.current_slice, replace=True),
+            wedge_dir,
+            wedge_side)
+
+
+def study_slice_positions(folder: Path) -> tuple[dict[str, float], dict[str, float], MedACRContext, bool]:
+    """
+    The slice positions of a synthetic study from `wedge_rois` and `baseline_wedge_rois`,
+    the context and whether the ROIs of both are the same.
+    """
+    series = load_series(find_studies(folder).popitem()[1])[0]
+    context = series_context(series)
+    slice1, slice2 = inserts_slices(context)
+    pixel_size = (series.pixel_spacing[0], series.pixel_spacing[1])
+    args = (series.instances[slice1], series.instances[slice2], context, pixel_size)
+
+    rois = wedge_rois(*args)
+    baseline_rois = baseline_wedge_rois(*args)
+    same_rois = all((roi.xmin, roi.xmax, roi.ymin, roi.ymax)
+                    == (baseline_roi.xmin, baseline_roi.xmax, baseline_roi.ymin, baseline_roi.ymax)
+                    for roi, baseline_roi in zip(rois[:4], baseline_rois[:4]))
+    return (slice_positions(*rois, pixel_spacing=pixel_size),
+            slice_positions(*baseline_rois, pixel_spacing=pixel_size),
+            context,
+            same_rois)
+
+
+@pytest.mark.parametrize("res_insert_side, circle_insert_side", [("bottom", "right"),
+                                                                 ("left", "bottom"),
+                                                                 ("right", "top")])
+def test_unchanged_at_1mm(tmp_path: Path, res_insert_side: str, circle_insert_side: str):
+    generate_study(tmp_path,
+                   pixel_spacing=(1, 1),
+                   res_insert_side=res_insert_side,
+                   circle_insert_side=circle_insert_side,
+                   slice_1_pos=2,
+                   slice_11_pos=-3,
+                   seed=0)
+    positions, baseline_positions, _, same_rois = study_slice_positions(tmp_path)
+
+    assert same_rois
+    assert positions == baseline_positions
+
+
+@pytest.mark.parametrize("settings", [{"matrix": 512}, {"res_insert_side": "top", "circle_insert_side": "left"}])
+def test_changed_results_match_ground_truth(tmp_path: Path, settings: dict):
+    truth = generate_study(tmp_path, slice_1_pos=1.5, slice_11_pos=-1, seed=0, **settings)
+    positions, baseline_positions, context, same_rois = study_slice_positions(tmp_path)
+    assert context.res_insert_side == truth["res_insert_side"]
+
+    assert not same_rois
+    assert positions["slice_1_pos"] == pytest.approx(truth["slice_1_pos"], abs=0.5)
+    assert positions["slice_11_pos"] == pytest.approx(truth["slice_11_pos"], abs=0.5)
+    # the baseline ROIs miss the wedges
+    assert (baseline_positions["slice_1_pos"] != pytest.approx(truth["slice_1_pos"], abs=0.5)
+            or baseline_positions["slice_11_pos"] != pytest.approx(truth["slice_11_pos"], abs=0.5))
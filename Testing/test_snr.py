@@ -0,0 +1,93 @@
+"""
+Checks the streaming and moving window SNR calculations against direct calculations.
+"""
+import math
+
+import numpy as np
+import pytest
+
+from pumpia.file_handling.dicom_structures import Series
+
+from pumpia_acr_med.batch import series_context
+from pumpia_acr_med.context_utils import uniform_slice, window_sums
+from pumpia_acr_med.stats_utils import RunningStats
+from pumpia_acr_med.modules.sub_snr import snr_roi, subtraction_snr, repeat_snr, local_snr
+
+
+def test_running_stats_match_numpy():
+    rng = np.random.default_rng(0)
+    arrays = rng.normal(1000, 10, (7, 30, 40))
+    stats = RunningStats()
+    for array in arrays:
+        stats.add(array)
+
+    assert stats.count == 7
+    np.testing.assert_allclose(stats.mean, np.mean(arrays, axis=0), rtol=1e-12)
+    np.testing.assert_allclose(stats.variance(), np.var(arrays, axis=0, ddof=1), rtol=1e-9)
+    np.testing.assert_allclose(stats.std(0), np.std(arrays, axis=0), rtol=1e-9)
+
+
+def test_repeat_snr_matches_stack(repeat_study: list[Series]):
+    context = series_context(repeat_study[0])
+    slice_used = uniform_slice(context)
+    images = [series.instances[slice_used] for series in repeat_study]
+    roi = snr_roi(images[0], context, 70)
+    no_corrections: tuple[dict[str, float], float] = ({}, 1)
+
+    results = repeat_snr(roi, images, corrections=no_corrections)
+
+    stack = np.array([np.asarray(image[roi.slice_num], dtype=float)[roi.mask] for image in images])
+    signal = np.mean(stack)
+    noise = math.sqrt(np.mean(np.var(stack, axis=0, ddof=1)))
+    assert results["num_repeats"] == len(images)
+    assert results["signal"] == pytest.approx(signal, rel=1e-12)
+    assert results["noise"] == pytest.approx(noise, rel=1e-9)
+    assert results["snr"] == pytest.approx(signal / noise, rel=1e-9)
+
+    roi2 = roi.copy_to_image(images[1], images[1].current_slice, "SNR ROI", True)
+    pair = subtraction_snr(roi, roi2, corrections=no_corrections)
+    assert results["pair_snr"] == pytest.approx(pair["snr"], rel=1e-12)
+
+
+@pytest.mark.parametrize("window", [(1, 1), (3, 5), (7, 7), (40, 40)])
+def test_window_sums_match_loop(window: tuple[int, int]):
+    rng = np.random.default_rng(1)
+    array = rng.normal(0, 1, (23, 31))
+    height, width = array.shape
+
+    expected = np.zeros(array.shape)
+    for y in range(height):
+        for x in range(width):
+            ymin = max(y - window[0] // 2, 0)
+            xmin = max(x - window[1] // 2, 0)
+            expected[y, x] = np.sum(array[ymin:y - window[0] // 2 + window[0],
+                                          xmin:x - window[1] // 2 + window[1]])
+
+    np.testing.assert_allclose(window_sums(array, window), expected, atol=1e-10)
+
+
+def test_local_snr_matches_loop():
+    rng = np.random.default_rng(2)
+    rows, columns = np.indices((40, 48))
+    mask = (rows - 20) ** 2 + (columns - 24) ** 2 <= 18 ** 2
+    # signal varying across the phantom like a coil sensitivity
+    signal = np.where(mask, 500 + 10 * columns, 0)
+    array1 = signal + rng.normal(0, 10, mask.shape)
+    array2 = signal + rng.normal(0, 10, mask.shape)
+    window = (5, 7)
+
+    results, snr_map = local_snr(array1, array2, mask, window)
+
+    expected = np.full(mask.shape, np.nan)
+    for y in range(window[0] // 2, mask.shape[0] - window[0] // 2):
+        for x in range(window[1] // 2, mask.shape[1] - window[1] // 2):
+            box = (slice(y - window[0] // 2, y + window[0] // 2 + 1),
+                   slice(x - window[1] // 2, x + window[1] // 2 + 1))
+            if np.all(mask[box]):
+                noise = np.std(array1[box] - array2[box]) / math.sqrt(2)
+                expected[y, x] = np.mean((array1[box] + array2[box]) / 2) / noise
+
+    np.testing.assert_array_equal(np.isnan(snr_map), np.isnan(expected))
+    np.testing.assert_allclose(snr_map, expected, rtol=1e-8)
+    assert results["min_local_snr"] == pytest.approx(np.nanmin(expected), rel=1e-8)
+    assert results["max_local_snr"] == pytest.approx(np.nanmax(expected), rel=1e-8)
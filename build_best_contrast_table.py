@@ -0,0 +1,3 @@
+from pumpia_acr_med.resolution_utils import build_best_contrast_table
+
+build_best_contrast_table()
@@ -0,0 +1,127 @@
+"""
+Acquisition parameters of a series, read once from the DICOM header and shared by all modules.
+"""
+import threading
+import weakref
+
+import pydicom
+from pydicom import dcmread
+
+from pumpia.file_handling.dicom_structures import Series, Instance
+
+
+def _float(header: pydicom.Dataset, keyword: str) -> float | None:
+    # invalid values can raise when the element is converted
+    try:
+        return float(header.get(keyword))  # pyright: ignore[reportArgumentType]
+    except (ValueError, TypeError):
+        return None
+
+
+def _int(header: pydicom.Dataset, keyword: str) -> int | None:
+    try:
+        return int(header.get(keyword))  # pyright: ignore[reportArgumentType]
+    except (ValueError, TypeError):
+        return None
+
+
+class AcquisitionParameters:
+    """
+    The acquisition parameters of a series used by the modules.
+    Values not in the header, or which are not valid, are None.
+
+    Attributes
+    ----------
+    rows : int | None
+    columns : int | None
+    slice_thickness : float | None
+    pixel_spacing : tuple[float, float] | None
+        The row and column spacing.
+    pixel_bandwidth : float | None
+    averages : float | None
+    phase_encoding_steps : float | None
+    phase_encoding_direction : str | None
+    percent_sampling : float | None
+    repetition_time : float | None
+        In seconds.
+    """
+
+    def __init__(self,
+                 rows: int | None = None,
+                 columns: int | None = None,
+                 slice_thickness: float | None = None,
+                 pixel_spacing: tuple[float, float] | None = None,
+                 pixel_bandwidth: float | None = None,
+                 averages: float | None = None,
+                 phase_encoding_steps: float | None = None,
+                 phase_encoding_direction: str | None = None,
+                 percent_sampling: float | None = None,
+                 repetition_time: float | None = None):
+        self.rows: int | None = rows
+        self.columns: int | None = columns
+        self.slice_thickness: float | None = slice_thickness
+        self.pixel_spacing: tuple[float, float] | None = pixel_spacing
+        self.pixel_bandwidth: float | None = pixel_bandwidth
+        self.averages: float | None = averages
+        self.phase_encoding_steps: float | None = phase_encoding_steps
+        self.phase_encoding_direction: str | None = phase_encoding_direction
+        self.percent_sampling: float | None = percent_sampling
+        self.repetition_time: float | None = repetition_time
+
+    @classmethod
+    def from_header(cls, header: pydicom.Dataset) -> 'AcquisitionParameters':
+        """
+        Reads the parameters from a dataset, the pixel data is not used.
+        """
+        try:
+            pixel_spacing = header.get("PixelSpacing")
+            spacing = (float(pixel_spacing[0]), float(pixel_spacing[1]))  # pyright: ignore[reportOptionalSubscript]
+        except (ValueError, TypeError, IndexError):
+            spacing = None
+        direction = header.get("InPlanePhaseEncodingDirection")
+        repetition_time = _float(header, "RepetitionTime")
+        return cls(rows=_int(header, "Rows"),
+                   columns=_int(header, "Columns"),
+                   slice_thickness=_float(header, "SliceThickness"),
+                   pixel_spacing=spacing,
+                   pixel_bandwidth=_float(header, "PixelBandwidth"),
+                   averages=_float(header, "NumberOfAverages"),
+                   phase_encoding_steps=_float(header, "NumberOfPhaseEncodingSteps"),
+                   phase_encoding_direction=None if direction is None else str(direction),
+                   percent_sampling=_float(header, "PercentSampling"),
+                   repetition_time=None if repetition_time is None else repetition_time / 1000)
+
+
+_parameters: weakref.WeakKeyDictionary[Series, AcquisitionParameters] = weakref.WeakKeyDictionary()
+_parameters_lock = threading.Lock()
+
+
+def store_parameters(series: Series, header: pydicom.Dataset) -> AcquisitionParameters:
+    """
+    Stores the parameters of `series` from the header of one of its instances, used when loading.
+    """
+    parameters = AcquisitionParameters.from_header(header)
+    with _parameters_lock:
+        _parameters[series] = parameters
+    return parameters
+
+
+def series_parameters(series: Series) -> AcquisitionParameters:
+    """
+    Returns the acquisition parameters of `series`.
+    They are read from the header of its first instance the first time, without the pixel data,
+    and then kept for as long as the series is.
+    """
+    with _parameters_lock:
+        parameters = _parameters.get(series)
+    if parameters is not None:
+        return parameters
+    header = dcmread(series.instances[0].filepath, stop_before_pixels=True)
+    return store_parameters(series, header)
+
+
+def acquisition_parameters(image: Instance) -> AcquisitionParameters:
+    """
+    Returns the acquisition parameters of the series `image` is in, see `series_parameters`.
+    """
+    return series_parameters(image.series)
@@ -0,0 +1,534 @@
+"""
+Runs the medium ACR repeat collection analysis without the user interface.
+"""
+import os
+import argparse
+import csv
+from pathlib import Path
+from collections import deque
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+
+from pydicom import dcmread
+from pydicom.errors import InvalidDicomError
+
+from pumpia.file_handling.dicom_structures import Series, Instance
+from pumpia.utilities.logging import logger
+
+from pumpia_acr_med.med_acr_module import timed_call
+from pumpia_acr_med.context_utils import (MedACRContext,
+                                          find_inserts_slice,
+                                          inserts_slice_context,
+                                          inserts_slices,
+                                          uniform_slice,
+                                          grid_slice)
+from pumpia_acr_med.lazy_series import load_series
+from pumpia_acr_med.acquisition import series_parameters
+from pumpia_acr_med.modules import (sub_snr,
+                                    uniformity,
+                                    ghosting,
+                                    phantom_width,
+                                    slice_width,
+                                    resolution)
+from pumpia_acr_med.modules.sub_snr import (snr_roi,
+                                            subtraction_snr,
+                                            snr_correction_factors,
+                                            series_corrections)
+from pumpia_acr_med.modules.uniformity import uniformity_roi, integral_uniformity
+from pumpia_acr_med.modules.ghosting import ghosting_rois, ghosting_ratio
+from pumpia_acr_med.modules.phantom_width import width_lines, phantom_widths
+from pumpia_acr_med.modules.slice_width import (slice_width_rois,
+                                                ramp_profiles,
+                                                slice_widths,
+                                                fit_options)
+from pumpia_acr_med.modules.slice_pos import wedge_rois, slice_positions
+from pumpia_acr_med.modules.resolution import (phase_direction,
+                                               resolution_rois,
+                                               resolution_contrasts,
+                                               resolution_types)
+
+NUM_SLICES = 11
+
+STUDY_COLUMNS = ["patient_id",
+                 "patient_name",
+                 "study_date",
+                 "study_description",
+                 "series1",
+                 "series2",
+                 "inserts_slice",
+                 "res_insert_side",
+                 "circle_insert_side",
+                 "rotation",
+                 "context_wall_time",
+                 "context_cpu_time"]
+
+SNR_COLUMNS = ["signal",
+               "noise",
+               "snr",
+               "im_bw",
+               "pixel_size_cor",
+               "avg_cor",
+               "pe_cor",
+               "cor_snr"]
+
+MODULE_COLUMNS: dict[str, list[str]] = {
+    "uniformity": ["uniformity"],
+    "ghosting": ["ghosting"],
+    "phantom_width": ["width_vertical",
+                      "width_up_slope",
+                      "width_horizontal",
+                      "width_down_slope",
+                      "average_width",
+                      "linearity",
+                      "distortion"],
+    "slice_width": ["expected_width",
+                    "top_ramp_width",
+                    "bottom_ramp_width",
+                    "slice_width"],
+    "slice_pos": ["slice_1_bar_diff",
+                  "slice_1_pos",
+                  "slice_11_bar_diff",
+                  "slice_11_pos"],
+    "resolution": ["phase_contrast",
+                   "freq_contrast",
+                   "total_contrast",
+                   "best_contrast"]}
+
+TIMING_COLUMNS = ["draw_rois_wall_time",
+                  "draw_rois_cpu_time",
+                  "analyse_wall_time",
+                  "analyse_cpu_time"]
+
+MODULE_NAMES = ["snr"] + [f"{module}{num}" for num in (1, 2) for module in MODULE_COLUMNS]
+
+RESULT_COLUMNS = (STUDY_COLUMNS
+                  + [f"snr.{field}" for field in SNR_COLUMNS]
+                  + [f"{module}{num}.{field}"
+                     for num in (1, 2)
+                     for module, fields in MODULE_COLUMNS.items()
+                     for field in fields]
+                  + [f"{module}.{field}"
+                     for module in MODULE_NAMES
+                     for field in TIMING_COLUMNS])
+
+
+def find_studies(folder: Path) -> dict[str, list[Path]]:
+    """
+    Finds the DICOM files in a folder tree and groups them by study.
+    Only the headers are read.
+
+    Parameters
+    ----------
+    folder : Path
+        The folder to search.
+
+    Returns
+    -------
+    dict[str, list[Path]]
+        The files for each study instance UID, in sorted path order.
+    """
+    studies: dict[str, list[Path]] = {}
+    for file in sorted(folder.rglob("*")):
+        if not file.is_file():
+            continue
+        try:
+            header = dcmread(file, stop_before_pixels=True, specific_tags=["StudyInstanceUID"])
+        except (InvalidDicomError, OSError):
+            continue
+        study_uid = header.get("StudyInstanceUID")
+        if study_uid is not None:
+            studies.setdefault(str(study_uid), []).append(file)
+    return studies
+
+
+def pair_series(series: Sequence[Series]) -> list[tuple[Series, Series | None]]:
+    """
+    Pairs each 11 slice series with its repeat.
+    Series with the same description are paired in series number order,
+    a series without a repeat is returned with None.
+    """
+    acr_series: dict[str, list[Series]] = {}
+    for s in sorted(series, key=lambda s: s.series_number):
+        if s.num_slices == NUM_SLICES:
+            acr_series.setdefault(s.series_description, []).append(s)
+
+    pairs: list[tuple[Series, Series | None]] = []
+    for same_series in acr_series.values():
+        for i in range(0, len(same_series), 2):
+            if i + 1 < len(same_series):
+                pairs.append((same_series[i], same_series[i + 1]))
+            else:
+                pairs.append((same_series[i], None))
+    return sorted(pairs, key=lambda pair: pair[0].series_number)
+
+
+def _pixel_size(image: Instance) -> tuple[float, float]:
+    pixel_size = image.pixel_spacing
+    if pixel_size is None:
+        raise ValueError(f"{image.id_string} has no pixel spacing")
+    return pixel_size[0], pixel_size[1]
+
+
+def series_context(series: Series) -> MedACRContext:
+    """
+    Finds the context of an 11 slice series with the default settings.
+    The inserts slice is found from the z profile of the series so only that slice is needed,
+    for a `LazySeries` no other slices are decoded.
+    """
+    inserts_slice = find_inserts_slice(series.z_profile)
+    inserts_image = series.instances[inserts_slice]
+    return inserts_slice_context(inserts_image.array[0], inserts_slice, _pixel_size(inserts_image))
+
+
+def _run_module(name: str,
+                draw: Callable[..., Callable[[], dict[str, float]]],
+                *args) -> dict[str, float]:
+    """
+    Draws the ROIs of a module then runs its calculation, recording the time of each.
+    Failures are logged and give no results so the rest of the study is still analysed.
+    """
+    try:
+        analysis, draw_timer = timed_call(partial(draw, *args))
+        results, analyse_timer = timed_call(analysis)
+    # pylint: disable-next=broad-exception-caught
+    except Exception:
+        logger.warning("%s failed.", name, exc_info=True)
+        return {}
+    results["draw_rois_wall_time"] = draw_timer.wall
+    results["draw_rois_cpu_time"] = draw_timer.cpu
+    results["analyse_wall_time"] = analyse_timer.wall
+    results["analyse_cpu_time"] = analyse_timer.cpu
+    return {f"{name}.{key}": value for key, value in results.items()}
+
+
+def snr_analysis(series1: Series,
+                 series2: Series,
+                 context: MedACRContext,
+                 corrections: tuple[dict[str, float], float] | None = None) -> Callable[[], dict[str, float]]:
+    """
+    Draws the ROIs of the subtraction SNR module on a series and its repeat and returns its calculation.
+    If `corrections` is None they are found from the acquisition parameters of `series1`.
+    """
+    slice_used = uniform_slice(context)
+    roi1 = snr_roi(series1.instances[slice_used], context, sub_snr.DEFAULT_SIZE)
+    image2 = series2.instances[slice_used]
+    roi2 = roi1.copy_to_image(image2, image2.current_slice, "SNR ROI", True)
+    return partial(subtraction_snr,
+                   roi1,
+                   roi2,
+                   sub_snr.DEFAULT_REF_BANDWIDTH,
+                   sub_snr.DEFAULT_CORRECTION,
+                   sub_snr.DEFAULT_CORRECTION,
+                   sub_snr.DEFAULT_CORRECTION,
+                   sub_snr.DEFAULT_CORRECTION,
+                   corrections)
+
+
+def uniformity_analysis(series: Series, context: MedACRContext) -> Callable[[], dict[str, float]]:
+    """
+    Draws the ROI of the uniformity module on a series and returns its calculation.
+    """
+    image = series.instances[uniform_slice(context)]
+    return partial(integral_uniformity,
+                   uniformity_roi(image, context, uniformity.DEFAULT_SIZE),
+                   uniformity.DEFAULT_KERNEL)
+
+
+def ghosting_analysis(series: Series, context: MedACRContext) -> Callable[[], dict[str, float]]:
+    """
+    Draws the ROIs of the ghosting module on a series and returns its calculation.
+    """
+    image = series.instances[uniform_slice(context)]
+    return partial(ghosting_ratio, *ghosting_rois(image, context, ghosting.DEFAULT_SIZE))
+
+
+def phantom_width_analysis(series: Series, context: MedACRContext) -> Callable[[], dict[str, float]]:
+    """
+    Draws the lines of the phantom width module on a series and returns its calculation.
+    """
+    image = series.instances[grid_slice(context)]
+    pixel_size = _pixel_size(image)
+    line_vertical, line_down_slope, line_horizontal, line_up_slope = width_lines(image,
+                                                                                 context,
+                                                                                 pixel_size)
+    return partial(phantom_widths,
+                   line_vertical,
+                   line_up_slope,
+                   line_horizontal,
+                   line_down_slope,
+                   pixel_size,
+                   phantom_width.DEFAULT_MAX_PERC,
+                   phantom_width.DEFAULT_INCLUDE,
+                   phantom_width.DEFAULT_INCLUDE,
+                   phantom_width.DEFAULT_INCLUDE,
+                   phantom_width.DEFAULT_INCLUDE)
+
+
+def slice_width_analysis(series: Series, context: MedACRContext) -> Callable[[], dict[str, float]]:
+    """
+    Draws the ROIs of the slice width module on a series and returns its calculation.
+    """
+    image = series.instances[inserts_slices(context)[0]]
+    pixel_size = _pixel_size(image)
+    top_roi, bottom_roi, ramp_dir = slice_width_rois(image, context, pixel_size)
+    slice_thickness = image.slice_thickness
+
+    def analysis() -> dict[str, float]:
+        results = slice_widths(*ramp_profiles(top_roi, bottom_roi, ramp_dir, pixel_size),
+                               slice_width.DEFAULT_TAN_THETA,
+                               slice_width.DEFAULT_MAX_PERC,
+                               fit_options[slice_width.DEFAULT_FIT_TYPE])
+        if slice_thickness is not None:
+            results["expected_width"] = slice_thickness
+        return results
+
+    return analysis
+
+
+def slice_pos_analysis(series: Series, context: MedACRContext) -> Callable[[], dict[str, float]]:
+    """
+    Draws the ROIs of the slice position module on a series and returns its calculation.
+    """
+    slice1, slice2 = inserts_slices(context)
+    image1 = series.instances[slice1]
+    image2 = series.instances[slice2]
+    pixel_size = _pixel_size(image1)
+    (slice_1_left,
+     slice_1_right,
+     slice_11_left,
+     slice_11_right,
+     wedge_dir,
+     wedge_side) = wedge_rois(image1, image2, context, pixel_size)
+    return partial(slice_positions,
+                   slice_1_left,
+                   slice_1_right,
+                   slice_11_left,
+                   slice_11_right,
+                   wedge_dir,
+                   wedge_side,
+                   pixel_size)
+
+
+def resolution_analysis(series: Series, context: MedACRContext) -> Callable[[], dict[str, float]]:
+    """
+    Draws the ROIs of the resolution module on a series and returns its calculation.
+    """
+    image = series.instances[inserts_slices(context)[0]]
+    pixel_size = _pixel_size(image)
+    main_roi, horizontal_line, vertical_line = resolution_rois(image, context, pixel_size)
+    phase_dir = phase_direction(image)
+
+    def analysis() -> dict[str, float]:
+        results, _ = resolution_contrasts(main_roi,
+                                          horizontal_line,
+                                          vertical_line,
+                                          pixel_size,
+                                          phase_dir,
+                                          resolution.DEFAULT_AUTO_POSITION,
+                                          resolution.DEFAULT_REFINE,
+                                          resolution.DEFAULT_PERCENTAGE,
+                                          resolution_types[resolution.DEFAULT_RESOLUTION_TYPE])
+        return results
+
+    return analysis
+
+
+SERIES_MODULES: dict[str, Callable[[Series, MedACRContext], Callable[[], dict[str, float]]]] = {
+    "uniformity": uniformity_analysis,
+    "ghosting": ghosting_analysis,
+    "phantom_width": phantom_width_analysis,
+    "slice_width": slice_width_analysis,
+    "slice_pos": slice_pos_analysis,
+    "resolution": resolution_analysis}
+
+
+def analyse_pair(series1: Series,
+                 series2: Series | None,
+                 corrections: tuple[dict[str, float], float] | None = None) -> dict[str, str | float]:
+    """
+    Runs every module of the repeat collection on a series and its repeat.
+    The context is found once from the first series and used for both, as in the collection.
+
+    Parameters
+    ----------
+    series1 : Series
+        The ACR series.
+    series2 : Series | None
+        The repeat series, if None the SNR and second image results are left out.
+    corrections : tuple[dict[str, float], float] | None, optional
+        The SNR corrections of `series1` from `series_corrections`,
+        if None they are found from its acquisition parameters (default is None).
+
+    Returns
+    -------
+    dict[str, str | float]
+        The results keyed by `RESULT_COLUMNS`.
+    """
+    study = series1.study
+    row: dict[str, str | float] = {"patient_id": study.patient.patient_id,
+                                   "patient_name": study.patient.name,
+                                   "study_date": str(study.study_datetime),
+                                   "study_description": study.study_description,
+                                   "series1": series1.series_description + f" ({series1.series_number})"}
+    if series2 is not None:
+        row["series2"] = series2.series_description + f" ({series2.series_number})"
+
+    context, context_timer = timed_call(partial(series_context, series1))
+    row["context_wall_time"] = context_timer.wall
+    row["context_cpu_time"] = context_timer.cpu
+    row["inserts_slice"] = context.inserts_slice + 1
+    row["res_insert_side"] = context.res_insert_side
+    row["circle_insert_side"] = context.circle_insert_side
+    row["rotation"] = context.rotation
+
+    images: list[tuple[int, Series]] = [(1, series1)]
+    if series2 is not None:
+        row.update(_run_module("snr", snr_analysis, series1, series2, context, corrections))
+        images.append((2, series2))
+
+    for num, series in images:
+        for name, func in SERIES_MODULES.items():
+            row.update(_run_module(f"{name}{num}", func, series, context))
+
+    return row
+
+
+def analyse_study(files: Sequence[Path]) -> list[dict[str, str | float]]:
+    """
+    Loads the files of a study and analyses each ACR series and its repeat.
+    The series are loaded with `load_series` so only the slices used are decoded,
+    and the SNR corrections of every pair are found together from the acquisition parameters stored when loading.
+
+    Parameters
+    ----------
+    files : Sequence[Path]
+        The DICOM files of the study.
+
+    Returns
+    -------
+    list[dict[str, str | float]]
+        A row of results for each pair of series, normally one per study.
+    """
+    pairs = pair_series(load_series(files))
+    factors = snr_correction_factors([series_parameters(series1) for series1, _ in pairs],
+                                     sub_snr.DEFAULT_REF_BANDWIDTH,
+                                     sub_snr.DEFAULT_CORRECTION,
+                                     sub_snr.DEFAULT_CORRECTION,
+                                     sub_snr.DEFAULT_CORRECTION,
+                                     sub_snr.DEFAULT_CORRECTION)
+
+    rows: list[dict[str, str | float]] = []
+    for index, (series1, series2) in enumerate(pairs):
+        try:
+            rows.append(analyse_pair(series1, series2, series_corrections(factors, index)))
+        # pylint: disable-next=broad-exception-caught
+        except Exception:
+            logger.warning("%s failed.", series1.id_string, exc_info=True)
+    return rows
+
+
+def _study_rows(study_uid: str, result: Future[list[dict[str, str | float]]]) -> list[dict[str, str | float]]:
+    """
+    Gets the rows from a worker, a failed study is logged and gives no rows.
+    """
+    try:
+        return result.result()
+    # pylint: disable-next=broad-exception-caught
+    except Exception:
+        logger.warning("Study %s failed.", study_uid, exc_info=True)
+        return []
+
+
+def analyse_studies(studies: dict[str, list[Path]],
+                    workers: int | None = None) -> Iterator[tuple[str, list[dict[str, str | float]]]]:
+    """
+    Analyses studies across a pool of worker processes.
+    Each worker loads and analyses one study at a time,
+    results are yielded as they finish in the order of `studies`.
+
+    Parameters
+    ----------
+    studies : dict[str, list[Path]]
+        The files for each study, as returned by `find_studies`.
+    workers : int | None, optional
+        The number of worker processes, if None the number of CPUs is used (default is None).
+        If 1 the studies are analysed in this process.
+
+    Yields
+    ------
+    tuple[str, list[dict[str, str | float]]]
+        The study instance UID and its rows, a failed study gives no rows.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers == 1:
+        for study_uid, files in studies.items():
+            try:
+                rows = analyse_study(files)
+            # pylint: disable-next=broad-exception-caught
+            except Exception:
+                logger.warning("Study %s failed.", study_uid, exc_info=True)
+                rows = []
+            yield study_uid, rows
+        return
+
+    # limit the studies queued so results are written as they finish
+    max_pending = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: deque[tuple[str, Future[list[dict[str, str | float]]]]] = deque()
+        for study_uid, files in studies.items():
+            pending.append((study_uid, executor.submit(analyse_study, files)))
+            if len(pending) >= max_pending:
+                study_uid, result = pending.popleft()
+                yield study_uid, _study_rows(study_uid, result)
+        while pending:
+            study_uid, result = pending.popleft()
+            yield study_uid, _study_rows(study_uid, result)
+
+
+def run_batch(folder: Path, output: Path, workers: int | None = None) -> int:
+    """
+    Analyses every study in a folder tree and writes the results to a CSV file.
+
+    Parameters
+    ----------
+    folder : Path
+        The folder containing the DICOM files.
+    output : Path
+        The CSV file to write.
+    workers : int | None, optional
+        The number of worker processes, if None the number of CPUs is used (default is None).
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+    studies = find_studies(folder)
+    count = 0
+    with open(output, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.DictWriter(csv_file, RESULT_COLUMNS, restval="")
+        writer.writeheader()
+        for study_uid, rows in analyse_studies(studies, workers):
+            logger.info("Analysed study %s", study_uid)
+            writer.writerows(rows)
+            csv_file.flush()
+            count += len(rows)
+    return count
+
+
+def main(argv: Sequence[str] | None = None):
+    """
+    Command line entry point for the batch analysis.
+    """
+    parser = argparse.ArgumentParser(description="Analyse medium ACR series and their repeats without the user interface.")
+    parser.add_argument("folder", type=Path, help="folder containing the DICOM files, searched recursively")
+    parser.add_argument("output", type=Path, help="CSV file to write the results to")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes, defaults to the number of CPUs")
+    args = parser.parse_args(argv)
+
+    count = run_batch(args.folder, args.output, args.workers)
+    print(f"{count} rows written to {args.output}")
@@ -0,0 +1,266 @@
+"""
+Benchmarks finding the context and each module on synthetic medium ACR series.
+
+The stages are the calculations used by the modules and the batch analysis,
+so they can be ran without the user interface.
+Drawing the ROIs and analysing are timed separately for each module,
+the throughput is from analysing a whole study including loading it from disk.
+"""
+import sys
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import tracemalloc
+from collections.abc import Callable, Sequence
+from functools import partial
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from pumpia_acr_med.med_acr_module import timed_call
+from pumpia_acr_med.context_utils import MedACRContext
+from pumpia_acr_med.lazy_series import load_series
+from pumpia_acr_med.batch import (SERIES_MODULES,
+                                  find_studies,
+                                  pair_series,
+                                  analyse_study,
+                                  series_context,
+                                  snr_analysis)
+from pumpia_acr_med.synthetic import generate_study
+
+BENCHMARK_MATRICES = (256, 512, 1024)
+DEFAULT_REPEATS = 5
+# percentage a result can be worse than the baseline before it is a regression
+DEFAULT_TOLERANCE = 20
+# differences smaller than these are ignored as noise
+MIN_LATENCY_DIFFERENCE = 0.001
+MIN_MEMORY_DIFFERENCE = 1024 ** 2
+
+
+def _peak_memory(func: Callable[[], Any]) -> tuple[Any, int]:
+    """
+    Calls `func` and returns its result with the peak memory in bytes allocated while it ran.
+    tracemalloc must be tracing.
+    """
+    start = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    result = func()
+    return result, tracemalloc.get_traced_memory()[1] - start
+
+
+def _stage_result(latencies: list[float], peak_memory: int) -> dict[str, float]:
+    return {"median_latency": statistics.median(latencies),
+            "min_latency": min(latencies),
+            "peak_memory": peak_memory}
+
+
+def benchmark_stages(files: Sequence[Path], repeats: int = DEFAULT_REPEATS) -> dict[str, dict[str, float]]:
+    """
+    Benchmarks finding the context, and drawing the ROIs and analysing each module, on a study.
+
+    Each stage is ran once while tracing memory, which also loads any cached data,
+    then `repeats` times for the latencies.
+    The modules of the repeat image are not benchmarked as they are the same as the first.
+
+    Parameters
+    ----------
+    files : Sequence[Path]
+        The DICOM files of a study with an ACR series and its repeat.
+    repeats : int, optional
+        (default is DEFAULT_REPEATS)
+
+    Returns
+    -------
+    dict[str, dict[str, float]]
+        The median and minimum latency in seconds and the peak memory in bytes of each stage,
+        keyed by "context" and "<module>.draw_rois" or "<module>.analyse".
+    """
+    series1, series2 = pair_series(load_series(files))[0]
+    if series2 is None:
+        raise ValueError("Benchmark study has no repeat series")
+    find_context = partial(series_context, series1)
+
+    modules: dict[str, Callable[[MedACRContext], Callable[[], Any]]] = {
+        "snr": partial(snr_analysis, series1, series2)}
+    for name, draw in SERIES_MODULES.items():
+        modules[name] = partial(draw, series1)
+
+    stages: dict[str, dict[str, float]] = {}
+    tracemalloc.start()
+    try:
+        context, context_memory = _peak_memory(find_context)
+        memory: dict[str, int] = {}
+        for name, draw in modules.items():
+            analysis, memory[f"{name}.draw_rois"] = _peak_memory(partial(draw, context))
+            _, memory[f"{name}.analyse"] = _peak_memory(analysis)
+    finally:
+        tracemalloc.stop()
+
+    stages["context"] = _stage_result([timed_call(find_context)[1].wall for _ in range(repeats)],
+                                      context_memory)
+    for name, draw in modules.items():
+        draw_latencies: list[float] = []
+        analyse_latencies: list[float] = []
+        for _ in range(repeats):
+            analysis, draw_timer = timed_call(partial(draw, context))
+            _, analyse_timer = timed_call(analysis)
+            draw_latencies.append(draw_timer.wall)
+            analyse_latencies.append(analyse_timer.wall)
+        stages[f"{name}.draw_rois"] = _stage_result(draw_latencies, memory[f"{name}.draw_rois"])
+        stages[f"{name}.analyse"] = _stage_result(analyse_latencies, memory[f"{name}.analyse"])
+    return stages
+
+
+def benchmark_study(files: Sequence[Path], repeats: int = DEFAULT_REPEATS) -> dict[str, float]:
+    """
+    Benchmarks loading and analysing a whole study as in the batch analysis.
+
+    Returns
+    -------
+    dict[str, float]
+        The median latency in seconds and the throughput in studies per minute of a single process.
+    """
+    latencies = [timed_call(partial(analyse_study, files))[1].wall for _ in range(repeats)]
+    median = statistics.median(latencies)
+    return {"median_latency": median,
+            "min_latency": min(latencies),
+            "studies_per_minute": 60 / median}
+
+
+def run_benchmark(matrices: Sequence[int] = BENCHMARK_MATRICES,
+                  repeats: int = DEFAULT_REPEATS,
+                  seed: int = 0) -> dict[str, Any]:
+    """
+    Generates a synthetic study for each matrix size and benchmarks it.
+
+    Parameters
+    ----------
+    matrices : Sequence[int], optional
+        The matrix sizes (default is BENCHMARK_MATRICES).
+    repeats : int, optional
+        The number of times each stage is timed (default is DEFAULT_REPEATS).
+    seed : int, optional
+        The seed for the noise of the synthetic studies (default is 0).
+
+    Returns
+    -------
+    dict[str, Any]
+        The environment and the results for each matrix size, keyed by the matrix size as a string.
+    """
+    results: dict[str, Any] = {"python": platform.python_version(),
+                               "numpy": np.__version__,
+                               "platform": platform.platform(),
+                               "cpu_count": os.cpu_count(),
+                               "repeats": repeats,
+                               "matrices": {}}
+    with tempfile.TemporaryDirectory() as folder:
+        for matrix in matrices:
+            study_folder = Path(folder) / str(matrix)
+            generate_study(study_folder, matrix=matrix, seed=seed)
+            files = next(iter(find_studies(study_folder).values()))
+            results["matrices"][str(matrix)] = {"stages": benchmark_stages(files, repeats),
+                                                "study": benchmark_study(files, repeats)}
+    return results
+
+
+def _worse(current: float, baseline: float, tolerance: float, min_difference: float) -> bool:
+    return (current > baseline * (1 + tolerance / 100)
+            and current - baseline > min_difference)
+
+
+def compare_results(results: dict[str, Any],
+                    baseline: dict[str, Any],
+                    tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    """
+    Compares benchmark results against a baseline from `run_benchmark`.
+    Only the matrix sizes and stages in both are compared.
+
+    Parameters
+    ----------
+    results : dict[str, Any]
+    baseline : dict[str, Any]
+    tolerance : float, optional
+        The percentage a result can be worse than the baseline (default is DEFAULT_TOLERANCE).
+
+    Returns
+    -------
+    list[str]
+        A description of each regression, empty if there are none.
+    """
+    regressions: list[str] = []
+    for matrix, baseline_matrix in baseline["matrices"].items():
+        if matrix not in results["matrices"]:
+            continue
+        current_matrix = results["matrices"][matrix]
+
+        for stage, baseline_stage in baseline_matrix["stages"].items():
+            current_stage = current_matrix["stages"].get(stage)
+            if current_stage is None:
+                continue
+            if _worse(current_stage["median_latency"],
+                      baseline_stage["median_latency"],
+                      tolerance,
+                      MIN_LATENCY_DIFFERENCE):
+                regressions.append(f"{matrix}: {stage} median latency "
+                                   f"{current_stage['median_latency']:.4f}s "
+                                   f"(baseline {baseline_stage['median_latency']:.4f}s)")
+            if _worse(current_stage["peak_memory"],
+                      baseline_stage["peak_memory"],
+                      tolerance,
+                      MIN_MEMORY_DIFFERENCE):
+                regressions.append(f"{matrix}: {stage} peak memory "
+                                   f"{current_stage['peak_memory'] / 1024 ** 2:.1f}MiB "
+                                   f"(baseline {baseline_stage['peak_memory'] / 1024 ** 2:.1f}MiB)")
+
+        current_throughput = current_matrix["study"]["studies_per_minute"]
+        baseline_throughput = baseline_matrix["study"]["studies_per_minute"]
+        if current_throughput * (1 + tolerance / 100) < baseline_throughput:
+            regressions.append(f"{matrix}: throughput {current_throughput:.1f} studies/min "
+                               f"(baseline {baseline_throughput:.1f} studies/min)")
+    return regressions
+
+
+def main(argv: Sequence[str] | None = None):
+    """
+    Command line entry point for the benchmark.
+    Exits with status 1 if there are regressions against the baseline.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the medium ACR analysis on synthetic series.")
+    parser.add_argument("-o", "--output", type=Path, default=None,
+                        help="JSON file to write the results to, printed if not given")
+    parser.add_argument("-b", "--baseline", type=Path, default=None,
+                        help="JSON file of previous results to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results to the baseline file instead of comparing")
+    parser.add_argument("-m", "--matrices", type=int, nargs="+", default=list(BENCHMARK_MATRICES))
+    parser.add_argument("-r", "--repeats", type=int, default=DEFAULT_REPEATS,
+                        help="number of times each stage is timed")
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="percentage worse than the baseline allowed")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.matrices, args.repeats)
+    text = json.dumps(results, indent=4)
+    if args.output is None:
+        print(text)
+    else:
+        args.output.write_text(text, encoding="utf-8")
+
+    if args.baseline is None:
+        return
+    if args.save_baseline:
+        args.baseline.write_text(text, encoding="utf-8")
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    regressions = compare_results(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"Regression {regression}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline", file=sys.stderr)
@@ -0,0 +1,658 @@
+"""
+Functions for finding the context of the medium ACR phantom without the GUI.
+"""
+
+from typing import Literal
+
+import numpy as np
+
+from pumpia.module_handling.context import PhantomContext, PhantomShapes
+from pumpia.utilities.typing import SideType
+from pumpia.utilities.feature_utils import phantom_boundary_automatic, phantom_boundbox_manual
+
+# offsets in mm (dicom standard units)
+FOUR_BOX_OFFSET = 17
+FOUR_BOX_SL = 10
+FIVE_BOX_OFFSET = 28
+FIVE_BOX_SL = 5
+# rotation search in degrees
+ROTATION_STEP = 1
+MAX_ROTATION = 45
+
+# the box opposite the resolution insert, in the order of the four cardinal boxes
+res_insert_opp_sides: list[SideType] = ["bottom", "top", "right", "left"]
+# direction in degrees anticlockwise from the right, in the order of the four cardinal boxes
+box_directions: list[float] = [90, 270, 180, 0]
+
+
+class MedACRContext(PhantomContext):
+    """
+    Context for Medium ACR Phantom.
+    """
+
+    def __init__(self,
+                 xmin: int,
+                 xmax: int,
+                 ymin: int,
+                 ymax: int,
+                 inserts_slice: Literal[0] | Literal[10] = 0,
+                 res_insert_side: SideType = "bottom",
+                 circle_insert_side: SideType = "left",
+                 rotation: float = 0):
+        super().__init__(xmin, xmax, ymin, ymax, 'ellipse')
+
+        if ((res_insert_side in ["top", "bottom"]
+             and circle_insert_side in ["top", "bottom"])
+            or (res_insert_side in ["left", "right"]
+                and circle_insert_side in ["left", "right"])):
+            raise ValueError("resolution/circle insert sides must not be on the same axis")
+
+        self.res_insert_side: SideType = res_insert_side
+        self.circle_insert_side: SideType = circle_insert_side
+        self.inserts_slice: Literal[0] | Literal[10] = inserts_slice
+        # anticlockwise rotation in degrees of the phantom from the orientation given by the insert sides
+        self.rotation: float = rotation
+
+
+def summed_area_table(array: np.ndarray[tuple[int, int], np.dtype]) -> np.ndarray[tuple[int, int], np.dtype]:
+    """
+    Returns the summed area table of `array` padded with a row and column of zeros,
+    so that `table[y, x]` is the sum of `array[:y, :x]`.
+    """
+    table = np.zeros((array.shape[0] + 1, array.shape[1] + 1))
+    np.cumsum(np.cumsum(array, axis=0, dtype=float), axis=1, out=table[1:, 1:])
+    return table
+
+
+def window_sums(array: np.ndarray[tuple[int, int], np.dtype],
+                window: tuple[int, int]) -> np.ndarray[tuple[int, int], np.dtype]:
+    """
+    Returns the sum of `array` in a window centred on each pixel.
+    The sums are found from the summed area table so the time taken does not depend on the window size.
+    Windows are cut off at the edges of the array.
+
+    Parameters
+    ----------
+    array : np.ndarray[tuple[int, int], np.dtype]
+    window : tuple[int, int]
+        The height and width of the window, odd sizes are centred exactly.
+
+    Returns
+    -------
+    np.ndarray[tuple[int, int], np.dtype]
+        The sums, the same shape as `array`.
+    """
+    table = summed_area_table(array)
+    height, width = array.shape
+    rows = np.arange(height)
+    columns = np.arange(width)
+    ymin = np.clip(rows - window[0] // 2, 0, height)
+    ymax = np.clip(rows - window[0] // 2 + window[0], 0, height)
+    xmin = np.clip(columns - window[1] // 2, 0, width)
+    xmax = np.clip(columns - window[1] // 2 + window[1], 0, width)
+    return (table[np.ix_(ymax, xmax)]
+            - table[np.ix_(ymin, xmax)]
+            - table[np.ix_(ymax, xmin)]
+            + table[np.ix_(ymin, xmin)])
+
+
+def box_mean(table: np.ndarray[tuple[int, int], np.dtype],
+             xmin: float | np.ndarray,
+             xmax: float | np.ndarray,
+             ymin: float | np.ndarray,
+             ymax: float | np.ndarray) -> float | np.ndarray:
+    """
+    Returns the mean of `array[ymin:ymax, xmin:xmax]` using the summed area table of the array.
+
+    Non-integer bounds are allowed, the table is interpolated bilinearly
+    which is equivelant to including the fraction of each edge pixel inside the box.
+    Boxes are clipped to the array and can be given as arrays to find many means at once.
+
+    Parameters
+    ----------
+    table : np.ndarray
+        The summed area table from `summed_area_table`.
+    xmin : float | np.ndarray
+    xmax : float | np.ndarray
+    ymin : float | np.ndarray
+    ymax : float | np.ndarray
+
+    Returns
+    -------
+    float | np.ndarray
+        The mean of each box.
+    """
+    xmin = np.clip(xmin, 0, table.shape[1] - 1)
+    xmax = np.clip(xmax, 0, table.shape[1] - 1)
+    ymin = np.clip(ymin, 0, table.shape[0] - 1)
+    ymax = np.clip(ymax, 0, table.shape[0] - 1)
+    total = (_table_value(table, xmax, ymax)
+             - _table_value(table, xmax, ymin)
+             - _table_value(table, xmin, ymax)
+             + _table_value(table, xmin, ymin))
+    return total / ((xmax - xmin) * (ymax - ymin))
+
+
+def _table_value(table: np.ndarray[tuple[int, int], np.dtype],
+                 x: float | np.ndarray,
+                 y: float | np.ndarray) -> float | np.ndarray:
+    """
+    Bilinear interpolation of the summed area table at (x, y), these must be within the table.
+    """
+    x0 = np.minimum(np.floor(x).astype(int), table.shape[1] - 2)
+    y0 = np.minimum(np.floor(y).astype(int), table.shape[0] - 2)
+    x_frac = x - x0
+    y_frac = y - y0
+    return ((1 - y_frac) * ((1 - x_frac) * table[y0, x0] + x_frac * table[y0, x0 + 1])
+            + y_frac * ((1 - x_frac) * table[y0 + 1, x0] + x_frac * table[y0 + 1, x0 + 1]))
+
+
+def ring_means(table: np.ndarray[tuple[int, int], np.dtype],
+               xcent: float,
+               ycent: float,
+               pixel_size: tuple[float, float],
+               direction: float = 0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the mean of a box moved around the centre of the phantom every ROTATION_STEP degrees.
+    The box is the size and distance of the boxes used to find the resolution insert.
+
+    Parameters
+    ----------
+    table : np.ndarray
+        The summed area table of the inserts slice.
+    xcent : float
+        The x position of the centre of the phantom.
+    ycent : float
+        The y position of the centre of the phantom.
+    pixel_size : tuple[float, float]
+        The (row, column) pixel size.
+    direction : float, optional
+        The direction in degrees anticlockwise from the right the rotations are relative to (default is 0).
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The rotations from `direction` in degrees, from -180 to 180, and the box mean at each.
+    """
+    pixel_height, pixel_width = pixel_size
+    rotations = np.arange(-180, 180, ROTATION_STEP)
+    radians = np.radians(direction + rotations)
+
+    distance = FOUR_BOX_OFFSET + FOUR_BOX_SL / 2
+    # pixel centres are at +0.5 in the summed area table
+    box_xcent = xcent + 0.5 + distance * np.cos(radians) / pixel_width
+    box_ycent = ycent + 0.5 - distance * np.sin(radians) / pixel_height
+    half_width = FOUR_BOX_SL / (2 * pixel_width)
+    half_height = FOUR_BOX_SL / (2 * pixel_height)
+
+    means = box_mean(table,
+                     box_xcent - half_width,
+                     box_xcent + half_width,
+                     box_ycent - half_height,
+                     box_ycent + half_height)
+    return rotations, np.asarray(means)
+
+
+def phantom_rotation(table: np.ndarray[tuple[int, int], np.dtype],
+                     xcent: float,
+                     ycent: float,
+                     pixel_size: tuple[float, float],
+                     direction: float) -> float:
+    """
+    Finds the rotation of the phantom from the mean of a box moved around the centre of the phantom,
+    see `ring_means`.
+
+    The rotation is the centre of the arc of box means above half maximum that contains `direction`,
+    limited to MAX_ROTATION degrees.
+
+    Parameters
+    ----------
+    table : np.ndarray
+        The summed area table of the inserts slice.
+    xcent : float
+        The x position of the centre of the phantom.
+    ycent : float
+        The y position of the centre of the phantom.
+    pixel_size : tuple[float, float]
+        The (row, column) pixel size.
+    direction : float
+        The direction in degrees anticlockwise from the right of the box opposite the resolution insert.
+
+    Returns
+    -------
+    float
+        The anticlockwise rotation in degrees from `direction`.
+    """
+    rotations, means = ring_means(table, xcent, ycent, pixel_size, direction)
+    half_maximum = (np.max(means) + np.min(means)) / 2
+    centre = int(np.argmin(np.abs(rotations)))
+    if means[centre] < half_maximum:
+        return 0
+
+    # walk out from direction to the half maximum crossings, interpolating between steps
+    num = rotations.shape[0]
+    upper = 0
+    while upper < num and means[(centre + upper + 1) % num] >= half_maximum:
+        upper += 1
+    lower = 0
+    while lower < num and means[(centre - lower - 1) % num] >= half_maximum:
+        lower += 1
+    if upper >= num:
+        return 0
+
+    upper_in = means[(centre + upper) % num]
+    upper_out = means[(centre + upper + 1) % num]
+    lower_in = means[(centre - lower) % num]
+    lower_out = means[(centre - lower - 1) % num]
+    upper_edge = upper + (upper_in - half_maximum) / (upper_in - upper_out)
+    lower_edge = lower + (lower_in - half_maximum) / (lower_in - lower_out)
+
+    rotation = ROTATION_STEP * (upper_edge - lower_edge) / 2
+    return float(np.clip(rotation, -MAX_ROTATION, MAX_ROTATION))
+
+
+def _angle_difference(angle1: float, angle2: float) -> float:
+    """
+    Returns `angle1` - `angle2` in degrees wrapped to [-180, 180).
+    """
+    return (angle1 - angle2 + 180) % 360 - 180
+
+
+def find_inserts_slice(z_profile: np.ndarray[tuple[int], np.dtype]) -> Literal[0] | Literal[10]:
+    """
+    Returns the index of the slice containing the inserts from the z profile of the 11 slice series.
+
+    Slice 5 is the darkest slice when the inserts are on the first slice.
+    """
+    if np.argmin(z_profile) == 4:
+        return 0
+    return 10
+
+
+def inserts_slices(context: MedACRContext) -> tuple[int, int]:
+    """
+    Returns the indexes of the slice containing the inserts and the slice at the other end of the phantom,
+    used for slice width, slice position and resolution.
+    """
+    if context.inserts_slice == 10:
+        return 10, 0
+    return 0, 10
+
+
+def uniform_slice(context: MedACRContext) -> Literal[4] | Literal[6]:
+    """
+    Returns the index of the uniform slice used for SNR, uniformity and ghosting.
+    """
+    if context.inserts_slice == 10:
+        return 4
+    return 6
+
+
+def grid_slice(context: MedACRContext) -> Literal[4] | Literal[6]:
+    """
+    Returns the index of the grid slice used for phantom width.
+    """
+    if context.inserts_slice == 10:
+        return 6
+    return 4
+
+
+def find_boundary(array: np.ndarray[tuple[int, int], np.dtype],
+                  mode: Literal["auto", "manual"] = "auto",
+                  sensitivity: float = 3,
+                  top_perc: float = 95,
+                  iterations: int = 2,
+                  cull_perc: float = 80,
+                  bubble_offset: int = 0,
+                  bubble_side: SideType = "top",
+                  shape: PhantomShapes = "ellipse") -> PhantomContext:
+    """
+    Finds the boundary of the phantom on a 2D array,
+    equivelant to the "auto" and "manual" modes of `AutoPhantomManager`.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        The slice to find the boundary on.
+    mode : Literal["auto", "manual"], optional
+        Use `phantom_boundary_automatic` or `phantom_boundbox_manual` (default is "auto").
+    sensitivity : float, optional
+        (default is 3)
+    top_perc : float, optional
+        (default is 95)
+    iterations : int, optional
+        Only used in auto mode (default is 2).
+    cull_perc : float, optional
+        Only used in auto mode (default is 80).
+    bubble_offset : int, optional
+        Only used in manual mode (default is 0).
+    bubble_side : SideType, optional
+        Only used in manual mode (default is "top").
+    shape : PhantomShapes, optional
+        The shapes to fit in auto mode, None for any (default is "ellipse").
+
+    Returns
+    -------
+    PhantomContext
+    """
+    if mode == "manual":
+        bounds = phantom_boundbox_manual(array,
+                                         sensitivity,
+                                         top_perc,
+                                         bubble_offset,
+                                         bubble_side)
+        return PhantomContext(bounds.xmin,
+                              bounds.xmax,
+                              bounds.ymin,
+                              bounds.ymax,
+                              "ellipse")
+
+    return phantom_boundary_automatic(array,
+                                      sensitivity,
+                                      top_perc,
+                                      iterations,
+                                      cull_perc,
+                                      shape)
+
+
+def insert_boxes(xcent: float,
+                 ycent: float,
+                 pixel_size: tuple[float, float],
+                 res_insert_side: SideType | None = None,
+                 rotation: float = 0) -> dict[str, tuple[int, int, int, int]]:
+    """
+    Returns the boxes used to find the inserts as (xmin, xmax, ymin, ymax) with exclusive maximums.
+
+    The four boxes "Top", "Bottom", "Left" and "Right" are around the centre of the phantom.
+    If `res_insert_side` is given the two boxes "Diagonal 1" and "Diagonal 2"
+    are on the side opposite the resolution insert, used to find the circle insert.
+    The boxes are moved around the centre by `rotation`, they are not rotated themselves.
+
+    Parameters
+    ----------
+    xcent : float
+        The x position of the centre of the phantom.
+    ycent : float
+        The y position of the centre of the phantom.
+    pixel_size : tuple[float, float]
+        The (row, column) pixel size.
+    res_insert_side : SideType | None, optional
+        The side of the resolution insert (default is None).
+    rotation : float, optional
+        The anticlockwise rotation in degrees of the phantom (default is 0).
+
+    Returns
+    -------
+    dict[str, tuple[int, int, int, int]]
+    """
+    pixel_height, pixel_width = pixel_size
+
+    four_box_offset_x = FOUR_BOX_OFFSET / pixel_width
+    four_box_offset_y = FOUR_BOX_OFFSET / pixel_height
+
+    four_box_width = FOUR_BOX_SL / pixel_width
+    four_box_height = FOUR_BOX_SL / pixel_height
+
+    boxes = {"Top": (round(xcent - four_box_width / 2),
+                     round(xcent + four_box_width / 2) + 1,
+                     round(ycent - four_box_offset_y - four_box_height),
+                     round(ycent - four_box_offset_y) + 1),
+             "Bottom": (round(xcent - four_box_width / 2),
+                        round(xcent + four_box_width / 2) + 1,
+                        round(ycent + four_box_offset_y),
+                        round(ycent + four_box_offset_y + four_box_height) + 1),
+             "Left": (round(xcent - four_box_offset_x - four_box_width),
+                      round(xcent - four_box_offset_x) + 1,
+                      round(ycent - four_box_height / 2),
+                      round(ycent + four_box_height / 2) + 1),
+             "Right": (round(xcent + four_box_offset_x),
+                       round(xcent + four_box_offset_x + four_box_width) + 1,
+                       round(ycent - four_box_height / 2),
+                       round(ycent + four_box_height / 2) + 1)}
+
+    if res_insert_side is None:
+        return _rotate_boxes(boxes, xcent, ycent, pixel_size, rotation)
+
+    five_box_offset_x = FIVE_BOX_OFFSET / pixel_width
+    five_box_offset_y = FIVE_BOX_OFFSET / pixel_height
+
+    five_box_width = FIVE_BOX_SL / pixel_width
+    five_box_height = FIVE_BOX_SL / pixel_height
+
+    if res_insert_side in ["top", "bottom"]:
+        five_box_xmin = round(xcent - five_box_offset_x - five_box_width)
+        five_box_xmax = round(xcent - five_box_offset_x) + 1
+        six_box_xmin = round(xcent + five_box_offset_x)
+        six_box_xmax = round(xcent + five_box_offset_x + five_box_width) + 1
+
+        if res_insert_side == "bottom":
+            five_box_ymin = six_box_ymin = round(ycent - five_box_offset_y - five_box_height)
+            five_box_ymax = six_box_ymax = round(ycent - five_box_offset_y) + 1
+        else:
+            five_box_ymin = six_box_ymin = round(ycent + five_box_offset_y)
+            five_box_ymax = six_box_ymax = round(ycent + five_box_offset_y
+                                                 + five_box_height) + 1
+    else:
+        five_box_ymin = round(ycent - five_box_offset_y - five_box_height)
+        five_box_ymax = round(ycent - five_box_offset_y) + 1
+        six_box_ymin = round(ycent + five_box_offset_y)
+        six_box_ymax = round(ycent + five_box_offset_y + five_box_height) + 1
+
+        if res_insert_side == "right":
+            five_box_xmin = six_box_xmin = round(xcent - five_box_offset_x - five_box_width)
+            five_box_xmax = six_box_xmax = round(xcent - five_box_offset_x) + 1
+        else:
+            five_box_xmin = six_box_xmin = round(xcent + five_box_offset_x)
+            five_box_xmax = six_box_xmax = round(xcent + five_box_offset_x + five_box_width) + 1
+
+    boxes["Diagonal 1"] = (five_box_xmin, five_box_xmax, five_box_ymin, five_box_ymax)
+    boxes["Diagonal 2"] = (six_box_xmin, six_box_xmax, six_box_ymin, six_box_ymax)
+    return _rotate_boxes(boxes, xcent, ycent, pixel_size, rotation)
+
+
+def _rotate_boxes(boxes: dict[str, tuple[int, int, int, int]],
+                  xcent: float,
+                  ycent: float,
+                  pixel_size: tuple[float, float],
+                  rotation: float) -> dict[str, tuple[int, int, int, int]]:
+    """
+    Moves the centre of each box anticlockwise around (xcent, ycent) by `rotation` degrees.
+    """
+    if rotation == 0:
+        return boxes
+    pixel_height, pixel_width = pixel_size
+    cos = np.cos(np.radians(rotation))
+    sin = np.sin(np.radians(rotation))
+    rotated: dict[str, tuple[int, int, int, int]] = {}
+    for name, (xmin, xmax, ymin, ymax) in boxes.items():
+        # offsets in mm, y is down so the signs are swapped from the usual matrix
+        x_offset = ((xmin + xmax - 1) / 2 - xcent) * pixel_width
+        y_offset = ((ymin + ymax - 1) / 2 - ycent) * pixel_height
+        x_shift = round((x_offset * cos + y_offset * sin - x_offset) / pixel_width)
+        y_shift = round((y_offset * cos - x_offset * sin - y_offset) / pixel_height)
+        rotated[name] = (xmin + x_shift, xmax + x_shift, ymin + y_shift, ymax + y_shift)
+    return rotated
+
+
+def find_inserts(array: np.ndarray[tuple[int, int], np.dtype],
+                 xcent: float,
+                 ycent: float,
+                 pixel_size: tuple[float, float]) -> tuple[SideType, SideType, float]:
+    """
+    Finds the sides of the resolution and circle inserts and the rotation of the phantom
+    from the inserts slice.
+
+    A box is moved around the centre of the phantom, see `ring_means`,
+    the centre of the bright arc around its brightest position is opposite the resolution insert.
+    The resolution insert side is the side nearest the opposite of this direction
+    and the rotation is the angle between them.
+    The two diagonal boxes are then moved around the centre by the rotation,
+    the darker of the two is on the side of the circle insert.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        The inserts slice.
+    xcent : float
+        The x position of the centre of the phantom.
+    ycent : float
+        The y position of the centre of the phantom.
+    pixel_size : tuple[float, float]
+        The (row, column) pixel size.
+
+    Returns
+    -------
+    tuple[SideType, SideType, float]
+        The resolution insert side, circle insert side and anticlockwise rotation in degrees.
+    """
+    inserts_table = summed_area_table(array)
+
+    rotations, means = ring_means(inserts_table, xcent, ycent, pixel_size)
+    brightest = float(rotations[np.argmax(means)])
+    res_insert_opp_direction = brightest + phantom_rotation(inserts_table,
+                                                            xcent,
+                                                            ycent,
+                                                            pixel_size,
+                                                            brightest)
+    differences = [_angle_difference(res_insert_opp_direction, direction) for direction in box_directions]
+    res_insert_opp = int(np.argmin(np.abs(differences)))
+    res_insert_side = res_insert_opp_sides[res_insert_opp]
+    rotation = float(np.clip(differences[res_insert_opp], -MAX_ROTATION, MAX_ROTATION))
+
+    boxes = insert_boxes(xcent, ycent, pixel_size, res_insert_side, rotation)
+    five_box_mean = box_mean(inserts_table, *boxes["Diagonal 1"])
+    six_box_mean = box_mean(inserts_table, *boxes["Diagonal 2"])
+
+    circle_insert_side: SideType
+    if res_insert_side in ["top", "bottom"]:
+        if five_box_mean > six_box_mean:
+            circle_insert_side = "right"
+        else:
+            circle_insert_side = "left"
+    else:
+        if five_box_mean > six_box_mean:
+            circle_insert_side = "bottom"
+        else:
+            circle_insert_side = "top"
+
+    return res_insert_side, circle_insert_side, rotation
+
+
+def inserts_slice_context(inserts_array: np.ndarray[tuple[int, int], np.dtype],
+                          inserts_slice: Literal[0] | Literal[10],
+                          pixel_size: tuple[float, float],
+                          mode: Literal["auto", "manual"] = "auto",
+                          sensitivity: float = 3,
+                          top_perc: float = 95,
+                          iterations: int = 2,
+                          cull_perc: float = 80,
+                          bubble_offset: int = 0,
+                          bubble_side: SideType = "top",
+                          shape: PhantomShapes = "ellipse") -> MedACRContext:
+    """
+    Finds the context of a medium ACR series from the slice containing the inserts,
+    see `medium_acr_context` for the parameters.
+    Only this slice is needed once the inserts slice is known, e.g. from `find_inserts_slice`.
+
+    Parameters
+    ----------
+    inserts_array : np.ndarray
+        The slice containing the inserts.
+    inserts_slice : Literal[0] | Literal[10]
+        The index of the slice containing the inserts.
+
+    Returns
+    -------
+    MedACRContext
+    """
+    boundary = find_boundary(inserts_array,
+                             mode,
+                             sensitivity,
+                             top_perc,
+                             iterations,
+                             cull_perc,
+                             bubble_offset,
+                             bubble_side,
+                             shape)
+    res_insert_side, circle_insert_side, rotation = find_inserts(inserts_array,
+                                                                 boundary.xcent,
+                                                                 boundary.ycent,
+                                                                 pixel_size)
+
+    return MedACRContext(boundary.xmin,
+                         boundary.xmax,
+                         boundary.ymin,
+                         boundary.ymax,
+                         inserts_slice,
+                         res_insert_side,
+                         circle_insert_side,
+                         rotation)
+
+
+def medium_acr_context(volume: np.ndarray[tuple[int, int, int], np.dtype],
+                       pixel_size: tuple[float, float],
+                       mode: Literal["auto", "manual"] = "auto",
+                       sensitivity: float = 3,
+                       top_perc: float = 95,
+                       iterations: int = 2,
+                       cull_perc: float = 80,
+                       bubble_offset: int = 0,
+                       bubble_side: SideType = "top",
+                       shape: PhantomShapes = "ellipse") -> MedACRContext:
+    """
+    Finds the context of an 11 slice medium ACR series.
+
+    This is the calculation used by `MedACRContextManager` in the "auto" and "manual" modes,
+    it does not need the GUI so can be used from scripts and worker processes.
+
+    Parameters
+    ----------
+    volume : np.ndarray
+        The series pixel array with shape (slices, rows, columns).
+    pixel_size : tuple[float, float]
+        The (row, column) pixel size.
+    mode : Literal["auto", "manual"], optional
+        The boundary detection mode (default is "auto").
+    sensitivity : float, optional
+        (default is 3)
+    top_perc : float, optional
+        (default is 95)
+    iterations : int, optional
+        (default is 2)
+    cull_perc : float, optional
+        (default is 80)
+    bubble_offset : int, optional
+        (default is 0)
+    bubble_side : SideType, optional
+        (default is "top")
+    shape : PhantomShapes, optional
+        (default is "ellipse")
+
+    Returns
+    -------
+    MedACRContext
+
+    Raises
+    ------
+    ValueError
+        If the volume does not have 11 slices.
+
+    See Also
+    --------
+    find_boundary : for details of the boundary detection parameters.
+    """
+    if volume.shape[0] != 11:
+        raise ValueError("Expected ACR Image with 11 slices")
+
+    inserts_slice = find_inserts_slice(np.sum(volume, axis=(1, 2)))
+    return inserts_slice_context(volume[inserts_slice],
+                                 inserts_slice,
+                                 pixel_size,
+                                 mode,
+                                 sensitivity,
+                                 top_perc,
+                                 iterations,
+                                 cull_perc,
+                                 bubble_offset,
+                                 bubble_side,
+                                 shape)
@@ -0,0 +1,290 @@
+"""
+Loads DICOM series without decoding their pixel data until it is used.
+
+Only the headers are read when the files are loaded, the pixel data of an instance
+is decoded the first time its array is used and then kept.
+The z profile of a series is found from a summary of each slice,
+for uncompressed pixel data this is read straight from the file without decoding the slice.
+"""
+import datetime
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+import pydicom
+from pydicom import dcmread
+from pydicom.errors import InvalidDicomError
+
+from pumpia.file_handling.dicom_structures import Patient, Study, Series, Instance
+from pumpia.image_handling.image_structures import FileImageSet
+from pumpia.module_handling.manager import Manager
+from pumpia.utilities.logging import logger
+
+from pumpia_acr_med.acquisition import store_parameters
+
+# elements larger than this are read from the file when used
+DEFER_SIZE = 1024
+# every nth row and column of a slice is used for its summary
+SUMMARY_STEP = 4
+
+
+def _study_datetime(header: pydicom.Dataset) -> datetime.datetime:
+    """
+    Returns the study date and time, missing parts of the time are 0.
+    """
+    study_date = str(header.get("StudyDate", ""))
+    study_time = str(header.get("StudyTime", "")).split(".")[0].ljust(6, "0")
+    return datetime.datetime(int(study_date[:4]),
+                             int(study_date[4:6]),
+                             int(study_date[6:8]),
+                             int(study_time[:2]),
+                             int(study_time[2:4]),
+                             int(study_time[4:6]))
+
+
+def pixel_data_view(filepath: Path, header: pydicom.Dataset) -> np.ndarray[tuple[int, int], np.dtype] | None:
+    """
+    Returns a memory map of the pixel data in a single frame greyscale file without the rescale applied.
+
+    Parameters
+    ----------
+    filepath : Path
+    header : pydicom.Dataset
+        The dataset of the file read with `DEFER_SIZE`, so the pixel data is not read.
+
+    Returns
+    -------
+    np.ndarray[tuple[int, int], np.dtype] | None
+        None if the pixel data is compressed, big endian or not 8, 16 or 32 bit, so must be decoded.
+    """
+    file_meta = getattr(header, "file_meta", None)
+    if "PixelData" not in header or file_meta is None:
+        return None
+    transfer_syntax = file_meta.get("TransferSyntaxUID")
+    if (transfer_syntax is None
+        or transfer_syntax.is_compressed
+        or transfer_syntax.is_deflated
+        or not transfer_syntax.is_little_endian
+        or int(header.get("SamplesPerPixel", 1)) != 1
+        or int(header.get("NumberOfFrames") or 1) != 1
+            or int(header.BitsAllocated) not in (8, 16, 32)):
+        return None
+
+    element = header.get_item("PixelData", keep_deferred=True)
+    offset = getattr(element, "value_tell", None)
+    if offset is None:
+        return None
+    kind = "i" if int(header.get("PixelRepresentation", 0)) else "u"
+    return np.memmap(filepath,
+                     dtype=f"<{kind}{int(header.BitsAllocated) // 8}",
+                     mode="r",
+                     offset=offset,
+                     shape=(int(header.Rows), int(header.Columns)))
+
+
+def read_frame(filepath: Path) -> np.ndarray[tuple[int, int], np.dtype]:
+    """
+    Reads the pixel data of a single frame greyscale file with the rescale slope and intercept applied.
+    Uncompressed pixel data is read through a memory map, other pixel data is decoded.
+    Nothing is kept after the array is returned, so reading a series one frame at a time
+    only needs the memory of one frame.
+
+    Parameters
+    ----------
+    filepath : Path
+
+    Returns
+    -------
+    np.ndarray[tuple[int, int], np.dtype]
+        The pixel values as floats.
+    """
+    header = dcmread(filepath, defer_size=DEFER_SIZE)
+    pixels = pixel_data_view(filepath, header)
+    if pixels is None:
+        pixels = dcmread(filepath).pixel_array
+    frame = np.asarray(pixels, dtype=float) * float(header.get("RescaleSlope", 1))
+    frame += float(header.get("RescaleIntercept", 0))
+    return frame
+
+
+class LazyInstance(Instance):
+    """
+    An instance which decodes its pixel data the first time it is used.
+    Has the same attributes and methods as Instance unless stated below.
+
+    Parameters
+    ----------
+    series : Series
+    slice_number : int
+    filepath : Path
+    header : pydicom.Dataset
+        The dataset read with `DEFER_SIZE`, so the pixel data is not read.
+
+    Attributes
+    ----------
+    decoded : bool
+    summary : float
+    """
+
+    def __init__(self,
+                 series: Series,
+                 slice_number: int,
+                 filepath: Path,
+                 header: pydicom.Dataset) -> None:
+        # Instance decodes the pixel data for the shape, so is skipped
+        # pylint: disable-next=non-parent-init-called
+        FileImageSet.__init__(self, (int(header.Rows), int(header.Columns)), filepath)
+        self.series: Series = series
+        self.is_frame: bool = False
+        self.slice_number: int = slice_number
+        self.dimension_index_values = None
+        self.loaded: bool = False
+        self._dicom: pydicom.Dataset | None = header
+        self._raw_array: np.ndarray | None = None
+        self._summary: float | None = None
+
+    @property
+    def raw_array(self) -> np.ndarray[tuple[int, int, int], np.dtype]:
+        if self._raw_array is None:
+            self._raw_array = dcmread(self.filepath).pixel_array[np.newaxis, ...]
+        return self._raw_array
+
+    @property
+    def decoded(self) -> bool:
+        """
+        Whether the pixel data has been decoded.
+        """
+        return self._raw_array is not None
+
+    @property
+    def summary(self) -> float:
+        """
+        The mean of every `SUMMARY_STEP` row and column with the rescale slope and intercept applied.
+        Read from the file without decoding the pixel data if it is uncompressed.
+        """
+        if self._summary is None:
+            if self._raw_array is None and self._dicom is not None:
+                pixels = pixel_data_view(self.filepath, self._dicom)
+            else:
+                pixels = None
+            if pixels is None:
+                pixels = self.raw_array[0]
+            raw_mean = float(np.mean(pixels[::SUMMARY_STEP, ::SUMMARY_STEP]))
+            header = self._dicom
+            if header is None:
+                self._summary = raw_mean
+            else:
+                self._summary = (raw_mean * float(header.get("RescaleSlope", 1))
+                                 + float(header.get("RescaleIntercept", 0)))
+        return self._summary
+
+
+class LazySeries(Series):
+    """
+    A series of `LazyInstance`.
+    Has the same attributes and methods as Series unless stated below.
+
+    Attributes
+    ----------
+    z_profile : np.ndarray
+        The summary of each slice, proportional to the sum of each slice used by Series.
+    num_decoded : int
+    """
+
+    @property
+    def z_profile(self) -> np.ndarray[tuple[int], np.dtype]:
+        return np.array([instance.summary
+                         if isinstance(instance, LazyInstance)
+                         else np.mean(instance.array)
+                         for instance in self.instances])
+
+    @property
+    def num_decoded(self) -> int:
+        """
+        The number of instances with decoded pixel data.
+        """
+        return sum(1 for instance in self.instances
+                   if not isinstance(instance, LazyInstance) or instance.decoded)
+
+
+def _load_with_manager(files: Sequence[Path]) -> list[Series]:
+    manager = Manager()
+    manager.load_images(files)
+    return [s
+            for patient in manager.patients
+            for study in patient.studies
+            for s in study.series]
+
+
+def load_series(files: Sequence[Path]) -> list[Series]:
+    """
+    Loads the series in `files` as `LazySeries`, only reading the headers.
+    The acquisition parameters of each series are stored from its first header.
+
+    Files which are not DICOM images are ignored.
+    Enhanced (multi-frame) and colour files are not supported,
+    if there are any all of the files are loaded through the pumpia `Manager` instead.
+
+    Parameters
+    ----------
+    files : Sequence[Path]
+
+    Returns
+    -------
+    list[Series]
+    """
+    headers: list[tuple[Path, pydicom.Dataset]] = []
+    for file in files:
+        try:
+            header = dcmread(file, defer_size=DEFER_SIZE)
+        except (InvalidDicomError, OSError):
+            continue
+        if "PixelData" not in header:
+            continue
+        if "NumberOfFrames" in header or int(header.get("SamplesPerPixel", 1)) != 1:
+            return _load_with_manager(files)
+        headers.append((file, header))
+
+    patients: dict[str, Patient] = {}
+    studies: dict[str, Study] = {}
+    series: dict[tuple[str, int], LazySeries] = {}
+    for file, header in headers:
+        try:
+            patient_id = str(header.PatientID)
+            patient = patients.get(patient_id)
+            if patient is None:
+                patient = Patient(patient_id=patient_id, name=str(header.get("PatientName", "")))
+                patients[patient_id] = patient
+
+            study_id = str(header.StudyInstanceUID)
+            study = studies.get(study_id)
+            if study is None:
+                study = Study(patient=patient,
+                              study_id=study_id,
+                              study_datetime=_study_datetime(header),
+                              study_desc=str(header.get("StudyDescription", "")))
+                patient.add_study(study)
+                studies[study_id] = study
+
+            acquisition_number = int(header.get("AcquisitionNumber") or 0)
+            series_key = (str(header.SeriesInstanceUID), acquisition_number)
+            file_series = series.get(series_key)
+            if file_series is None:
+                file_series = LazySeries(study=study,
+                                         series_id=series_key[0],
+                                         series_description=str(header.get("SeriesDescription", "")),
+                                         series_number=int(header.SeriesNumber),
+                                         acquisition_number=acquisition_number)
+                study.add_series(file_series)
+                series[series_key] = file_series
+                store_parameters(file_series, header)
+
+            file_series.add_instance(LazyInstance(file_series,
+                                                  int(header.InstanceNumber),
+                                                  file,
+                                                  header))
+        # pylint: disable-next=broad-exception-caught
+        except Exception:
+            logger.warning("%s failed to load.", file, exc_info=True)
+
+    return list(series.values())
@@ -2,12 +2,14 @@
 Contains context handling for medium ACR phantom
 """
 
+import os
 import tkinter as tk
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from functools import partial
 from tkinter import ttk
 from typing import overload, Literal
 
-import numpy as np
-
 from pumpia.file_handling.dicom_structures import Series, Instance
 from pumpia.module_handling.manager import Manager
 from pumpia.image_handling.roi_structures import RectangleROI, PointROI
@@ -17,7 +19,13 @@ from pumpia.widgets.context_managers import (AutoPhantomManager,
                                              side_map,
                                              inv_side_map,
                                              side_opts)
-from pumpia.module_handling.context import PhantomContext
+from pumpia.module_handling.context import PhantomShape
+
+from pumpia_acr_med.context_utils import (MedACRContext,
+                                          medium_acr_context,
+                                          find_inserts_slice,
+                                          find_inserts,
+                                          insert_boxes)
 
 inserts_slice_map: dict[Literal["1", "11"], Literal[0, 10]] = {"1": 0,
                                                                "11": 10}
@@ -26,37 +34,65 @@ inv_inserts_slice_map: dict[Literal[0, 10], Literal["1", "11"]] = {v: k
                                                                    inserts_slice_map.items()}
 inserts_slice_opts = list(inserts_slice_map.keys())
 
-# offsets in mm (dicom standard units)
-FOUR_BOX_OFFSET = 17
-FOUR_BOX_SL = 10
-FIVE_BOX_OFFSET = 28
-FIVE_BOX_SL = 5
+CONTEXT_CACHE_SIZE = 16
 
 
-class MedACRContext(PhantomContext):
+class ContextCache:
     """
-    Context for Medium ACR Phantom.
+    Least recently used cache of contexts, shared by all `MedACRContextManager` instances.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of contexts stored (default is CONTEXT_CACHE_SIZE).
     """
 
-    def __init__(self,
-                 xmin: int,
-                 xmax: int,
-                 ymin: int,
-                 ymax: int,
-                 inserts_slice: Literal[0] | Literal[10] = 0,
-                 res_insert_side: SideType = "bottom",
-                 circle_insert_side: SideType = "left"):
-        super().__init__(xmin, xmax, ymin, ymax, 'ellipse')
-
-        if ((res_insert_side in ["top", "bottom"]
-             and circle_insert_side in ["top", "bottom"])
-            or (res_insert_side in ["left", "right"]
-                and circle_insert_side in ["left", "right"])):
-            raise ValueError("resolution/circle insert sides must not be on the same axis")
-
-        self.res_insert_side: SideType = res_insert_side
-        self.circle_insert_side: SideType = circle_insert_side
-        self.inserts_slice: Literal[0] | Literal[10] = inserts_slice
+    def __init__(self, maxsize: int = CONTEXT_CACHE_SIZE):
+        self.maxsize: int = maxsize
+        self._contexts: OrderedDict[Hashable, MedACRContext] = OrderedDict()
+
+    def get(self, key: Hashable) -> MedACRContext | None:
+        """
+        Returns the context for `key` or None if it is not cached.
+        """
+        try:
+            self._contexts.move_to_end(key)
+        except KeyError:
+            return None
+        return self._contexts[key]
+
+    def put(self, key: Hashable, context: MedACRContext) -> None:
+        """
+        Stores `context` against `key`, removing the least recently used context if full.
+        """
+        self._contexts[key] = context
+        self._contexts.move_to_end(key)
+        while len(self._contexts) > self.maxsize:
+            self._contexts.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Removes all cached contexts.
+        """
+        self._contexts.clear()
+
+
+context_cache = ContextCache()
+
+
+def series_identity(image: Series) -> tuple[Hashable, ...]:
+    """
+    Returns the ID of `image` and the path and modification time of each of its files.
+    This identifies the pixel data without reading it, a file which is changed gives a new identity.
+    """
+    files: list[tuple[str, int | None]] = []
+    for instance in image.instances:
+        try:
+            modified = os.stat(instance.filepath).st_mtime_ns
+        except OSError:
+            modified = None
+        files.append((str(instance.filepath), modified))
+    return (image.id_string, tuple(files))
 
 
 class MedACRContextManager(AutoPhantomManager):
@@ -214,232 +250,217 @@ class MedACRContextManager(AutoPhantomManager):
             self.auto_phantom_manager.grid(column=0, row=0, sticky="nsew")
             self.inserts_frame.grid(column=0, row=1, sticky="nsew")
 
-    def get_context(self, image: Series | Instance) -> MedACRContext:
+    def context_settings(self) -> tuple[Hashable, ...]:
+        """
+        Returns the boundary detection settings used when the context is calculated automatically.
+        """
+        manager = self.auto_phantom_manager
+        return (manager.mode_var.get(),
+                manager.sensitivity_var.get(),
+                manager.top_perc_var.get(),
+                manager.iterations_var.get(),
+                manager.cull_perc_var.get(),
+                manager.bubble_offset_var.get(),
+                manager.bubble_side_var.get(),
+                manager.man_shape_var.get(),
+                tuple(var.get() for var in manager.shape_vars))
+
+    def _shapes(self) -> list[PhantomShape]:
+        """
+        Returns the shapes selected for the boundary detection.
+        """
+        manager = self.auto_phantom_manager
+        shapes: list[PhantomShape] = []
+        for var in manager.shape_vars:
+            if var.get() != "":
+                shape = manager.shape_map[var.get()]
+                if shape is not None:
+                    shapes.append(shape)
+        return shapes
+
+    def _use_cache(self) -> bool:
+        # full manual control and on image contexts are not calculated, showing boxes must draw them
+        return (self.auto_phantom_manager.mode_var.get() in ["auto", "manual"]
+                and not self.show_boxes_var.get())
+
+    def _cache_key(self, image: Series) -> Hashable:
+        return (series_identity(image), self.context_settings())
+
+    def context_calculation(self,
+                            image: Series | Instance
+                            ) -> tuple[Hashable, Callable[[], MedACRContext]] | None:
+        """
+        Returns the calculation of the context for `image` with the current settings.
+        The calculation does not use tkinter so can be ran on a worker thread,
+        storing its result in `context_cache` against the key means `get_context` will use it.
+
+        Parameters
+        ----------
+        image : Series | Instance
+
+        Returns
+        -------
+        tuple[Hashable, Callable[[], MedACRContext]] | None
+            The cache key and the calculation.
+            None if the context is not calculated automatically with the current settings.
+
+        Raises
+        ------
+        ValueError
+            If the image does not have 11 slices or has no pixel spacing.
+        """
         if isinstance(image, Instance):
             image = image.series
 
         if image.num_slices != 11:
             raise ValueError("Expected ACR Image with 11 slices")
 
-        if self.auto_phantom_manager.mode_var.get() == "fine tune":
-            inserts_slice = inserts_slice_map[self.inserts_slice_var.get()]  # pyright: ignore[reportArgumentType]
-        else:
-            min_slice = np.argmin(image.z_profile)
+        if not self._use_cache():
+            return None
 
-            if min_slice == 4:
-                inserts_slice = 0
-            else:
-                inserts_slice = 10
+        return self._cache_key(image), self._calculation(image)
 
-            self.inserts_slice_var.set(inv_inserts_slice_map[inserts_slice])
+    def _calculation(self, image: Series) -> Callable[[], MedACRContext]:
+        """
+        Returns the calculation of the context for `image` in the "auto" and "manual" modes.
+        """
+        pixel_size = image.pixel_spacing
+        if pixel_size is None:
+            raise ValueError("Image has no pixel spacing.")
 
-        inserts_image = image.instances[inserts_slice]
+        manager = self.auto_phantom_manager
+        return partial(medium_acr_context,
+                       image.array,
+                       (pixel_size[0], pixel_size[1]),
+                       manager.mode_var.get(),  # pyright: ignore[reportArgumentType]
+                       manager.sensitivity_var.get(),
+                       manager.top_perc_var.get(),
+                       manager.iterations_var.get(),
+                       manager.cull_perc_var.get(),
+                       manager.bubble_offset_var.get(),
+                       side_map[manager.bubble_side_var.get()],
+                       self._shapes())
+
+    def _show_context(self, context: MedACRContext) -> None:
+        """
+        Shows the inserts of `context` in the manager's inputs.
+        """
+        self.inserts_slice_var.set(inv_inserts_slice_map[context.inserts_slice])
+        self.res_insert_var.set(inv_side_map[context.res_insert_side])
+        self.circle_insert_var.set(inv_side_map[context.circle_insert_side])
+
+    def _show_bounds(self, context: MedACRContext) -> None:
+        """
+        Shows the bounds of `context` in the fine tune inputs of the phantom manager
+        and shows the fine tune mode, as the phantom manager does for the bounds it finds.
+        """
+        manager = self.auto_phantom_manager
+        manager.fine_tune_frame.xmin_var.set(context.xmin)
+        manager.fine_tune_frame.xmax_var.set(context.xmax)
+        manager.fine_tune_frame.ymin_var.set(context.ymin)
+        manager.fine_tune_frame.ymax_var.set(context.ymax)
+        manager.fine_tune_frame.shape_var.set(manager.inv_shape_map[context.shape])
+        manager.fine_tune_radio.grid(column=0, row=2, sticky="nsew")
 
-        boundary_context = self.auto_phantom_manager.get_context(inserts_image)
+    def get_context(self, image: Series | Instance) -> MedACRContext:
+        if isinstance(image, Instance):
+            image = image.series
 
-        res_insert_side: SideType
-        circle_insert_side: SideType
+        if image.num_slices != 11:
+            raise ValueError("Expected ACR Image with 11 slices")
 
-        if self.auto_phantom_manager.mode_var.get() == "fine tune":
-            res_insert_side = side_map[self.res_insert_var.get()]
-            circle_insert_side = side_map[self.circle_insert_var.get()]
+        if self._use_cache():
+            cache_key = self._cache_key(image)
+            context = context_cache.get(cache_key)
+            if context is not None:
+                self._show_context(context)
+                self._show_bounds(context)
+                return context
+            context = self._calculate_context(image)
+            context_cache.put(cache_key, context)
+            return context
+
+        return self._calculate_context(image)
+
+    def _calculate_context(self, image: Series) -> MedACRContext:
+        """
+        Calculates the context for `image`, see `get_context`.
+        In the "auto" and "manual" modes this is the calculation from `context_calculation`.
+        """
+        manager = self.auto_phantom_manager
+        mode = manager.mode_var.get()
+
+        if mode in ["auto", "manual"]:
+            context = self._calculation(image)()
+            self._show_context(context)
+            self._show_bounds(context)
+            if self.show_boxes_var.get():
+                self._show_boxes(image, context)
+            return context
+
+        if mode == "fine tune":
+            inserts_slice = inserts_slice_map[self.inserts_slice_var.get()]  # pyright: ignore[reportArgumentType]
+            boundary_context = manager.get_context(image.instances[inserts_slice])
             return MedACRContext(boundary_context.xmin,
                                  boundary_context.xmax,
                                  boundary_context.ymin,
                                  boundary_context.ymax,
                                  inserts_slice,
-                                 res_insert_side,
-                                 circle_insert_side)
+                                 side_map[self.res_insert_var.get()],
+                                 side_map[self.circle_insert_var.get()])
+
+        inserts_slice = find_inserts_slice(image.z_profile)
+        self.inserts_slice_var.set(inv_inserts_slice_map[inserts_slice])
+        inserts_image = image.instances[inserts_slice]
+        boundary_context = manager.get_context(inserts_image)
 
         pixel_size = image.pixel_spacing
         if pixel_size is None:
             raise ValueError("Image has no pixel spacing.")
-        pixel_height = pixel_size[0]
-        pixel_width = pixel_size[1]
-
-        inserts_image_array = inserts_image.array[0]
-
-        xcent = boundary_context.xcent
-        ycent = boundary_context.ycent
-
-        four_box_offset_x = FOUR_BOX_OFFSET / pixel_width
-        four_box_offset_y = FOUR_BOX_OFFSET / pixel_height
-
-        four_box_width = FOUR_BOX_SL / pixel_width
-        four_box_height = FOUR_BOX_SL / pixel_height
-
-        five_box_offset_x = FIVE_BOX_OFFSET / pixel_width
-        five_box_offset_y = FIVE_BOX_OFFSET / pixel_height
-
-        five_box_width = FIVE_BOX_SL / pixel_width
-        five_box_height = FIVE_BOX_SL / pixel_height
-
-        top_box_xmin = round(xcent - four_box_width / 2)
-        top_box_xmax = round(xcent + four_box_width / 2) + 1
-        top_box_ymin = round(ycent - four_box_offset_y - four_box_height)
-        top_box_ymax = round(ycent - four_box_offset_y) + 1
-
-        bottom_box_xmin = round(xcent - four_box_width / 2)
-        bottom_box_xmax = round(xcent + four_box_width / 2) + 1
-        bottom_box_ymin = round(ycent + four_box_offset_y)
-        bottom_box_ymax = round(ycent + four_box_offset_y + four_box_height) + 1
-
-        left_box_xmin = round(xcent - four_box_offset_x - four_box_width)
-        left_box_xmax = round(xcent - four_box_offset_x) + 1
-        left_box_ymin = round(ycent - four_box_height / 2)
-        left_box_ymax = round(ycent + four_box_height / 2) + 1
-
-        right_box_xmin = round(xcent + four_box_offset_x)
-        right_box_xmax = round(xcent + four_box_offset_x + four_box_width) + 1
-        right_box_ymin = round(ycent - four_box_height / 2)
-        right_box_ymax = round(ycent + four_box_height / 2) + 1
-
-        res_insert_opp = np.argmax([np.mean(inserts_image_array[top_box_ymin:top_box_ymax,
-                                                                top_box_xmin:top_box_xmax]),
-                                   np.mean(inserts_image_array[bottom_box_ymin:bottom_box_ymax,
-                                                               bottom_box_xmin:bottom_box_xmax]),
-                                   np.mean(inserts_image_array[left_box_ymin:left_box_ymax,
-                                                               left_box_xmin:left_box_xmax]),
-                                   np.mean(inserts_image_array[right_box_ymin:right_box_ymax,
-                                                               right_box_xmin:right_box_xmax])])
-
-        res_insert_opp = int(res_insert_opp)
-
-        if res_insert_opp == 0 or res_insert_opp == 1:
-            five_box_xmin = round(xcent - five_box_offset_x - five_box_width)
-            five_box_xmax = round(xcent - five_box_offset_x) + 1
-            six_box_xmin = round(xcent + five_box_offset_x)
-            six_box_xmax = round(xcent + five_box_offset_x + five_box_width) + 1
-
-            if res_insert_opp == 0:
-                res_insert_side = "bottom"
-                five_box_ymin = six_box_ymin = round(ycent - five_box_offset_y - five_box_height)
-                five_box_ymax = six_box_ymax = round(ycent - five_box_offset_y) + 1
-            else:
-                res_insert_side = "top"
-                five_box_ymin = six_box_ymin = round(ycent + five_box_offset_y)
-                five_box_ymax = six_box_ymax = round(ycent + five_box_offset_y
-                                                     + five_box_height) + 1
-
-            five_box_mean = np.mean(inserts_image_array[five_box_ymin:five_box_ymax,
-                                                        five_box_xmin:five_box_xmax])
-            six_box_mean = np.mean(inserts_image_array[six_box_ymin:six_box_ymax,
-                                                       six_box_xmin:six_box_xmax])
-
-            if five_box_mean > six_box_mean:
-                circle_insert_side = "right"
-            else:
-                circle_insert_side = "left"
-
-        else:
-            five_box_ymin = round(ycent - five_box_offset_y - five_box_height)
-            five_box_ymax = round(ycent - five_box_offset_y) + 1
-            six_box_ymin = round(ycent + five_box_offset_y)
-            six_box_ymax = round(ycent + five_box_offset_y + five_box_height) + 1
-
-            if res_insert_opp == 2:
-                res_insert_side = "right"
-                five_box_xmin = six_box_xmin = round(xcent - five_box_offset_x - five_box_width)
-                five_box_xmax = six_box_xmax = round(xcent - five_box_offset_x) + 1
-            else:
-                res_insert_side = "left"
-                five_box_xmin = six_box_xmin = round(xcent + five_box_offset_x)
-                five_box_xmax = six_box_xmax = round(xcent + five_box_offset_x + five_box_width) + 1
-
-            five_box_mean = np.mean(inserts_image_array[five_box_ymin:five_box_ymax,
-                                                        five_box_xmin:five_box_xmax])
-            six_box_mean = np.mean(inserts_image_array[six_box_ymin:six_box_ymax,
-                                                       six_box_xmin:six_box_xmax])
-
-            if five_box_mean > six_box_mean:
-                circle_insert_side = "bottom"
-            else:
-                circle_insert_side = "top"
 
+        res_insert_side, circle_insert_side, rotation = find_inserts(inserts_image.current_slice_array,
+                                                                     boundary_context.xcent,
+                                                                     boundary_context.ycent,
+                                                                     (pixel_size[0], pixel_size[1]))
+        context = MedACRContext(boundary_context.xmin,
+                                boundary_context.xmax,
+                                boundary_context.ymin,
+                                boundary_context.ymax,
+                                inserts_slice,
+                                res_insert_side,
+                                circle_insert_side,
+                                rotation)
+        self._show_context(context)
         if self.show_boxes_var.get():
-            init_box_width = top_box_xmax - top_box_xmin
-            init_box_height = top_box_ymax - top_box_ymin
-
-            top_roi = RectangleROI(image,
-                                   top_box_xmin,
-                                   top_box_ymin,
-                                   init_box_width,
-                                   init_box_height,
-                                   slice_num=inserts_slice,
-                                   replace=True,
-                                   name="Top")
-
-            bottom_roi = RectangleROI(image,
-                                      bottom_box_xmin,
-                                      bottom_box_ymin,
-                                      init_box_width,
-                                      init_box_height,
-                                      slice_num=inserts_slice,
-                                      replace=True,
-                                      name="Bottom")
-
-            left_roi = RectangleROI(image,
-                                    left_box_xmin,
-                                    left_box_ymin,
-                                    init_box_width,
-                                    init_box_height,
-                                    slice_num=inserts_slice,
-                                    replace=True,
-                                    name="Left")
-
-            right_roi = RectangleROI(image,
-                                     right_box_xmin,
-                                     right_box_ymin,
-                                     init_box_width,
-                                     init_box_height,
-                                     slice_num=inserts_slice,
-                                     replace=True,
-                                     name="Right")
-
-            sec_box_width = five_box_xmax - five_box_xmin
-            sec_box_height = five_box_ymax - five_box_ymin
-
-            five_roi = RectangleROI(image,
-                                    five_box_xmin,
-                                    five_box_ymin,
-                                    sec_box_width,
-                                    sec_box_height,
-                                    slice_num=inserts_slice,
-                                    replace=True,
-                                    name="Diagonal 1")
-
-            six_roi = RectangleROI(image,
-                                   six_box_xmin,
-                                   six_box_ymin,
-                                   sec_box_width,
-                                   sec_box_height,
-                                   slice_num=inserts_slice,
-                                   replace=True,
-                                   name="Diagonal 2")
-
-            cent = PointROI(image,
-                            round(boundary_context.xcent),
-                            round(boundary_context.ycent),
-                            slice_num=inserts_slice,
-                            name="Centre",
-                            replace=True)
-            if self.manager is not None:
-                self.manager.add_roi(top_roi)
-                self.manager.add_roi(bottom_roi)
-                self.manager.add_roi(left_roi)
-                self.manager.add_roi(right_roi)
-                self.manager.add_roi(five_roi)
-                self.manager.add_roi(six_roi)
-                self.manager.add_roi(cent)
-                self.manager.update_viewers(image.instances[inserts_slice])
-
-        self.res_insert_var.set(inv_side_map[res_insert_side])
-        self.circle_insert_var.set(inv_side_map[circle_insert_side])
-
-        return MedACRContext(boundary_context.xmin,
-                             boundary_context.xmax,
-                             boundary_context.ymin,
-                             boundary_context.ymax,
-                             inserts_slice,
-                             res_insert_side,
-                             circle_insert_side)
+            self._show_boxes(image, context)
+        return context
+
+    def _show_boxes(self, image: Series, context: MedACRContext) -> None:
+        """
+        Draws the boxes used to find the inserts and the centre of the phantom on the inserts slice.
+        """
+        pixel_size = image.pixel_spacing
+        if self.manager is None or pixel_size is None:
+            return
+
+        boxes = insert_boxes(context.xcent,
+                             context.ycent,
+                             (pixel_size[0], pixel_size[1]),
+                             context.res_insert_side,
+                             context.rotation)
+        for name, (xmin, xmax, ymin, ymax) in boxes.items():
+            self.manager.add_roi(RectangleROI(image,
+                                              xmin,
+                                              ymin,
+                                              xmax - xmin,
+                                              ymax - ymin,
+                                              slice_num=context.inserts_slice,
+                                              replace=True,
+                                              name=name))
+        self.manager.add_roi(PointROI(image,
+                                      round(context.xcent),
+                                      round(context.ycent),
+                                      slice_num=context.inserts_slice,
+                                      name="Centre",
+                                      replace=True))
+        self.manager.update_viewers(image.instances[context.inserts_slice])
@@ -0,0 +1,603 @@
+"""
+Base module for the medium ACR modules.
+"""
+import time
+import hashlib
+import json
+import threading
+import tkinter as tk
+import weakref
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from tkinter import ttk
+from typing import Any, Self
+
+import numpy as np
+
+from pumpia.module_handling.modules import BaseModule, PhantomModule
+from pumpia.module_handling.collections import BaseCollection
+from pumpia.module_handling.context import BaseContext
+from pumpia.module_handling.fields.simple import FloatField
+from pumpia.module_handling.fields.roi_fields import BaseROIField
+from pumpia.module_handling.fields.windows import FieldWindow
+from pumpia.image_handling.image_structures import ArrayImage
+from pumpia.image_handling.roi_structures import (BaseROI,
+                                                  PointROI,
+                                                  CircleROI,
+                                                  EllipseROI,
+                                                  SquareROI,
+                                                  RectangleROI,
+                                                  LineROI)
+from pumpia.file_handling.dicom_structures import Instance
+from pumpia.widgets.viewers import BaseViewer
+
+from pumpia_acr_med.acquisition import acquisition_parameters
+from pumpia_acr_med.result_cache import CACHE_VERSION, ResultCache
+
+TIMED_STAGES: dict[str, str] = {"context": "Context",
+                                "draw_rois": "Draw ROIs",
+                                "post_roi_register": "Post ROI Register",
+                                "analyse": "Analyse"}
+TIMING_FIELDS: list[str] = [f"{stage}_{clock}_time"
+                            for stage in TIMED_STAGES
+                            for clock in ("wall", "cpu")]
+
+ANALYSIS_POLL_MS = 50
+
+# the cached results include the ROIs after the analysis under this name, as analyses can move them
+CACHED_ROIS = "_rois"
+ROI_TYPES: dict[str, type[BaseROI]] = {"Point": PointROI,
+                                       "Circle": CircleROI,
+                                       "Ellipse": EllipseROI,
+                                       "Square": SquareROI,
+                                       "Rectangle": RectangleROI,
+                                       "Line": LineROI}
+
+# the pixel data of a loaded image does not change so its hash is kept while the image is
+_pixel_hashes: weakref.WeakKeyDictionary[ArrayImage, str] = weakref.WeakKeyDictionary()
+
+
+def pixel_hash(image: ArrayImage) -> str:
+    """
+    Returns the SHA-256 hash of the pixel data of an image.
+    """
+    try:
+        return _pixel_hashes[image]
+    except KeyError:
+        digest = hashlib.sha256(np.ascontiguousarray(image.array)).hexdigest()
+        _pixel_hashes[image] = digest
+        return digest
+
+
+def roi_geometry(roi: BaseROI) -> list[str]:
+    """
+    Returns the type of an ROI followed by its geometry, from its storage string without the image and name.
+    """
+    return roi.storage_string.split(" ; ")[2:]
+
+
+def roi_from_geometry(roi: BaseROI, geometry: list[str]) -> BaseROI | None:
+    """
+    Returns an ROI with the same image, slice and name as `roi` and the geometry from `roi_geometry`.
+    None if the type of ROI is not supported.
+    """
+    roi_type = ROI_TYPES.get(geometry[0])
+    if roi_type is None:
+        return None
+    values = [int(value) for value in geometry[1:]]
+    return roi_type(roi.image,  # pyright: ignore[reportCallIssue]
+                    *values,
+                    slice_num=roi.slice_num,
+                    name=roi.name)
+
+
+class StageTimer:
+    """
+    Context manager which measures the wall time and CPU time of a block.
+    The CPU time is for the current thread so is correct when ran on a worker thread.
+
+    Attributes
+    ----------
+    wall : float
+        The wall time in seconds.
+    cpu : float
+        The CPU time in seconds.
+    """
+
+    def __init__(self) -> None:
+        self.wall: float = 0
+        self.cpu: float = 0
+        self._wall_start: float = 0
+        self._cpu_start: float = 0
+
+    def __enter__(self) -> Self:
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.wall = time.perf_counter() - self._wall_start
+        self.cpu = time.thread_time() - self._cpu_start
+
+
+def timed_call(func: Callable[[], Any]) -> tuple[Any, StageTimer]:
+    """
+    Calls `func` and returns its result with the time taken.
+    """
+    with StageTimer() as timer:
+        result = func()
+    return result, timer
+
+
+class AnalysisCancelled(Exception):
+    """
+    Raised in a calculation by `AnalysisProgress` when its analysis has been cancelled.
+    """
+
+
+class AnalysisProgress:
+    """
+    Progress of a calculation ran on a worker thread.
+
+    The calculation calls this with the fraction of it done.
+    If `cancel` has been called this raises `AnalysisCancelled`, stopping the calculation at that point.
+
+    Attributes
+    ----------
+    fraction : float
+        The fraction of the calculation done, between 0 and 1.
+    """
+
+    def __init__(self) -> None:
+        self.fraction: float = 0
+        self._cancelled = threading.Event()
+
+    def __call__(self, fraction: float) -> None:
+        if self._cancelled.is_set():
+            raise AnalysisCancelled
+        self.fraction = fraction
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        Whether the calculation has been cancelled.
+        """
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        """
+        Cancels the calculation the next time it reports its progress.
+        """
+        self._cancelled.set()
+
+
+def reset_results(module: BaseModule) -> None:
+    """
+    Resets the fields of a module which are reset on analysis.
+    """
+    for field in module.fields:
+        if field.reset_on_analysis:
+            field.reset_value()
+            field.reset_entry_style()
+            field.reset_label_style()
+
+
+def add_command_widget(owner: BaseModule | BaseCollection, widget: tk.Widget) -> None:
+    """
+    Grids `widget` in the commands frame of a module or collection in the same way as its command buttons.
+    """
+    if owner.direction == "horizontal":
+        widget.grid(column=0,
+                    row=owner.command_buttons_count,
+                    columnspan=2,
+                    sticky=tk.NSEW)
+    else:
+        widget.grid(column=owner.command_buttons_count,
+                    row=0,
+                    rowspan=2,
+                    sticky=tk.NSEW)
+    owner.command_buttons_count += 1
+
+
+class MedACRModule(PhantomModule):
+    """
+    Base module for the medium ACR modules.
+
+    The analysis is split into `get_analysis`, which reads the fields and ROIs,
+    and `set_results`, which sets the fields from the result of the calculation.
+    Both must be called on the main thread, the calculation returned by `get_analysis`
+    does not use tkinter so is ran on a worker thread when the module is analysed on its own,
+    or by a collection.
+    Long calculations report their progress to the `AnalysisProgress` given to `get_analysis`,
+    which is shown under the commands and allows the analysis to be cancelled.
+
+    The wall and CPU time of getting the context, drawing the ROIs, post ROI register and analysis
+    are shown in read only fields.
+    Drawing the ROIs does not include post ROI register, which is the total since the ROIs were last drawn.
+
+    If `result_cache` is set the read only fields are stored after analysis,
+    analysing again with the same images, parameters and ROIs sets them from the cache.
+    The module is only analysed again if these have changed since it was last analysed, see `dirty`.
+
+    Attributes
+    ----------
+    thread_safe : bool
+        Whether the calculation returned by `get_analysis` can be ran on a worker thread.
+        This should be False if it logs as the log window is a tkinter widget.
+        Set at class level.
+    result_cache : ResultCache | None
+        The cache of results shared by all modules, None to not cache results.
+        Set at class level on `MedACRModule`.
+    """
+    thread_safe: bool = True
+    result_cache: ResultCache | None = None
+
+    context_wall_time = FloatField(verbose_name="Context Wall Time (s)", read_only=True)
+    context_cpu_time = FloatField(verbose_name="Context CPU Time (s)", read_only=True)
+    draw_rois_wall_time = FloatField(verbose_name="Draw ROIs Wall Time (s)", read_only=True)
+    draw_rois_cpu_time = FloatField(verbose_name="Draw ROIs CPU Time (s)", read_only=True)
+    post_roi_register_wall_time = FloatField(verbose_name="Post ROI Register Wall Time (s)",
+                                             read_only=True)
+    post_roi_register_cpu_time = FloatField(verbose_name="Post ROI Register CPU Time (s)",
+                                            read_only=True)
+    analyse_wall_time = FloatField(verbose_name="Analyse Wall Time (s)", read_only=True)
+    analyse_cpu_time = FloatField(verbose_name="Analyse CPU Time (s)", read_only=True)
+
+    _post_register_wall: float = 0
+    _post_register_cpu: float = 0
+    _analysed_key: str | None = None
+    _analysis_progress: AnalysisProgress | None = None
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        # show the timings after the fields of the module
+        for name in TIMING_FIELDS:
+            cls.fields.field_types[name] = cls.fields.field_types.pop(name)
+
+    def set_timing(self, stage: str, timer: StageTimer) -> None:
+        """
+        Sets the timing fields of a stage.
+
+        Parameters
+        ----------
+        stage : str
+            One of the keys of `TIMED_STAGES`.
+        timer : StageTimer
+        """
+        setattr(self, f"{stage}_wall_time", timer.wall)
+        setattr(self, f"{stage}_cpu_time", timer.cpu)
+
+    def create_rois(self, context: BaseContext | None = None, batch: bool = False) -> None:
+        if context is None:
+            with StageTimer() as timer:
+                context = self.get_context()
+            self.set_timing("context", timer)
+
+        self._post_register_wall = 0
+        self._post_register_cpu = 0
+        with StageTimer() as timer:
+            super().create_rois(context, batch)
+        timer.wall -= self._post_register_wall
+        timer.cpu -= self._post_register_cpu
+        self.set_timing("draw_rois", timer)
+
+    def _post_roi_register_manual_wrapper(self,
+                                          roi_input: BaseROIField,
+                                          update_viewers: bool = False):
+        with StageTimer() as timer:
+            super()._post_roi_register_manual_wrapper(roi_input, update_viewers)
+        self._post_register_wall += timer.wall
+        self._post_register_cpu += timer.cpu
+        self.post_roi_register_wall_time = self._post_register_wall
+        self.post_roi_register_cpu_time = self._post_register_cpu
+
+    @property
+    def dirty(self) -> bool:
+        """
+        Whether the module needs analysing,
+        True if it has not been analysed or its images, parameters or ROIs have changed since.
+        """
+        if not self.analysed or self._analysed_key is None:
+            return True
+        return self.cache_key() != self._analysed_key
+
+    def mark_analysed(self) -> None:
+        """
+        Sets `analysed` and records the images, parameters and ROIs the results are from.
+        """
+        self.analysed = True
+        self._analysed_key = self.cache_key()
+
+    def on_image_load(self, viewer: BaseViewer) -> None:
+        self.cancel_analysis()
+        super().on_image_load(viewer)
+
+    def load_commands(self):
+        self.register_command("Cancel Analysis", self.cancel_analysis)
+        self.progress_bar = ttk.Progressbar(self.button_frame, maximum=1, mode="determinate")
+        add_command_widget(self, self.progress_bar)
+
+    def run_analysis(self, batch: bool = False) -> None:
+        """
+        Runs the analysis for the module if it is dirty.
+        When not ran as part of a batch and `thread_safe` is True
+        the calculation is ran on a worker thread and the results set when it finishes.
+        """
+        if self.rois_loaded and not self.dirty:
+            self.logger.info("Analysis Up To Date")
+            return
+        if not batch and self.thread_safe and self.rois_loaded:
+            self._start_analysis()
+            return
+        with StageTimer() as timer:
+            super().run_analysis(batch)
+        if self.rois_loaded:
+            self.set_timing("analyse", timer)
+            self.mark_analysed()
+
+    def _start_analysis(self) -> None:
+        """
+        Runs the calculation from `get_analysis` on a worker thread,
+        any analysis of the module already running is cancelled.
+        """
+        self.cancel_analysis()
+        reset_results(self)
+        self.progress_bar.configure(value=0)
+        try:
+            with StageTimer() as timer:
+                key, cached = self.check_cache()
+            progress = AnalysisProgress()
+            analysis = None if cached else self.get_analysis(progress)
+        # pylint: disable-next=broad-exception-caught
+        except Exception:
+            self.logger.warning("module had an error on analysis.",
+                                exc_info=True)
+            return
+
+        if analysis is None:
+            if cached:
+                self.set_timing("analyse", timer)
+            self._finish_analysis()
+            return
+
+        self._analysis_progress = progress
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(timed_call, analysis)
+        executor.shutdown(wait=False)
+        self._publish_analysis(progress, key, future)
+
+    def _publish_analysis(self,
+                          progress: AnalysisProgress,
+                          key: str | None,
+                          future: Future[tuple[Any, StageTimer]]) -> None:
+        """
+        Sets the results of the calculation, tkinter is not thread safe so this polls from the main thread.
+        """
+        if progress.cancelled:
+            return
+        if not future.done():
+            self.progress_bar.configure(value=progress.fraction)
+            self.after(ANALYSIS_POLL_MS, self._publish_analysis, progress, key, future)
+            return
+
+        self._analysis_progress = None
+        try:
+            results, timer = future.result()
+            self.set_results(results)
+            self.set_timing("analyse", timer)
+            if key is not None:
+                self.store_results(key)
+        except AnalysisCancelled:
+            return
+        # pylint: disable-next=broad-exception-caught
+        except Exception:
+            self.progress_bar.configure(value=0)
+            self.logger.warning("module had an error on analysis.",
+                                exc_info=True)
+            return
+        self._finish_analysis()
+
+    def _finish_analysis(self) -> None:
+        self.progress_bar.configure(value=1)
+        self.mark_analysed()
+        self.update_viewers()
+        self.logger.info("Analysis Completed")
+
+    def cancel_analysis(self) -> None:
+        """
+        Cancels the analysis if it is running on a worker thread, the fields are left empty.
+        """
+        progress = self._analysis_progress
+        if progress is None:
+            return
+        self._analysis_progress = None
+        progress.cancel()
+        self.progress_bar.configure(value=0)
+        self.logger.info("Analysis Cancelled")
+
+    def get_analysis(self, progress: AnalysisProgress | None = None) -> Callable[[], Any] | None:
+        """
+        User should override this method to return the calculation for the module.
+        This should read any fields or ROIs needed so the calculation does not use tkinter.
+
+        Parameters
+        ----------
+        progress : AnalysisProgress | None, optional
+            Called by the calculation with the fraction done if it reports its progress (default is None).
+
+        Returns
+        -------
+        Callable[[], Any] | None
+            The calculation, its result is passed to `set_results`.
+            None if the module can not be analysed.
+        """
+        return None
+
+    def set_results(self, results: Any) -> None:
+        """
+        Sets the fields from the result of the calculation returned by `get_analysis`.
+        By default this expects a dictionary keyed by field name.
+
+        Parameters
+        ----------
+        results : Any
+            The result of the calculation.
+        """
+        for name, value in results.items():
+            setattr(self, name, value)
+
+    def cache_key(self) -> str | None:
+        """
+        Returns the key of the current analysis in `result_cache`.
+
+        This is a hash of the module class, the values of the fields which are not read only,
+        the geometry of each ROI, the pixel data of the images the ROIs are on
+        and the acquisition parameters of their series, which are read from the headers.
+        It is also used to find if the module needs analysing again.
+
+        Returns
+        -------
+        str | None
+            None if the ROIs have not been drawn.
+        """
+        if not self.rois_loaded:
+            return None
+
+        cls = type(self)
+        key = hashlib.sha256(f"{CACHE_VERSION} {cls.__module__}.{cls.__qualname__}".encode())
+        parameters = {field.name: field.value_store.value
+                      for field in self.fields
+                      if not field.read_only}
+        key.update(json.dumps(parameters, sort_keys=True, default=str).encode())
+
+        for roi_field in self.rois:
+            roi = roi_field.roi
+            if roi is None:
+                return None
+            key.update(json.dumps([roi.slice_num, roi_geometry(roi), pixel_hash(roi.image)]).encode())
+            if isinstance(roi.image, Instance):
+                parameters = vars(acquisition_parameters(roi.image))
+                key.update(json.dumps(parameters, sort_keys=True, default=str).encode())
+        return key.hexdigest()
+
+    def load_cached_results(self, key: str) -> bool:
+        """
+        Sets the read only fields from `result_cache`,
+        and moves any ROIs the analysis moved to where they were after it.
+
+        Parameters
+        ----------
+        key : str
+            The key from `cache_key`.
+
+        Returns
+        -------
+        bool
+            True if the results were in the cache.
+        """
+        if self.result_cache is None:
+            return False
+        try:
+            results = self.result_cache.get(key)
+        # pylint: disable-next=broad-exception-caught
+        except Exception:
+            self.logger.warning("Could not read the result cache.", exc_info=True)
+            return False
+        if results is None:
+            return False
+        self.restore_rois(results.pop(CACHED_ROIS, {}))
+        for name, value in results.items():
+            setattr(self, name, value)
+        return True
+
+    def restore_rois(self, geometries: dict[str, list[str]]) -> None:
+        """
+        Registers ROIs with the geometry from `roi_geometry` keyed by ROI field name,
+        ROIs which already have the geometry are left.
+        """
+        for roi_field in self.rois:
+            roi = roi_field.roi
+            geometry = geometries.get(roi_field.name)
+            if roi is None or geometry is None or roi_geometry(roi) == geometry:
+                continue
+            new_roi = roi_from_geometry(roi, geometry)
+            if new_roi is not None:
+                roi_field.register_roi(new_roi)
+
+    def store_results(self, key: str) -> None:
+        """
+        Stores the read only fields, other than the timings, and the geometry of the ROIs in `result_cache`.
+        The key is found before the analysis, so the ROIs are stored as analyses such as auto-positioning
+        move them and a cached result must move them the same way.
+
+        Parameters
+        ----------
+        key : str
+            The key from `cache_key`, found before the analysis.
+        """
+        if self.result_cache is None:
+            return
+        results: dict[str, Any] = {field.name: field.value_store.value
+                                   for field in self.fields
+                                   if field.read_only and field.name not in TIMING_FIELDS}
+        results[CACHED_ROIS] = {roi_field.name: roi_geometry(roi_field.roi)
+                                for roi_field in self.rois
+                                if roi_field.roi is not None}
+        try:
+            self.result_cache.put(key, results)
+        # pylint: disable-next=broad-exception-caught
+        except Exception:
+            self.logger.warning("Could not write to the result cache.", exc_info=True)
+
+    def check_cache(self) -> tuple[str | None, bool]:
+        """
+        Sets the read only fields from `result_cache` if the current analysis is cached.
+
+        Returns
+        -------
+        tuple[str | None, bool]
+            The key to store the results against and whether they were cached.
+            The key is None if results are not cached.
+        """
+        if self.result_cache is None:
+            return None, False
+        key = self.cache_key()
+        if key is None:
+            return None, False
+        return key, self.load_cached_results(key)
+
+    def analyse(self, batch: bool = False):
+        key, cached = self.check_cache()
+        if cached:
+            return
+
+        analysis = self.get_analysis()
+        if analysis is not None:
+            self.set_results(analysis())
+            if key is not None:
+                self.store_results(key)
+
+
+def timings_window(*modules: tuple[str, MedACRModule],
+                   verbose_name: str = "Timings") -> FieldWindow:
+    """
+    Returns a field window with the draw ROIs and analyse wall times of each module.
+
+    Parameters
+    ----------
+    *modules : tuple[str, MedACRModule]
+        The name to show and the module.
+    verbose_name : str, optional
+        (default is "Timings")
+
+    Returns
+    -------
+    FieldWindow
+    """
+    fields = []
+    field_names: list[str | None] = []
+    for name, module in modules:
+        for stage in ("draw_rois", "analyse"):
+            fields.append(getattr(module.fields, f"{stage}_wall_time"))
+            field_names.append(f"{name} {TIMED_STAGES[stage]} (s)")
+    return FieldWindow(*fields, field_names=field_names, verbose_name=verbose_name)
@@ -1,15 +1,38 @@
 """
 Collection for Medium ACR with repeat images.
 """
+import os
+import queue
+import tkinter as tk
+from tkinter import ttk
+from collections.abc import Hashable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
 
+from pumpia.file_handling.dicom_structures import Series, Instance
+from pumpia.module_handling.manager import Manager
 from pumpia.module_handling.collections import ModuleGroup, BaseCollection
 from pumpia.module_handling.fields.windows import FieldWindow
 from pumpia.module_handling.fields.groups import FieldGroup
 from pumpia.module_handling.fields.viewer_fields import MonochromeDicomViewerField
 from pumpia.widgets.viewers import MonochromeDicomViewer
+from pumpia.utilities.typing import DirectionType
 
-from pumpia_acr_med.med_acr_context import MedACRContextManager
+from pumpia_acr_med.context_utils import MedACRContext
+from pumpia_acr_med.med_acr_context import (MedACRContextManager,
+                                            context_cache,
+                                            inv_inserts_slice_map,
+                                            inv_side_map)
+from pumpia_acr_med.med_acr_module import (ANALYSIS_POLL_MS,
+                                           AnalysisProgress,
+                                           MedACRModule,
+                                           StageTimer,
+                                           add_command_widget,
+                                           reset_results,
+                                           timed_call,
+                                           timings_window)
 from pumpia_acr_med.modules.sub_snr import MedACRSubSNR
+from pumpia_acr_med.modules.nps import MedACRNoisePowerSpectrum
 from pumpia_acr_med.modules.uniformity import MedACRUniformity
 from pumpia_acr_med.modules.ghosting import MedACRGhosting
 from pumpia_acr_med.modules.slice_width import MedACRSliceWidth
@@ -24,11 +47,18 @@ class MedACRrptCollection(BaseCollection):
     """
     context_manager = MedACRContextManager()
     title = "Medium ACR Repeat Collection"
+    # default for the analyse on load option
+    analyse_on_load: bool = False
+    _analysis_run: int = 0
+    _analysis_progress: dict[MedACRModule, AnalysisProgress]
+    _load_run: int = 0
+    _load_context: MedACRContext | None = None
 
     viewer1 = MonochromeDicomViewerField(row=0, column=0)
     viewer2 = MonochromeDicomViewerField(row=0, column=1)
 
     snr = MedACRSubSNR(verbose_name="SNR")
+    nps = MedACRNoisePowerSpectrum(verbose_name="NPS")
 
     uniformity1 = MedACRUniformity(verbose_name="Uniformity")
     uniformity2 = MedACRUniformity(verbose_name="Uniformity")
@@ -71,6 +101,20 @@ class MedACRrptCollection(BaseCollection):
                                 phantom_width2.fields.distortion,
                                 resolution2.fields.total_contrast,
                                 verbose_name="Image 2 Results")
+    timings_output = timings_window(("SNR", snr),
+                                    ("NPS", nps),
+                                    ("Uniformity 1", uniformity1),
+                                    ("Uniformity 2", uniformity2),
+                                    ("Ghosting 1", ghosting1),
+                                    ("Ghosting 2", ghosting2),
+                                    ("Phantom Width 1", phantom_width1),
+                                    ("Phantom Width 2", phantom_width2),
+                                    ("Slice Width 1", slice_width1),
+                                    ("Slice Width 2", slice_width2),
+                                    ("Slice Position 1", slice_pos1),
+                                    ("Slice Position 2", slice_pos2),
+                                    ("Resolution 1", resolution1),
+                                    ("Resolution 2", resolution2))
 
     uniformity_size_group = FieldGroup(uniformity1.fields.size,
                                        uniformity2.fields.size)
@@ -114,11 +158,42 @@ class MedACRrptCollection(BaseCollection):
     resolution_window = ModuleGroup(resolution1, resolution2,
                                     verbose_name="Resolution")
 
+    def __init__(self,
+                 parent: tk.Misc,
+                 manager: Manager,
+                 *,
+                 direction: DirectionType = "Horizontal",
+                 **kwargs):
+        # set before the base class loads the commands so each collection has its own progresses
+        self._analysis_progress = {}
+        super().__init__(parent, manager, direction=direction, **kwargs)
+
+    def load_commands(self):
+        self.analyse_on_load_var = tk.BooleanVar(self, self.analyse_on_load)
+        add_command_widget(self, ttk.Checkbutton(self.button_frame,
+                                                 text="Analyse On Load",
+                                                 variable=self.analyse_on_load_var))
+        self.register_command("Cancel Analysis", self.cancel_analysis)
+        self.progress_bar = ttk.Progressbar(self.button_frame, mode="determinate")
+        add_command_widget(self, self.progress_bar)
+        self.progress_label = ttk.Label(self.button_frame)
+        add_command_widget(self, self.progress_label)
+
+        for var in (self.context_manager.inserts_slice_var,
+                    self.context_manager.res_insert_var,
+                    self.context_manager.circle_insert_var):
+            var.trace_add("write", self._on_context_change)
+
+    def _show_progress(self, text: str, done: float = 0, total: int = 1) -> None:
+        self.progress_bar.configure(maximum=max(total, 1), value=done)
+        self.progress_label.configure(text=text)
+
     def on_image_load(self, viewer: MonochromeDicomViewer) -> None:
         if viewer is self.viewer1:
             if self.viewer1.image is not None:
                 image = self.viewer1.image
                 self.snr.viewer1.load_image(image)
+                self.nps.viewer1.load_image(image)
                 self.uniformity1.viewer.load_image(image)
                 self.ghosting1.viewer.load_image(image)
                 self.slice_width1.viewer.load_image(image)
@@ -129,9 +204,247 @@ class MedACRrptCollection(BaseCollection):
             if self.viewer2.image is not None:
                 image = self.viewer2.image
                 self.snr.viewer2.load_image(image)
+                self.nps.viewer2.load_image(image)
                 self.uniformity2.viewer.load_image(image)
                 self.ghosting2.viewer.load_image(image)
                 self.slice_width2.viewer.load_image(image)
                 self.slice_pos2.viewer1.load_image(image)
                 self.phantom_width2.viewer.load_image(image)
                 self.resolution2.viewer.load_image(image)
+
+        if (self.analyse_on_load_var.get()
+            and self.viewer1.image is not None
+                and self.viewer2.image is not None):
+            self.analyse_loaded_images()
+
+    def analyse_loaded_images(self) -> None:
+        """
+        Finds the context on a worker thread then draws the ROIs and runs the analysis,
+        used when the `Analyse On Load` option is selected and both viewers have an image.
+        Drawing the ROIs uses tkinter so is done on the main thread once the context is found.
+        Only contexts found automatically can be calculated on a worker thread,
+        in the other context modes the ROIs must be drawn by the user.
+        """
+        self._load_run += 1
+        self._cancel_running()
+        self._load_context = None
+        run = self._load_run
+        image = self.viewer1.image
+        if not isinstance(image, (Series, Instance)):
+            return
+
+        try:
+            calculation = self.context_manager.context_calculation(image)
+        # pylint: disable-next=broad-exception-caught
+        except Exception:
+            self.logger.warning("could not get the context on load.",
+                                exc_info=True)
+            self._show_progress("Context failed")
+            return
+        if calculation is None:
+            self.logger.info("Context mode is not auto or manual, images not analysed on load")
+            self._show_progress("")
+            return
+
+        key, find_context = calculation
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(timed_call, find_context)
+        executor.shutdown(wait=False)
+        self._show_progress("Finding context")
+        self._await_load_context(run, image, key, future)
+
+    def _await_load_context(self,
+                            run: int,
+                            image: Series | Instance,
+                            key: Hashable,
+                            future: Future[tuple[MedACRContext, StageTimer]]) -> None:
+        """
+        Polls for the context found by `analyse_loaded_images` then draws the ROIs and runs the analysis.
+        The context is discarded if the analysis has been cancelled or the image has changed.
+        """
+        if run != self._load_run or image is not self.viewer1.image:
+            return
+        if not future.done():
+            self.after(ANALYSIS_POLL_MS, self._await_load_context, run, image, key, future)
+            return
+
+        try:
+            context, timer = future.result()
+            # context manager sets its options and fine tune values from the cached context
+            context_cache.put(key, context)
+            context = self.get_context()
+        # pylint: disable-next=broad-exception-caught
+        except Exception:
+            self.logger.warning("could not get the context on load.",
+                                exc_info=True)
+            self._show_progress("Context failed")
+            return
+
+        self._show_progress("Drawing ROIs")
+        self._draw_rois(context, timer)
+        self._load_context = context
+        self.run_analysis()
+
+    def _on_context_change(self, *_) -> None:
+        """
+        Invalidates the results of analysing on load if the user corrects the context.
+        """
+        context = self._load_context
+        if context is None:
+            return
+        manager = self.context_manager
+        if (manager.inserts_slice_var.get() == inv_inserts_slice_map[context.inserts_slice]
+            and manager.res_insert_var.get() == inv_side_map[context.res_insert_side]
+                and manager.circle_insert_var.get() == inv_side_map[context.circle_insert_side]):
+            return
+
+        self._load_context = None
+        self._load_run += 1
+        self._cancel_running()
+        for module in self.modules:
+            reset_results(module)
+            module.analysed = False
+        self._show_progress("Context changed, draw ROIs and analyse again")
+        self.logger.info("Context changed, results of analysing on load cleared")
+
+    def _cancel_running(self) -> None:
+        """
+        Discards the results of any analysis running, calculations which report their progress are stopped.
+        """
+        self._analysis_run += 1
+        for progress in self._analysis_progress.values():
+            progress.cancel()
+        self._analysis_progress = {}
+
+    def cancel_analysis(self) -> None:
+        """
+        Cancels the analysis, calculations which do not report their progress finish but their results are discarded.
+        """
+        self._load_run += 1
+        self._cancel_running()
+        self._show_progress("Analysis cancelled")
+
+    def create_rois(self) -> None:
+        """
+        Gets the context then calls the `create_rois` method for each module.
+        The context is found once for the collection so its time is set on each module.
+        """
+        self._load_run += 1
+        self._load_context = None
+        with StageTimer() as timer:
+            context = self.get_context()
+        self._draw_rois(context, timer)
+
+    def _draw_rois(self, context: MedACRContext | None, timer: StageTimer) -> None:
+        """
+        Calls the `create_rois` method for each module with `context`, found in the time of `timer`.
+        """
+        for module in self.modules:
+            if isinstance(module, MedACRModule):
+                module.set_timing("context", timer)
+            try:
+                module.create_rois(context, batch=True)
+            # pylint: disable-next=broad-exception-caught
+            except Exception:
+                module.logger.warning("module had an error drawing ROIs.",
+                                      exc_info=True)
+        self.update_viewers()
+
+    def run_analysis(self) -> None:
+        """
+        Runs the analysis for each module whose images, parameters or ROIs have changed since it was last analysed.
+        The calculations are ran on a thread pool once the ROIs exist,
+        the results are set on the main thread as each module finishes.
+        Modules with cached results are set straight away.
+        """
+        self._cancel_running()
+        run = self._analysis_run
+        progresses: dict[MedACRModule, AnalysisProgress] = {}
+        self._analysis_progress = progresses
+        finished: queue.Queue[tuple[MedACRModule, str | None, Future[Any]]] = queue.Queue()
+        executor = ThreadPoolExecutor(max_workers=min(len(list(self.modules)), os.cpu_count() or 1))
+        pending = 0
+
+        for module in self.modules:
+            if not isinstance(module, MedACRModule) or not module.thread_safe:
+                try:
+                    module.run_analysis(batch=True)
+                # pylint: disable-next=broad-exception-caught
+                except Exception:
+                    module.logger.warning("module had an error on analysis.",
+                                          exc_info=True)
+                continue
+
+            if not module.rois_loaded or not module.dirty:
+                continue
+
+            module.cancel_analysis()
+            progress = AnalysisProgress()
+            try:
+                reset_results(module)
+                with StageTimer() as timer:
+                    key, cached = module.check_cache()
+                analysis = None if cached else module.get_analysis(progress)
+            # pylint: disable-next=broad-exception-caught
+            except Exception:
+                module.logger.warning("module had an error on analysis.",
+                                      exc_info=True)
+                continue
+
+            if cached:
+                module.set_timing("analyse", timer)
+            if analysis is None:
+                module.mark_analysed()
+                module.logger.info("Analysis Completed")
+                continue
+
+            progresses[module] = progress
+            future = executor.submit(timed_call, analysis)
+            future.add_done_callback(lambda result, module=module, key=key: finished.put((module, key, result)))
+            pending += 1
+
+        executor.shutdown(wait=False)
+        self._publish_results(run, finished, progresses, pending, pending)
+
+    def _publish_results(self,
+                         run: int,
+                         finished: queue.Queue[tuple[MedACRModule, str | None, Future[Any]]],
+                         progresses: dict[MedACRModule, AnalysisProgress],
+                         pending: int,
+                         total: int) -> None:
+        """
+        Sets the results of finished modules, tkinter is not thread safe so this polls from the main thread.
+        Results from an analysis which has been ran again or cancelled are discarded.
+        The progress shown includes the fraction done of calculations which report their progress.
+        """
+        while pending > 0:
+            try:
+                module, key, result = finished.get_nowait()
+            except queue.Empty:
+                break
+            pending -= 1
+            progresses.pop(module, None)
+            if run != self._analysis_run:
+                continue
+            try:
+                results, timer = result.result()
+                module.set_results(results)
+                module.set_timing("analyse", timer)
+                if key is not None:
+                    module.store_results(key)
+                module.mark_analysed()
+                module.logger.info("Analysis Completed")
+            # pylint: disable-next=broad-exception-caught
+            except Exception:
+                module.logger.warning("module had an error on analysis.",
+                                      exc_info=True)
+
+        if run == self._analysis_run:
+            done = total - pending + sum(progress.fraction for progress in progresses.values())
+            self._show_progress(f"Analysed {total - pending} of {total}", done, total)
+
+        if pending > 0:
+            self.after(ANALYSIS_POLL_MS, self._publish_results, run, finished, progresses, pending, total)
+        elif run == self._analysis_run:
+            self._show_progress("Analysis completed", total, total)
+            self.update_viewers()
@@ -0,0 +1,396 @@
+"""
+Noise power spectrum module for medium ACR phantom
+"""
+from collections.abc import Callable
+from functools import partial
+import numpy as np
+import matplotlib.pyplot as plt
+
+from pumpia.module_handling.fields.roi_fields import EllipseROIField
+from pumpia.module_handling.fields.viewer_fields import MonochromeDicomViewerField
+from pumpia.module_handling.fields.simple import (PercField,
+                                                  FloatField,
+                                                  IntField)
+from pumpia.file_handling.dicom_structures import Series, Instance
+
+from pumpia_acr_med.acquisition import acquisition_parameters
+from pumpia_acr_med.med_acr_module import AnalysisProgress, MedACRModule
+from pumpia_acr_med.med_acr_context import MedACRContextManager, MedACRContext
+from pumpia_acr_med.context_utils import summed_area_table, uniform_slice
+from pumpia_acr_med.modules.sub_snr import phantom_mask, snr_roi, subtraction_image
+
+# the most bytes used at once by the tiles being transformed and their spectra
+NPS_MEMORY_BUDGET = 16 * 1024 ** 2
+# the number of lines either side of a frequency axis averaged for the curve along it,
+# the axis itself is left out as it holds the DC of the other direction
+AXIS_LINES = 7
+
+
+class NPSData:
+    """
+    The spectrum and curves from `noise_power_spectrum`, used for plotting.
+    All frequencies are in 1/mm and the noise power in value² mm².
+
+    Attributes
+    ----------
+    nps : np.ndarray
+        The 2D noise power spectrum with the zero frequency in the centre.
+    row_frequencies : np.ndarray
+    column_frequencies : np.ndarray
+        The vertical and horizontal frequencies of `nps`.
+    radial_frequencies : np.ndarray
+    radial_nps : np.ndarray
+        The mean of `nps` in rings about the zero frequency.
+    pe_frequencies : np.ndarray
+    pe_nps : np.ndarray
+        The noise power along the phase encode direction.
+    fe_frequencies : np.ndarray
+    fe_nps : np.ndarray
+        The noise power along the frequency encode direction.
+    """
+
+    def __init__(self,
+                 nps: np.ndarray,
+                 row_frequencies: np.ndarray,
+                 column_frequencies: np.ndarray,
+                 radial_frequencies: np.ndarray,
+                 radial_nps: np.ndarray,
+                 pe_frequencies: np.ndarray,
+                 pe_nps: np.ndarray,
+                 fe_frequencies: np.ndarray,
+                 fe_nps: np.ndarray):
+        self.nps: np.ndarray = nps
+        self.row_frequencies: np.ndarray = row_frequencies
+        self.column_frequencies: np.ndarray = column_frequencies
+        self.radial_frequencies: np.ndarray = radial_frequencies
+        self.radial_nps: np.ndarray = radial_nps
+        self.pe_frequencies: np.ndarray = pe_frequencies
+        self.pe_nps: np.ndarray = pe_nps
+        self.fe_frequencies: np.ndarray = fe_frequencies
+        self.fe_nps: np.ndarray = fe_nps
+
+
+def tile_positions(mask: np.ndarray[tuple[int, int], np.dtype[np.bool]],
+                   tile_size: int) -> np.ndarray[tuple[int, int], np.dtype]:
+    """
+    Returns the top left corner of each square tile entirely inside `mask`,
+    on a grid spaced half a tile apart so neighbouring tiles overlap by half.
+
+    Returns
+    -------
+    np.ndarray[tuple[int, int], np.dtype]
+        The row and column of each tile as a `(number of tiles, 2)` array.
+    """
+    table = summed_area_table(mask)
+    rows = np.arange(0, mask.shape[0] - tile_size + 1, max(tile_size // 2, 1))
+    columns = np.arange(0, mask.shape[1] - tile_size + 1, max(tile_size // 2, 1))
+    inside = (table[np.ix_(rows + tile_size, columns + tile_size)]
+              - table[np.ix_(rows, columns + tile_size)]
+              - table[np.ix_(rows + tile_size, columns)]
+              + table[np.ix_(rows, columns)]) > tile_size ** 2 - 0.5
+    tile_rows, tile_columns = np.nonzero(inside)
+    return np.column_stack((rows[tile_rows], columns[tile_columns]))
+
+
+def plane_basis(tile_size: int) -> np.ndarray[tuple[int, int], np.dtype]:
+    """
+    Returns an orthonormal basis of planes over a flattened square tile,
+    as a `(tile_size ** 2, 3)` array with the constant first.
+    """
+    rows, columns = np.indices((tile_size, tile_size), dtype=float)
+    design = np.column_stack((np.ones(tile_size ** 2), rows.ravel(), columns.ravel()))
+    basis, _ = np.linalg.qr(design)
+    return basis
+
+
+def tiles_per_chunk(tile_size: int, memory_budget: int = NPS_MEMORY_BUDGET) -> int:
+    """
+    Returns the number of tiles transformed at once to stay within `memory_budget` bytes,
+    counting each tile, its complex spectrum and its power.
+    """
+    spectrum_size = tile_size * (tile_size // 2 + 1)
+    tile_bytes = tile_size ** 2 * 8 + spectrum_size * 16 + spectrum_size * 8
+    return max(memory_budget // tile_bytes, 1)
+
+
+def _ring_means(values: np.ndarray, bins: np.ndarray, weights: np.ndarray, num_bins: int) -> np.ndarray:
+    totals = np.bincount(bins.ravel(), (values * weights).ravel(), num_bins)
+    counts = np.bincount(bins.ravel(), weights.ravel(), num_bins)
+    return np.divide(totals, counts, out=np.zeros(num_bins), where=counts > 0)
+
+
+def noise_power_spectrum(difference: np.ndarray[tuple[int, int], np.dtype],
+                         mask: np.ndarray[tuple[int, int], np.dtype[np.bool]],
+                         tile_size: int = 64,
+                         pixel_size: tuple[float, float] = (1, 1),
+                         phase_direction: str | None = "ROW",
+                         memory_budget: int = NPS_MEMORY_BUDGET,
+                         progress: AnalysisProgress | None = None) -> tuple[dict[str, float], NPSData]:
+    """
+    Calculates the noise power spectrum of one image from the subtraction of two repeats.
+
+    The phantom is split into square tiles overlapping by half, see `tile_positions`,
+    and a plane is removed from each so the spectrum is not dominated by shading.
+    The spectra of the tiles are averaged (Welch's method), each chunk of tiles is transformed with
+    one `rfft2` and only the sum of the powers is kept, so the memory used stays within `memory_budget`
+    however many tiles there are.
+    Subtraction doubles the noise power so the spectrum is halved,
+    it is normalised so its integral is the noise variance of one image.
+
+    Parameters
+    ----------
+    difference : np.ndarray[tuple[int, int], np.dtype]
+        The subtraction image, see `subtraction_image`.
+    mask : np.ndarray[tuple[int, int], np.dtype[np.bool]]
+        The phantom, tiles are only taken entirely inside it.
+    tile_size : int, optional
+        The width of the tiles in pixels (default is 64).
+    pixel_size : tuple[float, float], optional
+        The row and column spacing in mm (default is (1, 1)).
+    phase_direction : str | None, optional
+        The phase encode direction, as InPlanePhaseEncodingDirection (default is "ROW").
+    memory_budget : int, optional
+        The most bytes used at once by the tiles being transformed (default is `NPS_MEMORY_BUDGET`).
+    progress : AnalysisProgress | None, optional
+        Given the fraction of tiles transformed (default is None).
+
+    Returns
+    -------
+    tuple[dict[str, float], NPSData]
+        The results keyed by `MedACRNoisePowerSpectrum` field name, and the spectrum and curves.
+    """
+    if tile_size < 4:
+        raise ValueError("Tiles must be at least 4 pixels")
+    positions = tile_positions(mask, tile_size)
+    num_tiles = len(positions)
+    if num_tiles == 0:
+        raise ValueError("Tile size is larger than the phantom")
+
+    difference = np.asarray(difference, dtype=float)
+    windows = np.lib.stride_tricks.sliding_window_view(difference, (tile_size, tile_size))
+    basis = plane_basis(tile_size)
+    chunk_size = tiles_per_chunk(tile_size, memory_budget)
+    power_sum = np.zeros((tile_size, tile_size // 2 + 1))
+    for start in range(0, num_tiles, chunk_size):
+        chunk = positions[start:start + chunk_size]
+        # indexing the view copies only the tiles in this chunk
+        tiles = windows[chunk[:, 0], chunk[:, 1]].reshape(len(chunk), -1)
+        tiles -= (tiles @ basis) @ basis.T
+        spectra = np.fft.rfft2(tiles.reshape(len(chunk), tile_size, tile_size))
+        power_sum += np.sum(np.square(spectra.real), axis=0)
+        power_sum += np.sum(np.square(spectra.imag), axis=0)
+        if progress is not None:
+            progress(min(start + chunk_size, num_tiles) / num_tiles)
+
+    nps = power_sum * (pixel_size[0] * pixel_size[1] / (2 * num_tiles * tile_size ** 2))
+    row_frequencies = np.fft.fftfreq(tile_size, pixel_size[0])
+    column_frequencies = np.fft.rfftfreq(tile_size, pixel_size[1])
+    # rfft2 only gives half the plane, columns other than the zero and Nyquist frequency stand for two points
+    weights = np.full(nps.shape, 2.0)
+    weights[:, 0] = 1
+    if tile_size % 2 == 0:
+        weights[:, -1] = 1
+    variance = float(np.sum(nps * weights)) / (tile_size ** 2 * pixel_size[0] * pixel_size[1])
+
+    radii = np.hypot(row_frequencies[:, np.newaxis], column_frequencies[np.newaxis, :])
+    radial_step = 1 / (tile_size * min(pixel_size))
+    num_bins = tile_size // 2 + 1
+    bins = np.minimum(np.rint(radii / radial_step).astype(int), num_bins)
+    radial_nps = _ring_means(nps, bins, weights, num_bins + 1)[1:num_bins]
+    radial_frequencies = np.arange(1, num_bins) * radial_step
+
+    lines = min(AXIS_LINES, tile_size // 2 - 1)
+    # the horizontal curve is from the rows either side of the zero vertical frequency
+    horizontal_nps = np.mean(nps[np.r_[1:lines + 1, -lines:0]], axis=0)
+    horizontal_frequencies = column_frequencies
+    # the vertical curve is folded as the spectrum of each side is the mirror of the other
+    vertical_nps = np.mean(nps[:, 1:lines + 1], axis=1)
+    vertical_nps = (vertical_nps + np.roll(vertical_nps[::-1], 1))[:num_bins] / 2
+    vertical_frequencies = np.arange(num_bins) / (tile_size * pixel_size[0])
+    if phase_direction == "ROW":
+        pe_frequencies, pe_nps = horizontal_frequencies, horizontal_nps
+        fe_frequencies, fe_nps = vertical_frequencies, vertical_nps
+    else:
+        pe_frequencies, pe_nps = vertical_frequencies, vertical_nps
+        fe_frequencies, fe_nps = horizontal_frequencies, horizontal_nps
+
+    peak = int(np.argmax(radial_nps))
+    results: dict[str, float] = {
+        "num_tiles": num_tiles,
+        "nps_noise": float(np.sqrt(variance)),
+        "peak_frequency": float(radial_frequencies[peak]),
+        "mean_frequency": float(np.sum(radial_frequencies * radial_nps) / np.sum(radial_nps)),
+        "pe_fe_ratio": float(np.mean(pe_nps[1:]) / np.mean(fe_nps[1:]))}
+    data = NPSData(np.fft.fftshift(nps, axes=0),
+                   np.fft.fftshift(row_frequencies),
+                   column_frequencies,
+                   radial_frequencies,
+                   radial_nps,
+                   pe_frequencies,
+                   pe_nps,
+                   fe_frequencies,
+                   fe_nps)
+    return results, data
+
+
+class MedACRNoisePowerSpectrum(MedACRModule):
+    """
+    Module for the noise power spectrum of the medium ACR phantom from the subtraction of two repeated images.
+
+    The ROIs are drawn as in the SNR module and the phantom is taken as the first ROI scaled to 100%,
+    the spectrum is found with `noise_power_spectrum`.
+    """
+    context_manager = MedACRContextManager()
+    show_draw_rois_button = True
+    show_analyse_button = True
+    title = "Noise Power Spectrum"
+
+    viewer1 = MonochromeDicomViewerField(row=0, column=0)
+    viewer2 = MonochromeDicomViewerField(row=0, column=1, allow_changing_rois=False)
+
+    size = PercField(70, verbose_name="Size (%)")
+    tile_size = IntField(64, verbose_name="Tile Size (px)")
+
+    slice_used = IntField(read_only=True)
+    num_tiles = IntField(verbose_name="Number of Tiles",
+                         reset_on_analysis=True,
+                         read_only=True)
+    nps_noise = FloatField(verbose_name="NPS Noise",
+                           reset_on_analysis=True,
+                           read_only=True)
+    peak_frequency = FloatField(verbose_name="Peak Frequency (1/mm)",
+                                reset_on_analysis=True,
+                                read_only=True)
+    mean_frequency = FloatField(verbose_name="Mean Frequency (1/mm)",
+                                reset_on_analysis=True,
+                                read_only=True)
+    pe_fe_ratio = FloatField(verbose_name="PE/FE NPS Ratio",
+                             reset_on_analysis=True,
+                             read_only=True)
+
+    nps_roi1 = EllipseROIField("NPS ROI1")
+    nps_roi2 = EllipseROIField("NPS ROI2", allow_manual_draw=False)
+
+    nps_data: NPSData | None = None
+    _nps_key: str | None = None
+
+    def draw_rois(self, context: MedACRContext, batch: bool = False) -> None:
+        if isinstance(self.viewer1.image, Instance):
+            image = self.viewer1.image
+        elif isinstance(self.viewer1.image, Series):
+            self.slice_used = uniform_slice(context)
+            image = self.viewer1.image.instances[self.slice_used]
+        else:
+            return
+
+        self.viewer1.load_image(image)
+        self.nps_roi1.register_roi(snr_roi(image, context, self.size))
+
+    def post_roi_register(self, roi_input: EllipseROIField):
+        if (roi_input == self.nps_roi1
+            and self.nps_roi1.roi is not None
+                and self.manager is not None):
+            self.manager.add_roi(self.nps_roi1.roi)
+            if isinstance(self.viewer2.image, Instance):
+                image = self.viewer2.image
+            elif isinstance(self.viewer2.image, Series):
+                if self.slice_used == 4:
+                    image = self.viewer2.image.instances[4]
+                else:
+                    image = self.viewer2.image.instances[6]
+            else:
+                return
+
+            self.viewer2.load_image(image)
+            self.nps_roi2.register_roi(self.nps_roi1.roi.copy_to_image(image,
+                                                                       image.current_slice,
+                                                                       "NPS ROI",
+                                                                       True))
+            if self.nps_roi2.roi is not None:
+                self.manager.add_roi(self.nps_roi2.roi)
+
+    def link_rois_viewers(self):
+        self.nps_roi1.viewer = self.viewer1
+        self.nps_roi2.viewer = self.viewer2
+
+    def get_analysis(self,
+                     progress: AnalysisProgress | None = None
+                     ) -> Callable[[], tuple[dict[str, float], NPSData]] | None:
+        roi1 = self.nps_roi1.roi
+        roi2 = self.nps_roi2.roi
+        if roi1 is None or roi2 is None or not isinstance(roi1.image, Instance):
+            return None
+
+        parameters = acquisition_parameters(roi1.image)
+        pixel_size = parameters.pixel_spacing
+        if pixel_size is None:
+            self.logger.warning("Pixel spacing not found, frequencies are per pixel")
+            pixel_size = (1, 1)
+        return partial(noise_power_spectrum,
+                       subtraction_image(roi1, roi2),
+                       phantom_mask(roi1, self.size),
+                       self.tile_size,
+                       pixel_size,
+                       parameters.phase_encoding_direction,
+                       progress=progress)
+
+    def set_results(self, results: tuple[dict[str, float], NPSData]) -> None:
+        nps, self.nps_data = results
+        self._nps_key = self.cache_key()
+        super().set_results(nps)
+
+    def load_commands(self):
+        super().load_commands()
+        self.register_command("Show 2D NPS", self.show_nps)
+        self.register_command("Show NPS Curves", self.show_nps_curves)
+
+    def _get_nps_data(self) -> NPSData | None:
+        """
+        Returns the spectrum and curves of the last analysis, calculating them if the results were cached.
+        """
+        if self.nps_roi1.roi is None or self.nps_roi2.roi is None:
+            self.create_rois()
+        if self.nps_data is None or self._nps_key != self.cache_key():
+            analysis = self.get_analysis()
+            if analysis is None:
+                return None
+            _, self.nps_data = analysis()
+            self._nps_key = self.cache_key()
+        return self.nps_data
+
+    def show_nps(self):
+        """
+        Shows the 2D noise power spectrum on a log scale,
+        only positive horizontal frequencies are shown as the other half is its mirror.
+        """
+        data = self._get_nps_data()
+        if data is not None:
+            plt.clf()
+            plt.imshow(np.log10(np.maximum(data.nps, np.finfo(float).tiny)),
+                       cmap='viridis',
+                       extent=(data.column_frequencies[0],
+                               data.column_frequencies[-1],
+                               data.row_frequencies[0],
+                               data.row_frequencies[-1]),
+                       origin='lower')
+            plt.colorbar()
+            plt.xlabel("Horizontal Frequency (1/mm)")
+            plt.ylabel("Vertical Frequency (1/mm)")
+            plt.title("log10 NPS")
+            plt.show()
+
+    def show_nps_curves(self):
+        """
+        Shows the radial, phase encode and frequency encode noise power spectra.
+        """
+        data = self._get_nps_data()
+        if data is not None:
+            plt.clf()
+            plt.plot(data.radial_frequencies, data.radial_nps, label="Radial")
+            plt.plot(data.pe_frequencies[1:], data.pe_nps[1:], label="Phase Encode")
+            plt.plot(data.fe_frequencies[1:], data.fe_nps[1:], label="Frequency Encode")
+            plt.legend()
+            plt.xlabel("Frequency (1/mm)")
+            plt.ylabel("NPS (value² mm²)")
+            plt.title("Noise Power Spectrum")
+            plt.show()
@@ -1,10 +1,11 @@
 """
 Phantom width of medium ACR phantom
 """
+from collections.abc import Callable
+from functools import partial
 import math
 import statistics
 
-from pumpia.module_handling.modules import PhantomModule
 from pumpia.module_handling.fields.roi_fields import LineROIField
 from pumpia.module_handling.fields.viewer_fields import MonochromeDicomViewerField
 from pumpia.module_handling.fields.simple import PercField, FloatField, BoolField
@@ -12,14 +13,111 @@ from pumpia.image_handling.roi_structures import LineROI
 from pumpia.file_handling.dicom_structures import Series, Instance
 from pumpia.utilities.array_utils import nth_max_bounds
 
+from pumpia_acr_med.med_acr_module import AnalysisProgress, MedACRModule
 from pumpia_acr_med.med_acr_context import MedACRContext, MedACRContextManager
+from pumpia_acr_med.context_utils import grid_slice
 
 # distances in mm
 HALF_LINE_LENGTH = 100
+DEFAULT_MAX_PERC = 50
+DEFAULT_INCLUDE = True
 COS_SIN_PI_4 = math.cos(math.pi / 4)
 
 
-class MedACRPhantomWidth(PhantomModule):
+def width_lines(image: Instance,
+                context: MedACRContext,
+                pixel_size: tuple[float, float]) -> tuple[LineROI, LineROI, LineROI, LineROI]:
+    """
+    Returns the vertical, down slope, horizontal and up slope lines through the centre of the phantom.
+    """
+    pixel_height, pixel_width = pixel_size
+
+    xcent = context.xcent
+    ycent = context.ycent
+
+    lines: list[LineROI] = []
+    for xdiff, ydiff in [(0, HALF_LINE_LENGTH / pixel_height),
+                         (HALF_LINE_LENGTH / pixel_width * COS_SIN_PI_4,
+                          HALF_LINE_LENGTH / pixel_height * COS_SIN_PI_4),
+                         (HALF_LINE_LENGTH / pixel_width, 0),
+                         (-HALF_LINE_LENGTH / pixel_width * COS_SIN_PI_4,
+                          HALF_LINE_LENGTH / pixel_height * COS_SIN_PI_4)]:
+        x1 = round(xcent - xdiff)
+        x2 = round(xcent + xdiff)
+        y1 = round(ycent - ydiff)
+        y2 = round(ycent + ydiff)
+        lines.append(LineROI(image,
+                             x1,
+                             y1,
+                             x2,
+                             y2,
+                             replace=True))
+    return lines[0], lines[1], lines[2], lines[3]
+
+
+def phantom_widths(line_vertical: LineROI,
+                   line_up_slope: LineROI,
+                   line_horizontal: LineROI,
+                   line_down_slope: LineROI,
+                   pixel_size: tuple[float, float],
+                   max_perc: float = 50,
+                   bool_vertical: bool = True,
+                   bool_up_slope: bool = True,
+                   bool_horizontal: bool = True,
+                   bool_down_slope: bool = True) -> dict[str, float]:
+    """
+    Calculates the phantom width along each line, and the linearity and distortion of the included widths.
+
+    Parameters
+    ----------
+    line_vertical : LineROI
+    line_up_slope : LineROI
+    line_horizontal : LineROI
+    line_down_slope : LineROI
+    pixel_size : tuple[float, float]
+        The (row, column) pixel size.
+    max_perc : float, optional
+        The width is measured at this percentage of the maximum (default is 50).
+    bool_vertical : bool, optional
+        Include the vertical width in the average (default is True).
+    bool_up_slope : bool, optional
+        Include the up slope width in the average (default is True).
+    bool_horizontal : bool, optional
+        Include the horizontal width in the average (default is True).
+    bool_down_slope : bool, optional
+        Include the down slope width in the average (default is True).
+
+    Returns
+    -------
+    dict[str, float]
+        The results, keyed by `MedACRPhantomWidth` field name.
+    """
+    pixel_height, pixel_width = pixel_size
+    results: dict[str, float] = {}
+
+    divisor = 100 / max_perc
+    diagonal_length = math.dist([pixel_height * COS_SIN_PI_4, pixel_width * COS_SIN_PI_4],
+                                [0, 0])
+
+    lengths = []
+    for name, line, unit_length, include in [("vertical", line_vertical, pixel_height, bool_vertical),
+                                             ("up_slope", line_up_slope, diagonal_length, bool_up_slope),
+                                             ("horizontal", line_horizontal, pixel_width, bool_horizontal),
+                                             ("down_slope", line_down_slope, diagonal_length, bool_down_slope)]:
+        width = (nth_max_bounds(line.profile, divisor).difference  # pyright: ignore[reportArgumentType]
+                 * unit_length)
+        results["width_" + name] = width
+        if include:
+            lengths.append(width)
+
+    mean = statistics.fmean(lengths)
+    results["average_width"] = mean
+    results["linearity"] = mean - 165
+    results["distortion"] = 100 * statistics.stdev(lengths) / mean
+    return results
+
+
+class MedACRPhantomWidth(MedACRModule):
     """
     Calculates medium ACR phantom width
     """
@@ -30,12 +128,12 @@ class MedACRPhantomWidth(PhantomModule):
 
     viewer = MonochromeDicomViewerField(row=0, column=0)
 
-    max_perc = PercField(50, verbose_name="Width position (% of max)")
+    max_perc = PercField(DEFAULT_MAX_PERC, verbose_name="Width position (% of max)")
 
-    bool_vertical = BoolField(verbose_name="Include vertical in Average")
-    bool_up_slope = BoolField(verbose_name="Include up slope in Average")
-    bool_horizontal = BoolField(verbose_name="Include horizontal in Average")
-    bool_down_slope = BoolField(verbose_name="Include down slope in Average")
+    bool_vertical = BoolField(DEFAULT_INCLUDE, verbose_name="Include vertical in Average")
+    bool_up_slope = BoolField(DEFAULT_INCLUDE, verbose_name="Include up slope in Average")
+    bool_horizontal = BoolField(DEFAULT_INCLUDE, verbose_name="Include horizontal in Average")
+    bool_down_slope = BoolField(DEFAULT_INCLUDE, verbose_name="Include down slope in Average")
 
     width_vertical = FloatField(verbose_name="vertical Width",
                                 reset_on_analysis=True,
@@ -69,10 +167,7 @@ class MedACRPhantomWidth(PhantomModule):
         if isinstance(self.viewer.image, Instance):
             image = self.viewer.image
         elif isinstance(self.viewer.image, Series):
-            if context.inserts_slice == 10:
-                image = self.viewer.image.instances[6]
-            else:
-                image = self.viewer.image.instances[4]
+            image = self.viewer.image.instances[grid_slice(context)]
         else:
             return
         self.viewer.load_image(image)
@@ -80,67 +175,12 @@ class MedACRPhantomWidth(PhantomModule):
         pixel_size = image.pixel_spacing
         if pixel_size is None:
             return
-        pixel_height = pixel_size[0]
-        pixel_width = pixel_size[1]
-
-        xcent = context.xcent
-        ycent = context.ycent
 
-        ydiff = HALF_LINE_LENGTH / pixel_height
-        xdiff = 0
-        x1 = round(xcent - xdiff)
-        x2 = round(xcent + xdiff)
-        y1 = round(ycent - ydiff)
-        y2 = round(ycent + ydiff)
-        roi = LineROI(image,
-                      x1,
-                      y1,
-                      x2,
-                      y2,
-                      replace=True)
-        self.line_vertical.register_roi(roi)
-
-        ydiff = HALF_LINE_LENGTH / pixel_height * COS_SIN_PI_4
-        xdiff = HALF_LINE_LENGTH / pixel_width * COS_SIN_PI_4
-        x1 = round(xcent - xdiff)
-        x2 = round(xcent + xdiff)
-        y1 = round(ycent - ydiff)
-        y2 = round(ycent + ydiff)
-        roi = LineROI(image,
-                      x1,
-                      y1,
-                      x2,
-                      y2,
-                      replace=True)
-        self.line_down_slope.register_roi(roi)
-
-        ydiff = 0
-        xdiff = HALF_LINE_LENGTH / pixel_width
-        x1 = round(xcent - xdiff)
-        x2 = round(xcent + xdiff)
-        y1 = round(ycent - ydiff)
-        y2 = round(ycent + ydiff)
-        roi = LineROI(image,
-                      x1,
-                      y1,
-                      x2,
-                      y2,
-                      replace=True)
-        self.line_horizontal.register_roi(roi)
-
-        ydiff = HALF_LINE_LENGTH / pixel_height * COS_SIN_PI_4
-        xdiff = -HALF_LINE_LENGTH / pixel_width * COS_SIN_PI_4
-        x1 = round(xcent - xdiff)
-        x2 = round(xcent + xdiff)
-        y1 = round(ycent - ydiff)
-        y2 = round(ycent + ydiff)
-        roi = LineROI(image,
-                      x1,
-                      y1,
-                      x2,
-                      y2,
-                      replace=True)
-        self.line_up_slope.register_roi(roi)
+        lines = width_lines(image, context, (pixel_size[0], pixel_size[1]))
+        self.line_vertical.register_roi(lines[0])
+        self.line_down_slope.register_roi(lines[1])
+        self.line_horizontal.register_roi(lines[2])
+        self.line_up_slope.register_roi(lines[3])
 
     def post_roi_register(self, roi_input: LineROIField):
         if (roi_input.roi is not None
@@ -148,7 +188,9 @@ class MedACRPhantomWidth(PhantomModule):
                 and roi_input in self.rois):
             self.manager.add_roi(roi_input.roi)
 
-    def analyse(self, batch: bool = False):
+    def get_analysis(self,
+                     progress: AnalysisProgress | None = None
+                     ) -> Callable[[], dict[str, float]] | None:
         if (self.viewer.image is not None
             and self.line_vertical.roi is not None
             and self.line_up_slope.roi is not None
@@ -163,52 +205,17 @@ class MedACRPhantomWidth(PhantomModule):
 
             pixel_size = image.pixel_spacing
             if pixel_size is None:
-                return
-            pixel_height = pixel_size[0]
-            pixel_width = pixel_size[1]
-
-            prof_vertical = self.line_vertical.roi.profile
-            prof_up_slope = self.line_up_slope.roi.profile
-            prof_horizontal = self.line_horizontal.roi.profile
-            prof_down_slope = self.line_down_slope.roi.profile
-
-            divisor = 100 / self.max_perc
-
-            lengths = []
-
-            unit_length_vertical = pixel_height
-            width_vertical = (nth_max_bounds(prof_vertical, divisor).difference
-                              * unit_length_vertical)
-            self.width_vertical = width_vertical
-            if self.bool_vertical:
-                lengths.append(width_vertical)
-
-            unit_length_up_slope = math.dist(
-                [pixel_height * COS_SIN_PI_4, pixel_width * COS_SIN_PI_4],
-                [0, 0])
-            width_up_slope = (nth_max_bounds(prof_up_slope, divisor).difference
-                              * unit_length_up_slope)
-            self.width_up_slope = width_up_slope
-            if self.bool_up_slope:
-                lengths.append(width_up_slope)
-
-            unit_length_horizontal = pixel_width
-            width_horizontal = (nth_max_bounds(prof_horizontal, divisor).difference
-                                * unit_length_horizontal)
-            self.width_horizontal = width_horizontal
-            if self.bool_horizontal:
-                lengths.append(width_horizontal)
-
-            unit_length_down_slope = math.dist(
-                [pixel_height * COS_SIN_PI_4, pixel_width * COS_SIN_PI_4],
-                [0, 0])
-            width_down_slope = (nth_max_bounds(prof_down_slope, divisor).difference
-                                * unit_length_down_slope)
-            self.width_down_slope = width_down_slope
-            if self.bool_down_slope:
-                lengths.append(width_down_slope)
-
-            mean = statistics.fmean(lengths)
-            self.average_width = mean
-            self.linearity = mean - 165
-            self.distortion = 100 * statistics.stdev(lengths) / mean
+                return None
+
+            return partial(phantom_widths,
+                           self.line_vertical.roi,
+                           self.line_up_slope.roi,
+                           self.line_horizontal.roi,
+                           self.line_down_slope.roi,
+                           (pixel_size[0], pixel_size[1]),
+                           self.max_perc,
+                           self.bool_vertical,
+                           self.bool_up_slope,
+                           self.bool_horizontal,
+                           self.bool_down_slope)
+        return None
@@ -2,10 +2,11 @@
 Calculates the contrast of the 1 mm resolution insert.
 """
 import math
+from collections.abc import Callable
+from functools import partial
+from typing import Literal
 import numpy as np
-from scipy.optimize import minimize_scalar
 
-from pumpia.module_handling.modules import PhantomModule
 from pumpia.module_handling.fields.roi_fields import LineROIField, RectangleROIField
 from pumpia.module_handling.fields.viewer_fields import MonochromeDicomViewerField
 from pumpia.module_handling.fields.simple import (PercField,
@@ -15,10 +16,18 @@ from pumpia.module_handling.fields.simple import (PercField,
                                                   OptionField)
 from pumpia.image_handling.roi_structures import RectangleROI, LineROI
 from pumpia.file_handling.dicom_structures import Series, Instance
-from pumpia.file_handling.dicom_tags import MRTags
-from pumpia.utilities.array_utils import nth_max_bounds
 
+from pumpia_acr_med.acquisition import acquisition_parameters
+from pumpia_acr_med.med_acr_module import AnalysisProgress, MedACRModule
 from pumpia_acr_med.med_acr_context import MedACRContextManager, MedACRContext
+from pumpia_acr_med.context_utils import inserts_slices
+from pumpia_acr_med.resolution_utils import (get_contrast,
+                                             fft_contrast,
+                                             search_lines,
+                                             search_angled_lines,
+                                             refine_line,
+                                             line_ends,
+                                             best_contrast_ratio)
 
 BOX_Y_OFFSET = 28
 BOX_X_OFFSET = -5
@@ -27,183 +36,355 @@ LINE_LENGTH = 10
 LINE_GAP = 2
 POINT_SEP = 1
 NUM_PINS = 4
-FFT_MULT = 10
+MAX_LINE_ANGLE = 5
+LINE_ANGLE_STEP = 2.5
+DEFAULT_AUTO_POSITION = True
+DEFAULT_REFINE = False
+DEFAULT_PERCENTAGE = 50
+DEFAULT_RESOLUTION_TYPE = "FFT Method"
 
+resolution_types: dict[str, str] = {"FFT Method": "FFT",
+                                    "Contrast Method": "contrast"}
 
-def get_contrast(profile: np.ndarray[tuple[int], np.dtype]) -> float:
+
+def phase_direction(image: Instance) -> str:
     """
-    Get the contrast for a line profile from the 1mm ACR resolution insert
+    Returns the in plane phase encode direction of the image, or an empty string if it is not found.
     """
-    bounds = nth_max_bounds(profile, 2)
-    if profile[math.floor(bounds.minimum)] > profile[math.floor(bounds.minimum)]:
-        start = math.floor(bounds.minimum)
-    else:
-        start = math.floor(bounds.minimum)
-
-    if profile[math.floor(bounds.maximum)] > profile[math.floor(bounds.maximum)]:
-        end = math.floor(bounds.maximum)
-    else:
-        end = math.floor(bounds.maximum)
-
-    new_prof = profile[start:end + 1]
-    minimum = np.min(new_prof)
-    maximum = np.max(new_prof)
-    half_maximum = (maximum + minimum) / 2
-    mins = list(np.argwhere(new_prof < half_maximum)[:, 0])
-
-    if end - start in mins:
-        mins.remove(end - start)
-    if 0 in mins:
-        mins.remove(0)
-
-    if len(mins) == 0:
-        return 0
+    phase_dir = acquisition_parameters(image).phase_encoding_direction
+    if phase_dir is not None:
+        return phase_dir
+    return ""
 
-    troughs: list[list[int]] = [[mins[0]]]
-    prev_min = mins[0]
 
-    for m in mins[1:]:
-        if m == prev_min + 1:
-            troughs[-1].append(m)
-        else:
-            troughs.append([m])
-        prev_min = m
-
-    contrasts = []
-    prev_t = 0
-    for trough_num, trough in enumerate(troughs):
-        if trough_num + 1 < len(troughs):
-            next_t = min(troughs[trough_num + 1])
-        else:
-            next_t = len(new_prof)
-        left_peak_val = np.mean(new_prof[prev_t:min(trough)])
-        right_peak_val = np.mean(new_prof[max(trough) + 1:next_t])
-        peak_val = (left_peak_val + right_peak_val) / 2
-        trough_val = np.mean(new_prof[min(trough):max(trough) + 1])
-        contrasts.append((peak_val - trough_val) / (peak_val + trough_val))
-
-    return min(contrasts)
-
-
-def fft_contrast(profile: np.ndarray[tuple[int], np.dtype],
-                 pixel_width: float,
-                 contrast_frequency: float) -> float:
+def resolution_rois(image: Instance,
+                    context: MedACRContext,
+                    pixel_size: tuple[float, float]) -> tuple[RectangleROI, LineROI, LineROI]:
     """
-    Get the contrast for a line profile using an fft
+    Returns the ROI around the 1mm resolution insert and the initial horizontal and vertical lines.
     """
-    fft_signal = np.fft.rfft(profile, FFT_MULT * profile.shape[0])
-    abs_fft = np.abs(fft_signal)
-    locs = np.fft.rfftfreq(FFT_MULT * profile.shape[0], d=pixel_width)
-    return np.interp(contrast_frequency, locs, abs_fft) / abs_fft[0]
-
-
-def square_wave_integral(x: np.ndarray | float, width: float = 1, offset: float = 0):
+    pixel_height, pixel_width = pixel_size
+
+    box_height = BOX_SIDE_LENGTH / pixel_height
+    box_width = BOX_SIDE_LENGTH / pixel_width
+
+    x_offset = 0
+    y_offset = 0
+    horizontal_dir = ["U", "L"]
+    vertical_dir = ["D", "R"]
+
+    if context.res_insert_side == "right":
+        x_offset = BOX_Y_OFFSET / pixel_width
+        horizontal_dir[1] = "R"
+        vertical_dir[1] = "L"
+    elif context.res_insert_side == "left":
+        x_offset = -BOX_Y_OFFSET / pixel_width - box_width
+        horizontal_dir[1] = "L"
+        vertical_dir[1] = "R"
+    elif context.res_insert_side == "top":
+        y_offset = -BOX_Y_OFFSET / pixel_height - box_height
+        horizontal_dir[0] = "D"
+        vertical_dir[0] = "U"
+    else:
+        y_offset = BOX_Y_OFFSET / pixel_height
+        horizontal_dir[0] = "U"
+        vertical_dir[0] = "D"
+
+    if context.circle_insert_side == "top":
+        y_offset = BOX_X_OFFSET / pixel_height
+        horizontal_dir[0] = "D"
+        vertical_dir[0] = "U"
+    elif context.circle_insert_side == "bottom":
+        y_offset = -BOX_X_OFFSET / pixel_height - box_width
+        horizontal_dir[0] = "U"
+        vertical_dir[0] = "D"
+    elif context.circle_insert_side == "right":
+        x_offset = -BOX_X_OFFSET / pixel_width - box_width
+        horizontal_dir[1] = "R"
+        vertical_dir[1] = "L"
+    else:
+        x_offset = BOX_X_OFFSET / pixel_width
+        horizontal_dir[1] = "L"
+        vertical_dir[1] = "R"
+
+    box_xmin = round(context.xcent + x_offset)
+    box_ymin = round(context.ycent + y_offset)
+    box_height = round(box_height)
+    box_width = round(box_width)
+
+    main_roi = RectangleROI(image,
+                            box_xmin,
+                            box_ymin,
+                            box_width,
+                            box_height)
+
+    horizontal_line_length = math.floor(2
+                                        * NUM_PINS
+                                        * POINT_SEP
+                                        / pixel_width)
+    vertical_line_length = math.floor(2
+                                      * NUM_PINS
+                                      * POINT_SEP
+                                      / pixel_height)
+    horizontal_line = LineROI(image,
+                              box_xmin,
+                              box_ymin,
+                              box_xmin + horizontal_line_length - 1,
+                              box_ymin)
+    vertical_line = LineROI(image,
+                            box_xmin,
+                            box_ymin,
+                            box_xmin,
+                            box_ymin + vertical_line_length - 1)
+
+    return main_roi, horizontal_line, vertical_line
+
+
+def line_contrast(line: LineROI,
+                  pixel_width: float,
+                  contrast_frequency: float,
+                  resolution_type: str = "FFT") -> float:
+    """
+    Returns the contrast of the profile of a drawn line.
+    """
+    if resolution_type == "FFT":
+        return fft_contrast(line.profile,  # pyright: ignore[reportArgumentType]
+                            pixel_width,
+                            contrast_frequency)
+    return get_contrast(line.profile)  # pyright: ignore[reportArgumentType]
+
+
+def grid_line(image: Instance,
+              roi: RectangleROI,
+              position: tuple[float, float],
+              line_length: int,
+              direction: Literal["horizontal", "vertical"],
+              angle: float = 0) -> LineROI:
+    """
+    Returns the line starting at `position` in `roi`, see `line_ends`, with its ends rounded to whole pixels.
     """
-    The integral of a square wave from 0 to x.
-    The square wave is defined by
+    x1, y1, x2, y2 = line_ends(position, angle, line_length, direction)
+    return LineROI(image,
+                   round(x1) + roi.xmin,
+                   round(y1) + roi.ymin,
+                   round(x2) + roi.xmin,
+                   round(y2) + roi.ymin)
+
+
+def refined_line(array: np.ndarray,
+                 line_length: int,
+                 direction: Literal["horizontal", "vertical"],
+                 pixel_size: tuple[float, float],
+                 line_min_val: float,
+                 angles: np.ndarray,
+                 resolution_type: str,
+                 contrast_frequency: float,
+                 within_loc: int,
+                 progress: Callable[[float], None] | None = None) -> tuple[float, tuple[float, float], float]:
+    """
+    Finds the line with the highest contrast at each of `angles` using `search_angled_lines`
+    and refines it to a sub-pixel position and angle using `refine_line`.
 
-    1 (0 < x mod 2*width < width)
-    0 (width < x mod 2*width < 2*width)
+    Returns
+    -------
+    tuple[float, tuple[float, float], float]
+        The contrast of the refined line, its (x, y) start position and its angle.
+    """
+    contrast, position, angle = search_angled_lines(array,
+                                                    line_length,
+                                                    direction,
+                                                    pixel_size,
+                                                    line_min_val,
+                                                    angles,
+                                                    resolution_type,  # pyright: ignore[reportArgumentType]
+                                                    contrast_frequency,
+                                                    gating="ends",
+                                                    within_loc=within_loc,
+                                                    progress=progress)
+    if contrast <= 0:
+        return contrast, position, angle
+    return refine_line(array,
+                       position,
+                       line_length,
+                       direction,
+                       pixel_size,
+                       line_min_val,
+                       resolution_type,  # pyright: ignore[reportArgumentType]
+                       contrast_frequency,
+                       gating="ends",
+                       within_loc=within_loc,
+                       angle=angle,
+                       angle_radius=LINE_ANGLE_STEP,
+                       max_angle=MAX_LINE_ANGLE)
+
+
+def _scale_progress(progress: Callable[[float], None], start: float, fraction: float) -> None:
+    """
+    Reports the progress of one of the two line searches.
+    """
+    progress(start + fraction / 2)
+
+
+def resolution_contrasts(main_roi: RectangleROI,
+                         horizontal_line: LineROI | None,
+                         vertical_line: LineROI | None,
+                         pixel_size: tuple[float, float],
+                         phase_dir: str,
+                         auto_position_lines: bool = True,
+                         refine_lines: bool = False,
+                         resolution_percentage: float = 50,
+                         resolution_type: str = "FFT",
+                         progress: Callable[[float], None] | None = None
+                         ) -> tuple[dict[str, float], tuple[LineROI, LineROI] | None]:
+    """
+    Calculates the contrast of the 1mm resolution insert.
 
+    If `auto_position_lines` is True every line position in `main_roi` is searched for the highest contrast.
+    If `refine_lines` is also True every position is also searched at angles up to `MAX_LINE_ANGLE`
+    and the best lines are then refined to a sub-pixel position and angle, see `refined_line`.
+    The contrasts are those of the refined lines, which are never lower than without refinement.
+    The lines returned are drawn between the nearest pixels to the ends of the refined lines.
 
-    Parameters
-    ----------
-    x : np.ndarray | float
-    width : float, optional
-        Width of a peak of the square wave.
-        The wavelength is 2*width.
-    offset : float, optional
-        The offset of the square wave.
-        If a mutiple of 2*width then it is equivelant to 0.
+    If `progress` is given it is called with the fraction of candidate line positions searched,
+    the horizontal lines are the first half and the vertical lines the second.
 
     Returns
     -------
-    The integral of the square wave up to x.
+    tuple[dict[str, float], tuple[LineROI, LineROI] | None]
+        The results keyed by the field names of `MedACRResolution`
+        and the horizontal and vertical lines found if `auto_position_lines` is True.
     """
-    x = ((x - offset) / (2 * width)) - 0.5
-    zero_pt = ((0 - offset) / (2 * width)) - 0.5
-    integral = (width
-                * ((np.abs(0.5 + (x % 1))
-                    + np.abs(0.5 - (x % 1))
-                    + np.floor(x))
-                    + (np.abs(0.5 + (zero_pt % 1))
-                       + np.abs(0.5 - (zero_pt % 1))
-                       + np.floor(zero_pt))))
-    return integral
-
-
-def model_signal(offset: float,
-                 pixel_width: float,
-                 wave_peak_width: float,
-                 num_peaks: int,
-                 num_samples: int) -> np.ndarray:
-    points = np.arange(0, num_samples + 1, 1) * pixel_width
-    raw_signal = square_wave_integral(points, wave_peak_width, offset)
-    raw_signal[points < offset] = square_wave_integral(offset, wave_peak_width, offset)
-    max_point = offset + 2 * wave_peak_width * num_peaks
-    raw_signal[points > max_point] = square_wave_integral(max_point, wave_peak_width, offset)
-    signal = np.diff(raw_signal)
-    return signal
-
-
-def model_neg_signal_contrast(offset: float,
-                              pixel_width: float,
-                              wave_peak_width: float,
-                              num_peaks: int,
-                              num_samples: int,) -> float:
-    signal = model_signal(offset,
-                          pixel_width,
-                          wave_peak_width,
-                          num_peaks,
-                          num_samples)
-    return -get_contrast(signal)
-
-
-def maximum_contrast_ratio(pixel_width: float,
-                           wave_peak_width: float,
-                           num_peaks: int,
-                           num_samples: int) -> float:
-    optimum = minimize_scalar(model_neg_signal_contrast,
-                              args=(pixel_width,
-                                    wave_peak_width,
-                                    num_peaks,
-                                    num_samples),
-                              bounds=(0, pixel_width))
-    return -optimum.fun  # pyright: ignore[reportAttributeAccessIssue]
-
-
-def model_neg_signal_fft_contrast(offset: float,
-                                  pixel_width: float,
-                                  wave_peak_width: float,
-                                  num_peaks: int,
-                                  num_samples: int,
-                                  contrast_frequency: float) -> float:
-    signal = model_signal(offset,
-                          pixel_width,
-                          wave_peak_width,
-                          num_peaks,
-                          num_samples)
-    return -fft_contrast(signal,
-                         pixel_width,
-                         contrast_frequency)
-
-
-def maximum_frequency_ratio(pixel_width: float,
-                            wave_peak_width: float,
-                            num_peaks: int,
-                            num_samples: int,
-                            contrast_frequency: float) -> float:
-    optimum = minimize_scalar(model_neg_signal_fft_contrast,
-                              args=(pixel_width,
-                                    wave_peak_width,
-                                    num_peaks,
-                                    num_samples,
-                                    contrast_frequency),
-                              bounds=(0, pixel_width))
-    return -optimum.fun  # pyright: ignore[reportAttributeAccessIssue]
-
-
-class MedACRResolution(PhantomModule):
+    pixel_height, pixel_width = pixel_size
+
+    horizontal_max_contrast: float = 0
+    vertical_max_contrast: float = 0
+    contrast_frequency = 1 / (2 * POINT_SEP)
+    horizontal_line_length = math.floor(2
+                                        * NUM_PINS
+                                        * POINT_SEP
+                                        / pixel_width)
+
+    results: dict[str, float] = {}
+    results["best_contrast"] = 100 * best_contrast_ratio(pixel_width,
+                                                         POINT_SEP,
+                                                         NUM_PINS,
+                                                         horizontal_line_length,
+                                                         resolution_type,  # pyright: ignore[reportArgumentType]
+                                                         contrast_frequency)
+    lines: tuple[LineROI, LineROI] | None = None
+
+    if auto_position_lines:
+        roi = main_roi
+        image = roi.image
+
+        vertical_line_length = math.floor(2
+                                          * NUM_PINS
+                                          * POINT_SEP
+                                          / pixel_height)
+        line_min_vals = np.max(roi.pixel_array) * resolution_percentage / 100
+
+        horizontal_within_loc = math.ceil(2 * POINT_SEP / pixel_width)
+        vertical_within_loc = math.ceil(2 * POINT_SEP / pixel_height)
+
+        horizontal_progress = None
+        vertical_progress = None
+        if progress is not None:
+            horizontal_progress = partial(_scale_progress, progress, 0)
+            vertical_progress = partial(_scale_progress, progress, 0.5)
+
+        horizontal_angle: float = 0
+        vertical_angle: float = 0
+        horizontal_max_position: tuple[float, float]
+        vertical_max_position: tuple[float, float]
+        if refine_lines:
+            angles = np.arange(-MAX_LINE_ANGLE, MAX_LINE_ANGLE + LINE_ANGLE_STEP / 2, LINE_ANGLE_STEP)
+            horizontal_max_contrast, horizontal_max_position, horizontal_angle = refined_line(
+                roi.pixel_array,
+                horizontal_line_length,
+                "horizontal",
+                pixel_size,
+                line_min_vals,
+                angles,
+                resolution_type,
+                contrast_frequency,
+                horizontal_within_loc,
+                horizontal_progress)
+            vertical_max_contrast, vertical_max_position, vertical_angle = refined_line(
+                roi.pixel_array,
+                vertical_line_length,
+                "vertical",
+                pixel_size,
+                line_min_vals,
+                angles,
+                resolution_type,
+                contrast_frequency,
+                vertical_within_loc,
+                vertical_progress)
+        else:
+            horizontal_max_contrast, horizontal_max_position = search_lines(
+                roi.pixel_array,
+                horizontal_line_length,
+                "horizontal",
+                pixel_width,
+                line_min_vals,
+                resolution_type,  # pyright: ignore[reportArgumentType]
+                contrast_frequency=contrast_frequency,
+                gating="ends",
+                within_loc=horizontal_within_loc,
+                progress=horizontal_progress)
+            vertical_max_contrast, vertical_max_position = search_lines(
+                roi.pixel_array,
+                vertical_line_length,
+                "vertical",
+                pixel_height,
+                line_min_vals,
+                resolution_type,  # pyright: ignore[reportArgumentType]
+                contrast_frequency=contrast_frequency,
+                gating="ends",
+                within_loc=vertical_within_loc,
+                progress=vertical_progress)
+
+        lines = (grid_line(image,
+                           roi,
+                           horizontal_max_position,
+                           horizontal_line_length,
+                           "horizontal",
+                           horizontal_angle),
+                 grid_line(image,
+                           roi,
+                           vertical_max_position,
+                           vertical_line_length,
+                           "vertical",
+                           vertical_angle))
+
+    else:
+        if (horizontal_line is None
+                or vertical_line is None):
+            return results, lines
+        horizontal_max_contrast = line_contrast(horizontal_line,
+                                                pixel_width,
+                                                contrast_frequency,
+                                                resolution_type)
+        vertical_max_contrast = line_contrast(vertical_line,
+                                              pixel_height,
+                                              contrast_frequency,
+                                              resolution_type)
+
+    h_contrast = 100 * float(horizontal_max_contrast)
+    v_contrast = 100 * float(vertical_max_contrast)
+
+    if phase_dir == "ROW":
+        results["phase_contrast"] = h_contrast
+        results["freq_contrast"] = v_contrast
+    else:
+        results["phase_contrast"] = v_contrast
+        results["freq_contrast"] = h_contrast
+    results["total_contrast"] = (h_contrast + v_contrast) / 2
+
+    return results, lines
+
+
+class MedACRResolution(MedACRModule):
     """
     Calculates the contrast of the 1mm resolution insert.
     """
@@ -214,11 +395,11 @@ class MedACRResolution(PhantomModule):
 
     viewer = MonochromeDicomViewerField(row=0, column=0)
 
-    auto_position_lines = BoolField()
-    resolution_percentage = PercField(50)
-    resolution_type = OptionField[str](options_map={"FFT Method": "FFT",
-                                                    "Contrast Method": "contrast"},
-                                       initial="FFT Method")
+    auto_position_lines = BoolField(DEFAULT_AUTO_POSITION)
+    refine_lines = BoolField(DEFAULT_REFINE, verbose_name="Sub-pixel Line Refinement")
+    resolution_percentage = PercField(DEFAULT_PERCENTAGE)
+    resolution_type = OptionField[str](options_map=resolution_types,
+                                       initial=DEFAULT_RESOLUTION_TYPE)
 
     pixel_size_vertical = FloatField(read_only=True)
     pixel_size_horizontal = FloatField(read_only=True)
@@ -250,10 +431,7 @@ class MedACRResolution(PhantomModule):
         else:
             return
 
-        if context.inserts_slice == 10:
-            image = image.instances[10]
-        else:
-            image = image.instances[0]
+        image = image.instances[inserts_slices(context)[0]]
 
         self.viewer.load_image(image)
 
@@ -266,83 +444,14 @@ class MedACRResolution(PhantomModule):
         self.pixel_size_horizontal = pixel_width
         self.pixel_size_vertical = pixel_height
 
-        phase_dir = image.get_value(MRTags.InPlanePhaseEncodingDirection, True)
-        if phase_dir is not None:
-            self.phase_dir = phase_dir
-        else:
-            self.phase_dir = ""
-
-        box_height = BOX_SIDE_LENGTH / pixel_height
-        box_width = BOX_SIDE_LENGTH / pixel_width
-
-        x_offset = 0
-        y_offset = 0
-        horizontal_dir = ["U", "L"]
-        vertical_dir = ["D", "R"]
-
-        if context.res_insert_side == "right":
-            x_offset = BOX_Y_OFFSET / pixel_width
-            horizontal_dir[1] = "R"
-            vertical_dir[1] = "L"
-        elif context.res_insert_side == "left":
-            x_offset = -BOX_Y_OFFSET / pixel_width - box_width
-            horizontal_dir[1] = "L"
-            vertical_dir[1] = "R"
-        elif context.res_insert_side == "top":
-            y_offset = -BOX_Y_OFFSET / pixel_height - box_height
-            horizontal_dir[0] = "D"
-            vertical_dir[0] = "U"
-        else:
-            y_offset = BOX_Y_OFFSET / pixel_height
-            horizontal_dir[0] = "U"
-            vertical_dir[0] = "D"
-
-        if context.circle_insert_side == "top":
-            y_offset = BOX_X_OFFSET / pixel_height
-            horizontal_dir[0] = "D"
-            vertical_dir[0] = "U"
-        elif context.circle_insert_side == "bottom":
-            y_offset = -BOX_X_OFFSET / pixel_height - box_width
-            horizontal_dir[0] = "U"
-            vertical_dir[0] = "D"
-        elif context.circle_insert_side == "right":
-            x_offset = -BOX_X_OFFSET / pixel_width - box_width
-            horizontal_dir[1] = "R"
-            vertical_dir[1] = "L"
-        else:
-            x_offset = BOX_X_OFFSET / pixel_width
-            horizontal_dir[1] = "L"
-            vertical_dir[1] = "R"
-
-        box_xmin = round(context.xcent + x_offset)
-        box_ymin = round(context.ycent + y_offset)
-        box_height = round(box_height)
-        box_width = round(box_width)
-
-        self.main_roi.register_roi(RectangleROI(image,
-                                                box_xmin,
-                                                box_ymin,
-                                                box_width,
-                                                box_height))
-
-        horizontal_line_length = math.floor(2
-                                            * NUM_PINS
-                                            * POINT_SEP
-                                            / self.pixel_size_horizontal)
-        vertical_line_length = math.floor(2
-                                          * NUM_PINS
-                                          * POINT_SEP
-                                          / self.pixel_size_vertical)
-        self.horizontal_line.register_roi(LineROI(image,
-                                                  box_xmin,
-                                                  box_ymin,
-                                                  box_xmin + horizontal_line_length - 1,
-                                                  box_ymin))
-        self.vertical_line.register_roi(LineROI(image,
-                                                box_xmin,
-                                                box_ymin,
-                                                box_xmin,
-                                                box_ymin + vertical_line_length - 1))
+        self.phase_dir = phase_direction(image)
+
+        main_roi, horizontal_line, vertical_line = resolution_rois(image,
+                                                                   context,
+                                                                   (pixel_height, pixel_width))
+        self.main_roi.register_roi(main_roi)
+        self.horizontal_line.register_roi(horizontal_line)
+        self.vertical_line.register_roi(vertical_line)
 
     def post_roi_register(self, roi_input: LineROIField | RectangleROIField):
         if (roi_input.roi is not None
@@ -350,117 +459,28 @@ class MedACRResolution(PhantomModule):
                 and roi_input in self.rois):
             self.manager.add_roi(roi_input.roi)
 
-    def analyse(self, batch: bool = False):
-        horizontal_max_contrast: float = 0
-        vertical_max_contrast: float = 0
-        contrast_frequency = 1 / (2 * POINT_SEP)
-        horizontal_line_length = math.floor(2
-                                            * NUM_PINS
-                                            * POINT_SEP
-                                            / self.pixel_size_horizontal)
-
-        if self.resolution_type == "FFT":
-            self.best_contrast = 100 * maximum_frequency_ratio(self.pixel_size_horizontal,
-                                                               POINT_SEP,
-                                                               NUM_PINS,
-                                                               horizontal_line_length,
-                                                               contrast_frequency)
-        else:
-            self.best_contrast = 100 * maximum_contrast_ratio(self.pixel_size_horizontal,
-                                                              POINT_SEP,
-                                                              NUM_PINS,
-                                                              horizontal_line_length)
-
-        if self.auto_position_lines:
-            if self.viewer.image is not None:
-                image = self.viewer.image
-            else:
-                return
-
-            if self.main_roi.roi is not None:
-                roi = self.main_roi.roi
-            else:
-                return
-
-            horizontal_max_position: tuple[int, int] = 0, 0
-            vertical_max_position: tuple[int, int] = 0, 0
-            vertical_line_length = math.floor(2
-                                              * NUM_PINS
-                                              * POINT_SEP
-                                              / self.pixel_size_vertical)
-            xmax = roi.width - horizontal_line_length
-            ymax = roi.height - vertical_line_length
-            line_min_vals = np.max(roi.pixel_array) * self.resolution_percentage / 100
-
-            for x in range(roi.width):
-                for y in range(roi.height):
-                    if x <= xmax:
-                        profile = roi.pixel_array[y, x:x + horizontal_line_length]
-                        pin_locs: np.ndarray[tuple[int, ...],
-                                             np.dtypes.BoolDType] = profile >= line_min_vals
-                        within_loc = math.ceil(2 * POINT_SEP / self.pixel_size_horizontal)
-                        if (np.sum(pin_locs[:within_loc]) >= 1
-                                and np.sum(pin_locs[-within_loc:]) >= 1):
-                            if self.resolution_type == "FFT":
-                                contrast = fft_contrast(profile,
-                                                        self.pixel_size_horizontal,
-                                                        contrast_frequency)
-                            else:
-                                contrast = get_contrast(profile)
-                            if contrast > horizontal_max_contrast:
-                                horizontal_max_contrast = contrast
-                                horizontal_max_position = x, y
-                    if y <= ymax:
-                        profile = roi.pixel_array[y:y + vertical_line_length, x]
-                        pin_locs: np.ndarray[tuple[int, ...],
-                                             np.dtypes.BoolDType] = profile >= line_min_vals
-                        within_loc = math.ceil(2 * POINT_SEP / self.pixel_size_vertical)
-                        if (np.sum(pin_locs[:within_loc]) >= 1
-                                and np.sum(pin_locs[-within_loc:]) >= 1):
-                            if self.resolution_type == "FFT":
-                                contrast = fft_contrast(profile,
-                                                        self.pixel_size_vertical,
-                                                        contrast_frequency)
-                            else:
-                                contrast = get_contrast(profile)
-                            if contrast > vertical_max_contrast:
-                                vertical_max_contrast = contrast
-                                vertical_max_position = x, y
-
-            # -1 required to keep line length as line ROI ends are included
-            self.horizontal_line.register_roi(LineROI(image,
-                                                      horizontal_max_position[0] + roi.xmin,
-                                                      horizontal_max_position[1] + roi.ymin,
-                                                      horizontal_max_position[0] + horizontal_line_length + roi.xmin - 1,
-                                                      horizontal_max_position[1] + roi.ymin))
-            self.vertical_line.register_roi(LineROI(image,
-                                                    vertical_max_position[0] + roi.xmin,
-                                                    vertical_max_position[1] + roi.ymin,
-                                                    vertical_max_position[0] + roi.xmin,
-                                                    vertical_max_position[1] + vertical_line_length + roi.ymin - 1))
-
-        else:
-            if (self.horizontal_line.roi is None
-                    or self.vertical_line.roi is None):
-                return
-            elif self.resolution_type == "FFT":
-                horizontal_max_contrast = fft_contrast(self.horizontal_line.roi.profile,  # pyright: ignore[reportArgumentType]
-                                                       self.pixel_size_horizontal,
-                                                       contrast_frequency)
-                vertical_max_contrast = fft_contrast(self.vertical_line.roi.profile,  # pyright: ignore[reportArgumentType]
-                                                     self.pixel_size_vertical,
-                                                     contrast_frequency)
-            else:
-                horizontal_max_contrast = get_contrast(self.horizontal_line.roi.profile)  # pyright: ignore[reportArgumentType]
-                vertical_max_contrast = get_contrast(self.vertical_line.roi.profile)  # pyright: ignore[reportArgumentType]
-
-        h_contrast = 100 * horizontal_max_contrast
-        v_contrast = 100 * vertical_max_contrast
-
-        if self.phase_dir == "ROW":
-            self.phase_contrast = h_contrast
-            self.freq_contrast = v_contrast
-        else:
-            self.phase_contrast = v_contrast
-            self.freq_contrast = h_contrast
-        self.total_contrast = (h_contrast + v_contrast) / 2
+    def get_analysis(self,
+                     progress: AnalysisProgress | None = None
+                     ) -> Callable[[], tuple[dict[str, float], tuple[LineROI, LineROI] | None]] | None:
+        if self.main_roi.roi is None:
+            return None
+
+        return partial(resolution_contrasts,
+                       self.main_roi.roi,
+                       self.horizontal_line.roi,  # pyright: ignore[reportArgumentType]
+                       self.vertical_line.roi,  # pyright: ignore[reportArgumentType]
+                       (self.pixel_size_vertical, self.pixel_size_horizontal),
+                       self.phase_dir,
+                       self.auto_position_lines,
+                       self.refine_lines,
+                       self.resolution_percentage,
+                       self.resolution_type,
+                       progress)
+
+    def set_results(self, results: tuple[dict[str, float], tuple[LineROI, LineROI] | None]) -> None:
+        contrasts, lines = results
+        if lines is not None:
+            self.horizontal_line.register_roi(lines[0])
+            self.vertical_line.register_roi(lines[1])
+
+        super().set_results(contrasts)
@@ -3,18 +3,19 @@ Calculates the contrast of the 1 mm resolution insert.
 """
 import math
 import numpy as np
-from scipy.optimize import minimize_scalar
 
-from pumpia.module_handling.modules import PhantomModule
 from pumpia.module_handling.fields.roi_fields import LineROIField, RectangleROIField
 from pumpia.module_handling.fields.viewer_fields import MonochromeDicomViewerField
 from pumpia.module_handling.fields.simple import PercField, FloatField, BoolField, StringField
 from pumpia.image_handling.roi_structures import RectangleROI, LineROI
 from pumpia.file_handling.dicom_structures import Series, Instance
-from pumpia.file_handling.dicom_tags import MRTags
-from pumpia.utilities.array_utils import nth_max_bounds
 
+from pumpia_acr_med.acquisition import acquisition_parameters
+from pumpia_acr_med.med_acr_module import MedACRModule
 from pumpia_acr_med.med_acr_context import MedACRContextManager, MedACRContext
+from pumpia_acr_med.resolution_utils import (get_contrast,
+                                             search_lines,
+                                             best_contrast_ratio)
 
 BOX_Y_OFFSET = 28
 BOX_X_OFFSET = -5
@@ -24,137 +25,7 @@ POINT_SEP = 1
 NUM_PINS = 4
 
 
-def get_contrast(profile: np.ndarray[tuple[int], np.dtype]) -> float:
-    """
-    Get the contrast for a line profile from the 1mm ACR resolution insert
-    """
-    bounds = nth_max_bounds(profile, 2)
-    if profile[math.floor(bounds.minimum)] > profile[math.floor(bounds.minimum)]:
-        start = math.floor(bounds.minimum)
-    else:
-        start = math.floor(bounds.minimum)
-
-    if profile[math.floor(bounds.maximum)] > profile[math.floor(bounds.maximum)]:
-        end = math.floor(bounds.maximum)
-    else:
-        end = math.floor(bounds.maximum)
-
-    new_prof = profile[start:end + 1]
-    minimum = np.min(new_prof)
-    maximum = np.max(new_prof)
-    half_maximum = (maximum + minimum) / 2
-    mins = list(np.argwhere(new_prof < half_maximum)[:, 0])
-
-    if end - start in mins:
-        mins.remove(end - start)
-    if 0 in mins:
-        mins.remove(0)
-
-    if len(mins) == 0:
-        return 0
-
-    troughs: list[list[int]] = [[mins[0]]]
-    prev_min = mins[0]
-
-    for m in mins[1:]:
-        if m == prev_min + 1:
-            troughs[-1].append(m)
-        else:
-            troughs.append([m])
-        prev_min = m
-
-    contrasts = []
-    prev_t = 0
-    for trough_num, trough in enumerate(troughs):
-        if trough_num + 1 < len(troughs):
-            next_t = min(troughs[trough_num + 1])
-        else:
-            next_t = len(new_prof)
-        left_peak_val = np.mean(new_prof[prev_t:min(trough)])
-        right_peak_val = np.mean(new_prof[max(trough) + 1:next_t])
-        peak_val = (left_peak_val + right_peak_val) / 2
-        trough_val = np.mean(new_prof[min(trough):max(trough) + 1])
-        contrasts.append((peak_val - trough_val) / (peak_val + trough_val))
-
-    return min(contrasts)
-
-
-def square_wave_integral(x: np.ndarray | float, width: float = 1, offset: float = 0):
-    """
-    The integral of a square wave from 0 to x.
-    The square wave is defined by
-
-    1 (0 < x mod 2*width < width)
-    0 (width < x mod 2*width < 2*width)
-
-
-    Parameters
-    ----------
-    x : np.ndarray | float
-    width : float, optional
-        Width of a peak of the square wave.
-        The wavelength is 2*width.
-    offset : float, optional
-        The offset of the square wave.
-        If a mutiple of 2*width then it is equivelant to 0.
-
-    Returns
-    -------
-    The integral of the square wave up to x.
-    """
-    x = ((x - offset) / (2 * width)) - 0.5
-    zero_pt = ((0 - offset) / (2 * width)) - 0.5
-    integral = (width
-                * ((np.abs(0.5 + (x % 1))
-                    + np.abs(0.5 - (x % 1))
-                    + np.floor(x))
-                    + (np.abs(0.5 + (zero_pt % 1))
-                       + np.abs(0.5 - (zero_pt % 1))
-                       + np.floor(zero_pt))))
-    return integral
-
-
-def model_signal(offset: float,
-                 pixel_width: float,
-                 wave_peak_width: float,
-                 num_peaks: int,
-                 num_samples: int) -> np.ndarray:
-    points = np.arange(0, num_samples + 1, 1) * pixel_width
-    raw_signal = square_wave_integral(points, wave_peak_width, offset)
-    raw_signal[points < offset] = square_wave_integral(offset, wave_peak_width, offset)
-    max_point = offset + 2 * wave_peak_width * num_peaks
-    raw_signal[points > max_point] = square_wave_integral(max_point, wave_peak_width, offset)
-    signal = np.diff(raw_signal)
-    return signal
-
-
-def model_neg_signal_contrast(offset: float,
-                              pixel_width: float,
-                              wave_peak_width: float,
-                              num_peaks: int,
-                              num_samples: int,) -> float:
-    signal = model_signal(offset,
-                          pixel_width,
-                          wave_peak_width,
-                          num_peaks,
-                          num_samples)
-    return -get_contrast(signal)
-
-
-def maximum_contrast_ratio(pixel_width: float,
-                           wave_peak_width: float,
-                           num_peaks: int,
-                           num_samples: int) -> float:
-    optimum = minimize_scalar(model_neg_signal_contrast,
-                              args=(pixel_width,
-                                    wave_peak_width,
-                                    num_peaks,
-                                    num_samples),
-                              bounds=(0, pixel_width))
-    return -optimum.fun  # pyright: ignore[reportAttributeAccessIssue]
-
-
-class MedACRContrastResolution(PhantomModule):
+class MedACRContrastResolution(MedACRModule):
     """
     Calculates the contrast of the 1mm resolution insert.
     """
@@ -214,7 +85,7 @@ class MedACRContrastResolution(PhantomModule):
         self.pixel_size_horizontal = pixel_width
         self.pixel_size_vertical = pixel_height
 
-        phase_dir = image.get_value(MRTags.InPlanePhaseEncodingDirection, True)
+        phase_dir = acquisition_parameters(image).phase_encoding_direction
         if phase_dir is not None:
             self.phase_dir = phase_dir
         else:
@@ -312,8 +183,6 @@ class MedACRContrastResolution(PhantomModule):
             else:
                 return
 
-            horizontal_max_position: tuple[int, int] = 0, 0
-            vertical_max_position: tuple[int, int] = 0, 0
             horizontal_line_length = math.floor(2
                                                 * NUM_PINS
                                                 * POINT_SEP
@@ -322,32 +191,33 @@ class MedACRContrastResolution(PhantomModule):
                                               * NUM_PINS
                                               * POINT_SEP
                                               / self.pixel_size_vertical)
-            xmax = roi.width - horizontal_line_length
-            ymax = roi.height - vertical_line_length
             line_min_vals = np.max(roi.pixel_array) * self.resolution_percentage / 100
 
             self.best_contrast = (100
-                                  * maximum_contrast_ratio(self.pixel_size_horizontal,
-                                                           POINT_SEP,
-                                                           NUM_PINS,
-                                                           horizontal_line_length))
-
-            for x in range(roi.width):
-                for y in range(roi.height):
-                    if x <= xmax:
-                        profile = roi.pixel_array[y, x:x + horizontal_line_length]
-                        if np.count_nonzero(profile >= line_min_vals) >= NUM_PINS:
-                            contrast = get_contrast(profile)
-                            if contrast > horizontal_max_contrast:
-                                horizontal_max_contrast = contrast
-                                horizontal_max_position = x, y
-                    if y <= ymax:
-                        profile = roi.pixel_array[y:y + vertical_line_length, x]
-                        if np.count_nonzero(profile >= line_min_vals) >= NUM_PINS:
-                            contrast = get_contrast(profile)
-                            if contrast > vertical_max_contrast:
-                                vertical_max_contrast = contrast
-                                vertical_max_position = x, y
+                                  * best_contrast_ratio(self.pixel_size_horizontal,
+                                                        POINT_SEP,
+                                                        NUM_PINS,
+                                                        horizontal_line_length,
+                                                        "contrast"))
+
+            horizontal_max_contrast, horizontal_max_position = search_lines(
+                roi.pixel_array,
+                horizontal_line_length,
+                "horizontal",
+                self.pixel_size_horizontal,
+                line_min_vals,
+                "contrast",
+                gating="count",
+                num_pins=NUM_PINS)
+            vertical_max_contrast, vertical_max_position = search_lines(
+                roi.pixel_array,
+                vertical_line_length,
+                "vertical",
+                self.pixel_size_vertical,
+                line_min_vals,
+                "contrast",
+                gating="count",
+                num_pins=NUM_PINS)
 
             # -1 required to keep line length as line ROI ends are included
             self.horizontal_line.register_roi(LineROI(image,
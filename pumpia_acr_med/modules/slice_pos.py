@@ -3,10 +3,11 @@ Slice postition for Medium ACR Phantom.
 
 Slice position is given in absolute offset, not the distance measured by the bars.
 """
+from collections.abc import Callable
+from functools import partial
 import numpy as np
 import matplotlib.pyplot as plt
 
-from pumpia.module_handling.modules import PhantomModule
 from pumpia.module_handling.fields.roi_fields import RectangleROIField
 from pumpia.module_handling.fields.viewer_fields import MonochromeDicomViewerField
 from pumpia.module_handling.fields.simple import FloatField, StringField
@@ -14,7 +15,9 @@ from pumpia.image_handling.roi_structures import RectangleROI
 from pumpia.file_handling.dicom_structures import Series, Instance
 from pumpia.utilities.array_utils import nth_max_positions
 
+from pumpia_acr_med.med_acr_module import AnalysisProgress, MedACRModule
 from pumpia_acr_med.med_acr_context import MedACRContextManager, MedACRContext
+from pumpia_acr_med.context_utils import inserts_slices
 
 ROI_OFFSET = 55
 ROI_WIDTH = 2
@@ -23,7 +26,192 @@ LEFT_OFFSET = -5
 RIGHT_OFFSET = 1
 
 
-class MedACRSlicePosition(PhantomModule):
+def wedge_rois(image1: Instance,
+               image2: Instance,
+               context: MedACRContext,
+               pixel_size: tuple[float, float]
+               ) -> tuple[RectangleROI, RectangleROI, RectangleROI, RectangleROI, str, str]:
+    """
+    Returns the ROIs across the slice position wedges.
+
+    Parameters
+    ----------
+    image1 : Instance
+        The slice containing the inserts.
+    image2 : Instance
+        The slice at the other end of the phantom.
+    context : MedACRContext
+    pixel_size : tuple[float, float]
+        The (row, column) pixel size.
+
+    Returns
+    -------
+    tuple[RectangleROI, RectangleROI, RectangleROI, RectangleROI, str, str]
+        The left and right wedge ROIs on `image1`, the left and right wedge ROIs on `image2`,
+        the wedge direction ("Horizontal" or "Vertical") and the side of the wedges.
+    """
+    pixel_height, pixel_width = pixel_size
+
+    if context.res_insert_side == "right" or context.res_insert_side == "left":
+        wedge_dir = "Horizontal"
+        box_height = ROI_WIDTH / pixel_height
+        box_width = ROI_HEIGHT / pixel_width
+        left_pix_offset = LEFT_OFFSET / pixel_height
+        right_pix_offset = RIGHT_OFFSET / pixel_height
+        roi_pix_offset = ROI_OFFSET / pixel_width
+
+        if context.res_insert_side == "right":
+            wedge_side = "left"
+            left_xmin = right_xmin = round(context.xcent - box_width - roi_pix_offset)
+            left_xmax = right_xmax = round(context.xcent + box_width - roi_pix_offset)
+            left_ymin = round(context.ycent + left_pix_offset)
+            left_ymax = round(context.ycent + left_pix_offset + box_height)
+            right_ymin = round(context.ycent + right_pix_offset)
+            right_ymax = round(context.ycent + right_pix_offset + box_height)
+        else:
+            wedge_side = "right"
+            left_xmin = right_xmin = round(context.xcent - box_width + roi_pix_offset)
+            left_xmax = right_xmax = round(context.xcent + box_width + roi_pix_offset)
+            left_ymin = round(context.ycent - left_pix_offset - box_height)
+            left_ymax = round(context.ycent - left_pix_offset)
+            right_ymin = round(context.ycent - right_pix_offset - box_height)
+            right_ymax = round(context.ycent - right_pix_offset)
+    else:
+        wedge_dir = "Vertical"
+        box_height = ROI_HEIGHT / pixel_height
+        box_width = ROI_WIDTH / pixel_width
+        left_pix_offset = LEFT_OFFSET / pixel_width
+        right_pix_offset = RIGHT_OFFSET / pixel_width
+        roi_pix_offset = ROI_OFFSET / pixel_height
+
+        if context.res_insert_side == "bottom":
+            wedge_side = "top"
+            left_ymin = right_ymin = round(context.ycent - box_height - roi_pix_offset)
+            left_ymax = right_ymax = round(context.ycent + box_height - roi_pix_offset)
+
+            left_xmin = round(context.xcent + left_pix_offset)
+            left_xmax = round(context.xcent + left_pix_offset + box_width)
+            right_xmin = round(context.xcent + right_pix_offset)
+            right_xmax = round(context.xcent + right_pix_offset + box_width)
+        else:
+            wedge_side = "bottom"
+            left_ymin = right_ymin = round(context.ycent - box_height + roi_pix_offset)
+            left_ymax = right_ymax = round(context.ycent + box_height + roi_pix_offset)
+            left_xmin = round(context.xcent - left_pix_offset - box_width)
+            left_xmax = round(context.xcent - left_pix_offset)
+            right_xmin = round(context.xcent - right_pix_offset - box_width)
+            right_xmax = round(context.xcent - right_pix_offset)
+
+    left_roi = RectangleROI(image1,
+                            left_xmin,
+                            left_ymin,
+                            left_xmax - left_xmin,
+                            left_ymax - left_ymin,
+                            slice_num=image1.current_slice,
+                            replace=True)
+    right_roi = RectangleROI(image1,
+                             right_xmin,
+                             right_ymin,
+                             right_xmax - right_xmin,
+                             right_ymax - right_ymin,
+                             slice_num=image1.current_slice,
+                             replace=True)
+
+    return (left_roi,
+            right_roi,
+            left_roi.copy_to_image(image2, image2.current_slice, replace=True),
+            right_roi.copy_to_image(image2, image2.current_slice, replace=True),
+            wedge_dir,
+            wedge_side)
+
+
+def wedge_profiles(slice_1_left_wedge: RectangleROI,
+                   slice_1_right_wedge: RectangleROI,
+                   slice_11_left_wedge: RectangleROI,
+                   slice_11_right_wedge: RectangleROI,
+                   wedge_dir: str,
+                   pixel_spacing: tuple[float, float]
+                   ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, float]:
+    """
+    Returns the profiles along the wedges and the pixel size along them.
+    """
+    if wedge_dir[0].lower() == "h":
+        return (slice_1_left_wedge.h_profile,
+                slice_1_right_wedge.h_profile,
+                slice_11_left_wedge.h_profile,
+                slice_11_right_wedge.h_profile,
+                pixel_spacing[1])
+    return (slice_1_left_wedge.v_profile,
+            slice_1_right_wedge.v_profile,
+            slice_11_left_wedge.v_profile,
+            slice_11_right_wedge.v_profile,
+            pixel_spacing[0])
+
+
+def slice_positions(slice_1_left_wedge: RectangleROI,
+                    slice_1_right_wedge: RectangleROI,
+                    slice_11_left_wedge: RectangleROI,
+                    slice_11_right_wedge: RectangleROI,
+                    wedge_dir: str,
+                    wedge_side: str,
+                    pixel_spacing: tuple[float, float]) -> dict[str, float]:
+    """
+    Calculates the slice positions from the half maximum positions along the wedges.
+
+    Parameters
+    ----------
+    slice_1_left_wedge : RectangleROI
+    slice_1_right_wedge : RectangleROI
+    slice_11_left_wedge : RectangleROI
+    slice_11_right_wedge : RectangleROI
+    wedge_dir : str
+        The wedge direction as given by `wedge_rois`.
+    wedge_side : str
+        The side of the wedges as given by `wedge_rois`.
+    pixel_spacing : tuple[float, float]
+        The (row, column) pixel size.
+
+    Returns
+    -------
+    dict[str, float]
+        The results, keyed by `MedACRSlicePosition` field name.
+    """
+    (slice_1_left_prof,
+     slice_1_right_prof,
+     slice_11_left_prof,
+     slice_11_right_prof,
+     pix_size) = wedge_profiles(slice_1_left_wedge,
+                                slice_1_right_wedge,
+                                slice_11_left_wedge,
+                                slice_11_right_wedge,
+                                wedge_dir,
+                                pixel_spacing)
+
+    slice_11_left_nth_max = nth_max_positions(slice_11_left_prof, 2)
+    slice_11_right_nth_max = nth_max_positions(slice_11_right_prof, 2)
+    slice_1_left_nth_max = nth_max_positions(slice_1_left_prof, 2)
+    slice_1_right_nth_max = nth_max_positions(slice_1_right_prof, 2)
+
+    if wedge_side == "left" or wedge_side == "top":
+        slice_11_left_hm = slice_11_left_nth_max[0]
+        slice_11_right_hm = slice_11_right_nth_max[0]
+        slice_1_left_hm = slice_1_left_nth_max[0]
+        slice_1_right_hm = slice_1_right_nth_max[0]
+    else:
+        slice_11_left_hm = -slice_11_left_nth_max[-1]
+        slice_11_right_hm = -slice_11_right_nth_max[-1]
+        slice_1_left_hm = -slice_1_left_nth_max[-1]
+        slice_1_right_hm = -slice_1_right_nth_max[-1]
+
+    slice_1_bar_diff = (slice_1_right_hm - slice_1_left_hm) * pix_size
+    slice_11_bar_diff = (slice_11_right_hm - slice_11_left_hm) * pix_size
+    return {"slice_1_bar_diff": slice_1_bar_diff,
+            "slice_1_pos": slice_1_bar_diff / 2,
+            "slice_11_bar_diff": slice_11_bar_diff,
+            "slice_11_pos": slice_11_bar_diff / 2}
+
+
+class MedACRSlicePosition(MedACRModule):
     """
     Calculates slice position for the medium ACR phantom.
 
@@ -68,12 +256,9 @@ class MedACRSlicePosition(PhantomModule):
         else:
             return
 
-        if context.inserts_slice == 10:
-            image1 = image.instances[10]
-            image2 = image.instances[0]
-        else:
-            image1 = image.instances[0]
-            image2 = image.instances[10]
+        slice1, slice2 = inserts_slices(context)
+        image1 = image.instances[slice1]
+        image2 = image.instances[slice2]
 
         self.viewer1.load_image(image1)
         self.viewer2.load_image(image2)
@@ -81,86 +266,20 @@ class MedACRSlicePosition(PhantomModule):
         pixel_size = image.pixel_spacing
         if pixel_size is None:
             return
-        pixel_height = pixel_size[0]
-        pixel_width = pixel_size[1]
-
-        if context.res_insert_side == "right" or context.res_insert_side == "left":
-            self.wedge_dir = "Horizontal"
-            box_height = ROI_WIDTH / pixel_height
-            box_width = ROI_HEIGHT / pixel_width
-            left_pix_offset = LEFT_OFFSET / pixel_height
-            right_pix_offset = RIGHT_OFFSET / pixel_height
-
-            if context.res_insert_side == "right":
-                self.wedge_side = "left"
-                left_xmin = right_xmin = round(context.xcent - box_width - ROI_OFFSET)
-                left_xmax = right_xmax = round(context.xcent + box_width - ROI_OFFSET)
-                left_ymin = round(context.ycent + left_pix_offset)
-                left_ymax = round(context.ycent + left_pix_offset + box_height)
-                right_ymin = round(context.ycent + right_pix_offset)
-                right_ymax = round(context.ycent + right_pix_offset + box_height)
-            else:
-                self.wedge_side = "right"
-                left_xmin = right_xmin = round(context.xcent - box_width + ROI_OFFSET)
-                left_xmax = right_xmax = round(context.xcent + box_width + ROI_OFFSET)
-                left_ymin = round(context.ycent - left_pix_offset - box_height)
-                left_ymax = round(context.ycent - left_pix_offset)
-                right_ymin = round(context.ycent - right_pix_offset - box_height)
-                right_ymax = round(context.ycent - right_pix_offset)
-        else:
-            self.wedge_dir = "Vertical"
-            box_height = ROI_HEIGHT / pixel_height
-            box_width = ROI_WIDTH / pixel_width
-            left_pix_offset = LEFT_OFFSET / pixel_width
-            right_pix_offset = RIGHT_OFFSET / pixel_width
-
-            if context.res_insert_side == "bottom":
-                self.wedge_side = "top"
-                left_ymin = right_ymin = round(context.ycent - box_height - ROI_OFFSET)
-                left_ymax = right_ymax = round(context.ycent + box_height - ROI_OFFSET)
-
-                left_xmin = round(context.xcent + left_pix_offset)
-                left_xmax = round(context.xcent + left_pix_offset + box_width)
-                right_xmin = round(context.xcent + right_pix_offset)
-                right_xmax = round(context.xcent + right_pix_offset + box_width)
-            else:
-                self.wedge_side = "bottom"
-                left_ymin = right_ymin = round(context.ycent - box_width + ROI_OFFSET)
-                left_ymax = right_ymax = round(context.ycent + box_width + ROI_OFFSET)
-                left_xmin = round(context.xcent - left_pix_offset - box_width)
-                left_xmax = round(context.xcent - left_pix_offset)
-                right_xmin = round(context.xcent - right_pix_offset - box_width)
-                right_xmax = round(context.xcent - right_pix_offset)
-
-        left_roi = RectangleROI(image1,
-                                left_xmin,
-                                left_ymin,
-                                left_xmax - left_xmin,
-                                left_ymax - left_ymin,
-                                slice_num=image1.current_slice,
-                                replace=True)
-        self.slice_1_left_wedge.register_roi(left_roi)
-        if self.slice_1_left_wedge.roi is not None:
-            self.slice_11_left_wedge.register_roi(
-                self.slice_1_left_wedge.roi.copy_to_image(
-                    image2,
-                    image2.current_slice,
-                    replace=True))
-
-        right_roi = RectangleROI(image1,
-                                 right_xmin,
-                                 right_ymin,
-                                 right_xmax - right_xmin,
-                                 right_ymax - right_ymin,
-                                 slice_num=image1.current_slice,
-                                 replace=True)
-        self.slice_1_right_wedge.register_roi(right_roi)
-        if self.slice_1_right_wedge.roi is not None:
-            self.slice_11_right_wedge.register_roi(
-                self.slice_1_right_wedge.roi.copy_to_image(
-                    image2,
-                    image2.current_slice,
-                    replace=True))
+
+        (slice_1_left,
+         slice_1_right,
+         slice_11_left,
+         slice_11_right,
+         self.wedge_dir,
+         self.wedge_side) = wedge_rois(image1,
+                                       image2,
+                                       context,
+                                       (pixel_size[0], pixel_size[1]))
+        self.slice_1_left_wedge.register_roi(slice_1_left)
+        self.slice_11_left_wedge.register_roi(slice_11_left)
+        self.slice_1_right_wedge.register_roi(slice_1_right)
+        self.slice_11_right_wedge.register_roi(slice_11_right)
 
     def post_roi_register(self, roi_input: RectangleROIField):
         if (roi_input.roi is not None
@@ -174,7 +293,9 @@ class MedACRSlicePosition(PhantomModule):
         self.slice_11_left_wedge.viewer = self.viewer2
         self.slice_11_right_wedge.viewer = self.viewer2
 
-    def analyse(self, batch: bool = False):
+    def get_analysis(self,
+                     progress: AnalysisProgress | None = None
+                     ) -> Callable[[], dict[str, float]] | None:
         if (self.slice_11_left_wedge.roi is not None
             and self.slice_11_right_wedge.roi is not None
             and self.slice_1_left_wedge.roi is not None
@@ -183,45 +304,22 @@ class MedACRSlicePosition(PhantomModule):
             if isinstance(self.slice_1_right_wedge.roi.image, (Instance, Series)):
                 pixel_spacing = self.slice_1_right_wedge.roi.image.pixel_spacing
                 if pixel_spacing is None:
-                    return
-            else:
-                return
-
-            if self.wedge_dir[0].lower() == "h":
-                slice_11_left_prof = self.slice_11_left_wedge.roi.h_profile
-                slice_11_right_prof = self.slice_11_right_wedge.roi.h_profile
-                slice_1_left_prof = self.slice_1_left_wedge.roi.h_profile
-                slice_1_right_prof = self.slice_1_right_wedge.roi.h_profile
-                pix_size = pixel_spacing[1]
-            else:
-                slice_11_left_prof = self.slice_11_left_wedge.roi.v_profile
-                slice_11_right_prof = self.slice_11_right_wedge.roi.v_profile
-                slice_1_left_prof = self.slice_1_left_wedge.roi.v_profile
-                slice_1_right_prof = self.slice_1_right_wedge.roi.v_profile
-                pix_size = pixel_spacing[0]
-
-            slice_11_left_nth_max = nth_max_positions(slice_11_left_prof, 2)
-            slice_11_right_nth_max = nth_max_positions(slice_11_right_prof, 2)
-            slice_1_left_nth_max = nth_max_positions(slice_1_left_prof, 2)
-            slice_1_right_nth_max = nth_max_positions(slice_1_right_prof, 2)
-
-            if self.wedge_side == "left" or self.wedge_side == "top":
-                slice_11_left_hm = slice_11_left_nth_max[0]
-                slice_11_right_hm = slice_11_right_nth_max[0]
-                slice_1_left_hm = slice_1_left_nth_max[0]
-                slice_1_right_hm = slice_1_right_nth_max[0]
+                    return None
             else:
-                slice_11_left_hm = -slice_11_left_nth_max[-1]
-                slice_11_right_hm = -slice_11_right_nth_max[-1]
-                slice_1_left_hm = -slice_1_left_nth_max[-1]
-                slice_1_right_hm = -slice_1_right_nth_max[-1]
-
-            self.slice_1_bar_diff = (slice_1_right_hm - slice_1_left_hm) * pix_size
-            self.slice_1_pos = self.slice_1_bar_diff / 2
-            self.slice_11_bar_diff = (slice_11_right_hm - slice_11_left_hm) * pix_size
-            self.slice_11_pos = self.slice_11_bar_diff / 2
+                return None
+
+            return partial(slice_positions,
+                           self.slice_1_left_wedge.roi,
+                           self.slice_1_right_wedge.roi,
+                           self.slice_11_left_wedge.roi,
+                           self.slice_11_right_wedge.roi,
+                           self.wedge_dir,
+                           self.wedge_side,
+                           (pixel_spacing[0], pixel_spacing[1]))
+        return None
 
     def load_commands(self):
+        super().load_commands()
         self.register_command("Show Profiles", self.show_profiles)
 
     def show_profiles(self):
@@ -240,18 +338,16 @@ class MedACRSlicePosition(PhantomModule):
             else:
                 return
 
-            if self.wedge_dir[0].lower() == "h":
-                slice_11_left_prof = self.slice_11_left_wedge.roi.h_profile
-                slice_11_right_prof = self.slice_11_right_wedge.roi.h_profile
-                slice_1_left_prof = self.slice_1_left_wedge.roi.h_profile
-                slice_1_right_prof = self.slice_1_right_wedge.roi.h_profile
-                pix_size = pixel_spacing[1]
-            else:
-                slice_11_left_prof = self.slice_11_left_wedge.roi.v_profile
-                slice_11_right_prof = self.slice_11_right_wedge.roi.v_profile
-                slice_1_left_prof = self.slice_1_left_wedge.roi.v_profile
-                slice_1_right_prof = self.slice_1_right_wedge.roi.v_profile
-                pix_size = pixel_spacing[0]
+            (slice_1_left_prof,
+             slice_1_right_prof,
+             slice_11_left_prof,
+             slice_11_right_prof,
+             pix_size) = wedge_profiles(self.slice_1_left_wedge.roi,
+                                        self.slice_1_right_wedge.roi,
+                                        self.slice_11_left_wedge.roi,
+                                        self.slice_11_right_wedge.roi,
+                                        self.wedge_dir,
+                                        (pixel_spacing[0], pixel_spacing[1]))
 
             locs = np.indices(slice_11_left_prof.shape)[0] * pix_size / 2
 
@@ -7,7 +7,6 @@ import numpy as np
 from scipy.optimize import curve_fit
 import matplotlib.pyplot as plt
 
-from pumpia.module_handling.modules import PhantomModule
 from pumpia.module_handling.fields.roi_fields import RectangleROIField
 from pumpia.module_handling.fields.viewer_fields import MonochromeDicomViewerField
 from pumpia.module_handling.fields.simple import (PercField,
@@ -19,19 +18,227 @@ from pumpia.file_handling.dicom_structures import Series, Instance
 from pumpia.utilities.array_utils import nth_max_widest_peak
 from pumpia.utilities.feature_utils import flat_top_gauss, split_gauss
 
+from pumpia_acr_med.med_acr_module import AnalysisProgress, MedACRModule
 from pumpia_acr_med.med_acr_context import MedACRContextManager, MedACRContext
+from pumpia_acr_med.context_utils import inserts_slices
 
 # ROI sizes in mm
 ROI_HEIGHT = 2
 ROI_WIDTH = 120
 BOTTOM_OFFSET = 0.5
 TOP_OFFSET = -3.5
+DEFAULT_TAN_THETA = 0.1
+DEFAULT_MAX_PERC = 50
+DEFAULT_FIT_TYPE = "Flat Top Gaussian"
 
 fit_options: dict[str, Callable] = {"Flat Top Gaussian": flat_top_gauss,
                                     "Split Gaussian": split_gauss}
 
 
-class MedACRSliceWidth(PhantomModule):
+def slice_width_rois(image: Instance,
+                     context: MedACRContext,
+                     pixel_size: tuple[float, float]) -> tuple[RectangleROI, RectangleROI, str]:
+    """
+    Returns the top ramp ROI, bottom ramp ROI and ramp direction ("Horizontal" or "Vertical").
+    """
+    pixel_height, pixel_width = pixel_size
+
+    if context.res_insert_side == "bottom" or context.res_insert_side == "top":
+        ramp_dir = "Horizontal"
+        box_height = ROI_HEIGHT / pixel_height
+        box_width = ROI_WIDTH / pixel_width
+        top_pix_offset = TOP_OFFSET / pixel_height
+        bottom_pix_offset = BOTTOM_OFFSET / pixel_height
+
+        top_xmin = bottom_xmin = round(context.xcent - box_width / 2)
+        top_xmax = bottom_xmax = round(context.xcent + box_width / 2)
+
+        if context.res_insert_side == "bottom":
+            top_ymin = round(context.ycent + top_pix_offset)
+            top_ymax = round(context.ycent + top_pix_offset + box_height)
+            bottom_ymin = round(context.ycent + bottom_pix_offset)
+            bottom_ymax = round(context.ycent + bottom_pix_offset + box_height)
+        else:
+            top_ymin = round(context.ycent - top_pix_offset - box_height)
+            top_ymax = round(context.ycent - top_pix_offset)
+            bottom_ymin = round(context.ycent - bottom_pix_offset - box_height)
+            bottom_ymax = round(context.ycent - bottom_pix_offset)
+    else:
+        ramp_dir = "Vertical"
+        box_height = ROI_HEIGHT / pixel_width
+        box_width = ROI_WIDTH / pixel_height
+        top_pix_offset = TOP_OFFSET / pixel_width
+        bottom_pix_offset = BOTTOM_OFFSET / pixel_width
+
+        top_ymin = bottom_ymin = round(context.ycent - box_width / 2)
+        top_ymax = bottom_ymax = round(context.ycent + box_width / 2)
+
+        if context.res_insert_side == "right":
+            top_xmin = round(context.xcent + top_pix_offset)
+            top_xmax = round(context.xcent + top_pix_offset + box_height)
+            bottom_xmin = round(context.xcent + bottom_pix_offset)
+            bottom_xmax = round(context.xcent + bottom_pix_offset + box_height)
+        else:
+            top_xmin = round(context.xcent - top_pix_offset - box_height)
+            top_xmax = round(context.xcent - top_pix_offset)
+            bottom_xmin = round(context.xcent - bottom_pix_offset - box_height)
+            bottom_xmax = round(context.xcent - bottom_pix_offset)
+
+    top_roi = RectangleROI(image,
+                           top_xmin,
+                           top_ymin,
+                           top_xmax - top_xmin,
+                           top_ymax - top_ymin,
+                           slice_num=image.current_slice,
+                           replace=True)
+
+    bottom_roi = RectangleROI(image,
+                              bottom_xmin,
+                              bottom_ymin,
+                              bottom_xmax - bottom_xmin,
+                              bottom_ymax - bottom_ymin,
+                              slice_num=image.current_slice,
+                              replace=True)
+
+    return top_roi, bottom_roi, ramp_dir
+
+
+def ramp_profiles(top_roi: RectangleROI,
+                  bottom_roi: RectangleROI,
+                  ramp_dir: str,
+                  pixel_spacing: tuple[float, float]) -> tuple[np.ndarray, np.ndarray, float]:
+    """
+    Returns the top and bottom profiles along the ramps and the pixel size along them.
+    """
+    if ramp_dir[0].lower() == "v":
+        return top_roi.v_profile, bottom_roi.v_profile, pixel_spacing[0]
+    return top_roi.h_profile, bottom_roi.h_profile, pixel_spacing[1]
+
+
+def slice_widths(top_prof: np.ndarray,
+                 bottom_prof: np.ndarray,
+                 pix_size: float,
+                 tan_theta: float = 0.1,
+                 max_perc: float = 50,
+                 fit_type: Callable = flat_top_gauss,
+                 progress: Callable[[float], None] | None = None) -> dict[str, float]:
+    """
+    Calculates the slice width from the profiles along the top and bottom ramps.
+    If `progress` is given it is called with the fraction of the two fits done.
+
+    Parameters
+    ----------
+    top_prof : np.ndarray
+        The profile along the top ramp.
+    bottom_prof : np.ndarray
+        The profile along the bottom ramp.
+    pix_size : float
+        The pixel size along the ramps.
+    tan_theta : float, optional
+        The tan of the ramp angle (default is 0.1).
+    max_perc : float, optional
+        The width is measured at this percentage of the maximum of the fit (default is 50).
+    fit_type : Callable, optional
+        The function fitted to the profiles, from `fit_options` (default is flat_top_gauss).
+    progress : Callable[[float], None] | None, optional
+        Called with the fraction of the fits done (default is None).
+
+    Returns
+    -------
+    dict[str, float]
+        The results, keyed by `MedACRSliceWidth` field name.
+    """
+    if fit_type is split_gauss:
+        # reciprocal would require a negative in c_coeff
+        divisor = 100 / max_perc
+        c_coeff = math.sqrt(2 * math.log(divisor))
+
+        top_fwhm_peak = nth_max_widest_peak(top_prof, divisor)
+        bottom_fwhm_peak = nth_max_widest_peak(bottom_prof, divisor)
+        bounds = ([0, 0, 0, -np.inf, -np.inf],
+                  [np.inf, np.inf, np.inf, np.inf, np.inf])
+
+        top_init = (top_fwhm_peak.minimum,
+                    top_fwhm_peak.maximum,
+                    (top_fwhm_peak.maximum - top_fwhm_peak.minimum) / 4,
+                    np.max(top_prof) - np.min(top_prof),
+                    np.min(top_prof))
+        top_indeces = np.indices(top_prof.shape)[0]
+        top_fit, _ = curve_fit(split_gauss,
+                               top_indeces,
+                               top_prof,
+                               top_init,
+                               bounds=bounds)
+        top_fwhm = abs(top_fit[1] - top_fit[0]) + (2 * c_coeff * top_fit[2])
+        if progress is not None:
+            progress(0.5)
+
+        bottom_init = (bottom_fwhm_peak.minimum,
+                       bottom_fwhm_peak.maximum,
+                       (bottom_fwhm_peak.maximum - bottom_fwhm_peak.minimum) / 4,
+                       np.max(bottom_prof) - np.min(bottom_prof),
+                       np.min(bottom_prof))
+        bottom_indeces = np.indices(bottom_prof.shape)[0]
+        bottom_fit, _ = curve_fit(split_gauss,
+                                  bottom_indeces,
+                                  bottom_prof,
+                                  bottom_init,
+                                  bounds=bounds)
+        bottom_fwhm = abs(bottom_fit[1] - bottom_fit[0]) + (2 * c_coeff * bottom_fit[2])
+
+        top_width = top_fwhm * tan_theta * pix_size
+        bottom_width = bottom_fwhm * tan_theta * pix_size
+
+    else:
+        # reciprocal would require a negative in coeffs
+        divisor = 100 / max_perc
+
+        top_fwhm_peak = nth_max_widest_peak(top_prof, divisor)
+        bottom_fwhm_peak = nth_max_widest_peak(bottom_prof, divisor)
+        bounds = ([0, 0, -np.inf, 0, -np.inf],
+                  [np.inf, np.inf, np.inf, np.inf, np.inf])
+
+        top_init = ((top_fwhm_peak.maximum + top_fwhm_peak.minimum) / 2,
+                    (top_fwhm_peak.maximum - top_fwhm_peak.minimum) / 2,
+                    np.max(top_prof) - np.min(top_prof),
+                    1,
+                    np.min(top_prof))
+        top_indeces = np.indices(top_prof.shape)[0]
+        top_fit, _ = curve_fit(flat_top_gauss,
+                               top_indeces,
+                               top_prof,
+                               top_init,
+                               bounds=bounds)
+        top_coeff = math.sqrt(2 * math.pow(math.log(divisor), 1 / top_fit[3]))
+        top_fwhm = 2 * top_coeff * top_fit[1]
+        if progress is not None:
+            progress(0.5)
+
+        bottom_init = ((bottom_fwhm_peak.maximum + bottom_fwhm_peak.minimum) / 2,
+                       (bottom_fwhm_peak.maximum - bottom_fwhm_peak.minimum) / 2,
+                       np.max(bottom_prof) - np.min(bottom_prof),
+                       1,
+                       np.min(bottom_prof))
+        bottom_indeces = np.indices(bottom_prof.shape)[0]
+        bottom_fit, _ = curve_fit(flat_top_gauss,
+                                  bottom_indeces,
+                                  bottom_prof,
+                                  bottom_init,
+                                  bounds=bounds)
+        bottom_coeff = math.sqrt(2 * math.pow((2 * math.log(divisor)), 1 / bottom_fit[3]))
+        bottom_fwhm = 2 * bottom_coeff * bottom_fit[1]
+
+        top_width = abs(top_fwhm * tan_theta * pix_size)
+        bottom_width = abs(bottom_fwhm * tan_theta * pix_size)
+
+    if progress is not None:
+        progress(1)
+    return {"top_ramp_width": top_width,
+            "bottom_ramp_width": bottom_width,
+            "slice_width": math.sqrt(top_width * bottom_width)}
+
+
+class MedACRSliceWidth(MedACRModule):
     """
     Calculates slice width for the medium ACR phantom by fitting to a flat top gaussian.
 
@@ -45,9 +252,9 @@ class MedACRSliceWidth(PhantomModule):
 
     viewer = MonochromeDicomViewerField(row=0, column=0)
 
-    tan_theta = FloatField(0.1, verbose_name="Tan of ramp angle")
-    max_perc = PercField(50, verbose_name="Width position (% of max)")
-    fit_type = OptionField(fit_options, "Flat Top Gaussian")
+    tan_theta = FloatField(DEFAULT_TAN_THETA, verbose_name="Tan of ramp angle")
+    max_perc = PercField(DEFAULT_MAX_PERC, verbose_name="Width position (% of max)")
+    fit_type = OptionField(fit_options, DEFAULT_FIT_TYPE)
 
     ramp_dir = StringField(verbose_name="Ramp Direction", read_only=True)
 
@@ -72,10 +279,7 @@ class MedACRSliceWidth(PhantomModule):
         if isinstance(self.viewer.image, Instance):
             image = self.viewer.image
         elif isinstance(self.viewer.image, Series):
-            if context.inserts_slice == 10:
-                image = self.viewer.image.instances[10]
-            else:
-                image = self.viewer.image.instances[0]
+            image = self.viewer.image.instances[inserts_slices(context)[0]]
         else:
             return
 
@@ -87,63 +291,10 @@ class MedACRSliceWidth(PhantomModule):
 
         self.expected_width = pixel_size[0]
 
-        if context.res_insert_side == "bottom" or context.res_insert_side == "top":
-            self.ramp_dir = "Horizontal"
-            box_height = ROI_HEIGHT / pixel_height
-            box_width = ROI_WIDTH / pixel_width
-            top_pix_offset = TOP_OFFSET / pixel_height
-            bottom_pix_offset = BOTTOM_OFFSET / pixel_height
-
-            top_xmin = bottom_xmin = round(context.xcent - box_width / 2)
-            top_xmax = bottom_xmax = round(context.xcent + box_width / 2)
-
-            if context.res_insert_side == "bottom":
-                top_ymin = round(context.ycent + top_pix_offset)
-                top_ymax = round(context.ycent + top_pix_offset + box_height)
-                bottom_ymin = round(context.ycent + bottom_pix_offset)
-                bottom_ymax = round(context.ycent + bottom_pix_offset + box_height)
-            else:
-                top_ymin = round(context.ycent - top_pix_offset - box_height)
-                top_ymax = round(context.ycent - top_pix_offset)
-                bottom_ymin = round(context.ycent - bottom_pix_offset - box_height)
-                bottom_ymax = round(context.ycent - bottom_pix_offset)
-        else:
-            self.ramp_dir = "Vertical"
-            box_height = ROI_HEIGHT / pixel_width
-            box_width = ROI_WIDTH / pixel_height
-            top_pix_offset = TOP_OFFSET / pixel_width
-            bottom_pix_offset = BOTTOM_OFFSET / pixel_width
-
-            top_ymin = bottom_ymin = round(context.ycent - box_width / 2)
-            top_ymax = bottom_ymax = round(context.ycent + box_width / 2)
-
-            if context.res_insert_side == "right":
-                top_xmin = round(context.xcent + top_pix_offset)
-                top_xmax = round(context.xcent + top_pix_offset + box_height)
-                bottom_xmin = round(context.xcent + bottom_pix_offset)
-                bottom_xmax = round(context.xcent + bottom_pix_offset + box_height)
-            else:
-                top_xmin = round(context.xcent - top_pix_offset - box_height)
-                top_xmax = round(context.xcent - top_pix_offset)
-                bottom_xmin = round(context.xcent - bottom_pix_offset - box_height)
-                bottom_xmax = round(context.xcent - bottom_pix_offset)
-
-        top_roi = RectangleROI(image,
-                               top_xmin,
-                               top_ymin,
-                               top_xmax - top_xmin,
-                               top_ymax - top_ymin,
-                               slice_num=image.current_slice,
-                               replace=True)
+        top_roi, bottom_roi, self.ramp_dir = slice_width_rois(image,
+                                                              context,
+                                                              (pixel_height, pixel_width))
         self.top_ramp.register_roi(top_roi)
-
-        bottom_roi = RectangleROI(image,
-                                  bottom_xmin,
-                                  bottom_ymin,
-                                  bottom_xmax - bottom_xmin,
-                                  bottom_ymax - bottom_ymin,
-                                  slice_num=image.current_slice,
-                                  replace=True)
         self.bottom_ramp.register_roi(bottom_roi)
 
     def post_roi_register(self, roi_input: RectangleROIField):
@@ -152,121 +303,46 @@ class MedACRSliceWidth(PhantomModule):
                 and (roi_input is self.top_ramp or roi_input is self.bottom_ramp)):
             self.manager.add_roi(roi_input.roi)
 
-    def analyse(self, batch: bool = False):
+    def get_analysis(self,
+                     progress: AnalysisProgress | None = None
+                     ) -> Callable[[], dict[str, float]] | None:
         if (self.top_ramp.roi is not None
             and self.bottom_ramp.roi is not None
                 and self.viewer.image is not None):
             pixel_spacing = self.viewer.image.pixel_spacing
             if pixel_spacing is None:
-                return
-            if self.ramp_dir[0].lower() == "v":
-                top_prof = self.top_ramp.roi.v_profile
-                bottom_prof = self.bottom_ramp.roi.v_profile
-                pix_size = pixel_spacing[0]
-            else:
-                top_prof = self.top_ramp.roi.h_profile
-                bottom_prof = self.bottom_ramp.roi.h_profile
-                pix_size = pixel_spacing[1]
+                return None
 
             slice_thickness = self.viewer.image.slice_thickness
             if slice_thickness is None:
-                return
+                return None
             self.expected_width = slice_thickness
 
-            if self.fit_type is split_gauss:
-                # reciprocal would require a negative in c_coeff
-                divisor = 100 / self.max_perc
-                c_coeff = math.sqrt(2 * math.log(divisor))
-
-                top_fwhm_peak = nth_max_widest_peak(top_prof, divisor)
-                bottom_fwhm_peak = nth_max_widest_peak(bottom_prof, divisor)
-                bounds = ([0, 0, 0, -np.inf, -np.inf],
-                          [np.inf, np.inf, np.inf, np.inf, np.inf])
-
-                top_init = (top_fwhm_peak.minimum,
-                            top_fwhm_peak.maximum,
-                            (top_fwhm_peak.maximum - top_fwhm_peak.minimum) / 4,
-                            np.max(top_prof) - np.min(top_prof),
-                            np.min(top_prof))
-                top_indeces = np.indices(top_prof.shape)[0]
-                top_fit, _ = curve_fit(split_gauss,
-                                       top_indeces,
-                                       top_prof,
-                                       top_init,
-                                       bounds=bounds)
-                top_fwhm = abs(top_fit[1] - top_fit[0]) + (2 * c_coeff * top_fit[2])
-
-                bottom_init = (bottom_fwhm_peak.minimum,
-                               bottom_fwhm_peak.maximum,
-                               (bottom_fwhm_peak.maximum - bottom_fwhm_peak.minimum) / 4,
-                               np.max(bottom_prof) - np.min(bottom_prof),
-                               np.min(bottom_prof))
-                bottom_indeces = np.indices(bottom_prof.shape)[0]
-                bottom_fit, _ = curve_fit(split_gauss,
-                                          bottom_indeces,
-                                          bottom_prof,
-                                          bottom_init,
-                                          bounds=bounds)
-                bottom_fwhm = abs(bottom_fit[1] - bottom_fit[0]) + (2 * c_coeff * bottom_fit[2])
-
-                tan_theta = self.tan_theta
-
-                top_width = top_fwhm * tan_theta * pix_size
-                bottom_width = bottom_fwhm * tan_theta * pix_size
-
-                self.top_ramp_width = top_width
-                self.bottom_ramp_width = bottom_width
-
-                self.slice_width = math.sqrt(top_width * bottom_width)
-
-            else:
-                # reciprocal would require a negative in coeffs
-                divisor = 100 / self.max_perc
-
-                top_fwhm_peak = nth_max_widest_peak(top_prof, divisor)
-                bottom_fwhm_peak = nth_max_widest_peak(bottom_prof, divisor)
-                bounds = ([0, 0, -np.inf, 0, -np.inf],
-                          [np.inf, np.inf, np.inf, np.inf, np.inf])
-
-                top_init = ((top_fwhm_peak.maximum + top_fwhm_peak.minimum) / 2,
-                            (top_fwhm_peak.maximum - top_fwhm_peak.minimum) / 2,
-                            np.max(top_prof) - np.min(top_prof),
-                            1,
-                            np.min(top_prof))
-                top_indeces = np.indices(top_prof.shape)[0]
-                top_fit, _ = curve_fit(flat_top_gauss,
-                                       top_indeces,
-                                       top_prof,
-                                       top_init,
-                                       bounds=bounds)
-                top_coeff = math.sqrt(2 * math.pow(math.log(divisor), 1 / top_fit[3]))
-                top_fwhm = 2 * top_coeff * top_fit[1]
-
-                bottom_init = ((bottom_fwhm_peak.maximum + bottom_fwhm_peak.minimum) / 2,
-                               (bottom_fwhm_peak.maximum - bottom_fwhm_peak.minimum) / 2,
-                               np.max(bottom_prof) - np.min(bottom_prof),
-                               1,
-                               np.min(bottom_prof))
-                bottom_indeces = np.indices(bottom_prof.shape)[0]
-                bottom_fit, _ = curve_fit(flat_top_gauss,
-                                          bottom_indeces,
-                                          bottom_prof,
-                                          bottom_init,
-                                          bounds=bounds)
-                bottom_coeff = math.sqrt(2 * math.pow((2 * math.log(divisor)), 1 / bottom_fit[3]))
-                bottom_fwhm = 2 * bottom_coeff * bottom_fit[1]
-
-                tan_theta = self.tan_theta
-
-                top_width = abs(top_fwhm * tan_theta * pix_size)
-                bottom_width = abs(bottom_fwhm * tan_theta * pix_size)
-
-                self.top_ramp_width = top_width
-                self.bottom_ramp_width = bottom_width
-
-                self.slice_width = math.sqrt(top_width * bottom_width)
+            top_roi = self.top_ramp.roi
+            bottom_roi = self.bottom_ramp.roi
+            ramp_dir = self.ramp_dir
+            tan_theta = self.tan_theta
+            max_perc = self.max_perc
+            fit_type = self.fit_type
+
+            def analysis() -> dict[str, float]:
+                top_prof, bottom_prof, pix_size = ramp_profiles(top_roi,
+                                                                bottom_roi,
+                                                                ramp_dir,
+                                                                (pixel_spacing[0], pixel_spacing[1]))
+                return slice_widths(top_prof,
+                                    bottom_prof,
+                                    pix_size,
+                                    tan_theta,
+                                    max_perc,
+                                    fit_type,
+                                    progress)
+
+            return analysis
+        return None
 
     def load_commands(self):
+        super().load_commands()
         self.register_command("Show Profiles", self.show_profiles)
 
     def show_profiles(self):
@@ -279,14 +355,10 @@ class MedACRSliceWidth(PhantomModule):
             pixel_spacing = self.viewer.image.pixel_spacing
             if pixel_spacing is None:
                 return
-            if self.ramp_dir[0].lower() == "v":
-                top_prof = self.top_ramp.roi.v_profile
-                bottom_prof = self.bottom_ramp.roi.v_profile
-                pix_size = pixel_spacing[0]
-            else:
-                top_prof = self.top_ramp.roi.h_profile
-                bottom_prof = self.bottom_ramp.roi.h_profile
-                pix_size = pixel_spacing[1]
+            top_prof, bottom_prof, pix_size = ramp_profiles(self.top_ramp.roi,
+                                                            self.bottom_ramp.roi,
+                                                            self.ramp_dir,
+                                                            (pixel_spacing[0], pixel_spacing[1]))
 
             tan_theta = self.tan_theta
 
@@ -0,0 +1,381 @@
+"""
+Temporal stability module for medium ACR phantom
+"""
+import hashlib
+import json
+from collections.abc import Callable, Iterable, Sequence
+from functools import partial
+from pathlib import Path
+import numpy as np
+import matplotlib.pyplot as plt
+
+from pumpia.module_handling.fields.roi_fields import EllipseROIField
+from pumpia.module_handling.fields.viewer_fields import MonochromeDicomViewerField
+from pumpia.module_handling.fields.simple import (PercField,
+                                                  FloatField,
+                                                  IntField)
+from pumpia.file_handling.dicom_structures import Series, Instance
+from pumpia.file_handling.dicom_tags import MRTags
+
+from pumpia_acr_med.acquisition import acquisition_parameters
+from pumpia_acr_med.med_acr_module import AnalysisProgress, MedACRModule
+from pumpia_acr_med.med_acr_context import MedACRContextManager, MedACRContext
+from pumpia_acr_med.context_utils import uniform_slice
+from pumpia_acr_med.lazy_series import read_frame
+from pumpia_acr_med.modules.sub_snr import snr_roi
+
+# order of the polynomial removed from each pixel and the ROI mean before finding the fluctuations
+DRIFT_ORDER = 2
+
+
+class StabilityData:
+    """
+    The maps and curves from `temporal_stability`, used for plotting.
+
+    Attributes
+    ----------
+    tsnr_map : np.ndarray
+        The temporal SNR of each pixel after removing its drift.
+    times : np.ndarray
+        The time of each frame in seconds.
+    roi_means : np.ndarray
+        The mean of the ROI in each frame.
+    linear_fit : np.ndarray
+    quadratic_fit : np.ndarray
+        The fits of `roi_means` over time.
+    frequencies : np.ndarray
+        The frequencies of `spectrum` in Hz.
+    spectrum : np.ndarray
+        The amplitude spectrum of `roi_means` after removing the quadratic fit,
+        as a percentage of the mean signal.
+    """
+
+    def __init__(self,
+                 tsnr_map: np.ndarray,
+                 times: np.ndarray,
+                 roi_means: np.ndarray,
+                 linear_fit: np.ndarray,
+                 quadratic_fit: np.ndarray,
+                 frequencies: np.ndarray,
+                 spectrum: np.ndarray):
+        self.tsnr_map: np.ndarray = tsnr_map
+        self.times: np.ndarray = times
+        self.roi_means: np.ndarray = roi_means
+        self.linear_fit: np.ndarray = linear_fit
+        self.quadratic_fit: np.ndarray = quadratic_fit
+        self.frequencies: np.ndarray = frequencies
+        self.spectrum: np.ndarray = spectrum
+
+
+def drift_basis(num_frames: int, order: int = DRIFT_ORDER) -> np.ndarray[tuple[int, int], np.dtype]:
+    """
+    Returns orthonormal polynomials up to `order` over `num_frames` time points,
+    as a `(num_frames, order + 1)` array with the constant first.
+    """
+    times = np.linspace(-1, 1, num_frames)
+    basis, _ = np.linalg.qr(np.vander(times, order + 1, increasing=True))
+    return basis
+
+
+def temporal_stability(frames: Iterable[np.ndarray],
+                       num_frames: int,
+                       mask: np.ndarray,
+                       repetition_time: float = 1,
+                       progress: AnalysisProgress | None = None) -> tuple[dict[str, float], StabilityData]:
+    """
+    Calculates the temporal stability of a time series of the same slice.
+
+    The frames are used one at a time and not kept, so the memory used is that of a few frames
+    whatever the length of the series.
+    For the temporal SNR map the projection of each pixel onto `drift_basis` and its sum of squares
+    are accumulated, the residual after removing the drift is found from these once all frames are read.
+    The frames are taken from the first before accumulating so the sum of squares does not lose precision.
+
+    Parameters
+    ----------
+    frames : Iterable[np.ndarray]
+        The 2D frames in time order.
+    num_frames : int
+        The number of frames, more than `DRIFT_ORDER` + 1.
+    mask : np.ndarray
+        The ROI mask, the same shape as the frames.
+    repetition_time : float, optional
+        The time between frames in seconds (default is 1).
+    progress : AnalysisProgress | None, optional
+        Given the fraction of frames read (default is None).
+
+    Returns
+    -------
+    tuple[dict[str, float], StabilityData]
+        The results keyed by `MedACRStability` field name, and the maps and curves.
+    """
+    if num_frames <= DRIFT_ORDER + 1:
+        raise ValueError(f"At least {DRIFT_ORDER + 2} frames are needed")
+    basis = drift_basis(num_frames)
+    roi_means = np.empty(num_frames)
+    reference: np.ndarray | None = None
+    projections: np.ndarray | None = None
+    sum_squares: np.ndarray | None = None
+
+    count = 0
+    for count, frame in enumerate(frames, start=1):
+        if count > num_frames:
+            raise ValueError(f"More than {num_frames} frames given")
+        values = np.asarray(frame, dtype=float)
+        roi_means[count - 1] = np.mean(values[mask])
+        if reference is None or projections is None or sum_squares is None:
+            reference = values
+            projections = np.zeros((DRIFT_ORDER + 1, *values.shape))
+            sum_squares = np.zeros(values.shape)
+        else:
+            offset = values - reference
+            sum_squares += offset ** 2
+            for order in range(DRIFT_ORDER + 1):
+                projections[order] += basis[count - 1, order] * offset
+        if progress is not None:
+            progress(count / num_frames)
+
+    if reference is None or projections is None or sum_squares is None or count != num_frames:
+        raise ValueError(f"{count} frames given, expected {num_frames}")
+
+    # the constant basis is 1 / sqrt(num_frames) so this is the mean offset from the first frame
+    mean_map = reference + projections[0] * basis[0, 0]
+    residual_map = np.maximum(sum_squares - np.sum(projections ** 2, axis=0), 0) / (num_frames - DRIFT_ORDER - 1)
+    noise_map = np.sqrt(residual_map)
+    tsnr_map = np.divide(mean_map, noise_map, out=np.zeros_like(mean_map), where=noise_map > 0)
+
+    times = np.arange(num_frames) * repetition_time
+    signal = float(np.mean(roi_means))
+    linear_fit = np.polyval(np.polyfit(times, roi_means, 1), times)
+    quadratic_fit = np.polyval(np.polyfit(times, roi_means, 2), times)
+    residual = roi_means - quadratic_fit
+    spectrum = np.abs(np.fft.rfft(residual)) * 2 / num_frames * 100 / signal
+    frequencies = np.fft.rfftfreq(num_frames, repetition_time)
+    peak = int(np.argmax(spectrum[1:])) + 1
+
+    results: dict[str, float] = {
+        "num_frames": num_frames,
+        "repetition_time": repetition_time,
+        "signal": signal,
+        "sfnr": float(np.mean(tsnr_map[mask])),
+        "fluctuation": float(np.std(residual)) / signal * 100,
+        "linear_drift": float(np.ptp(linear_fit)) / signal * 100,
+        "quadratic_drift": float(np.ptp(quadratic_fit)) / signal * 100,
+        "peak_to_peak": float(np.ptp(residual)) / signal * 100,
+        "peak_frequency": float(frequencies[peak]),
+        "peak_amplitude": float(spectrum[peak])}
+    data = StabilityData(tsnr_map,
+                         times,
+                         roi_means,
+                         linear_fit,
+                         quadratic_fit,
+                         frequencies,
+                         spectrum)
+    return results, data
+
+
+def stability_from_files(files: Sequence[Path],
+                         mask: np.ndarray,
+                         repetition_time: float = 1,
+                         progress: AnalysisProgress | None = None) -> tuple[dict[str, float], StabilityData]:
+    """
+    Runs `temporal_stability` on single frame DICOM files in time order,
+    reading one file at a time with `read_frame`.
+    """
+    return temporal_stability((read_frame(file) for file in files),
+                              len(files),
+                              mask,
+                              repetition_time,
+                              progress)
+
+
+def _image_position(image: Instance) -> tuple[float, ...] | None:
+    try:
+        return tuple(float(value) for value in image.get_value(MRTags.ImagePositionPatient, True))
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+def time_series_instances(image: Instance) -> list[Instance]:
+    """
+    Returns `image` at each time point of its series, in time order.
+
+    A dynamic series is either loaded as a series for each acquisition with the same series instance UID,
+    where the instance with the same index as `image` is used from each,
+    or as a single series where the instances at the same position as `image` are used.
+    """
+    series = image.series
+    acquisitions = sorted((s for s in series.study.series if s.series_id == series.series_id),
+                          key=lambda s: s.acquisition_number)
+    if len(acquisitions) > 1:
+        index = series.instances.index(image)
+        return [acquisition.instances[index]
+                for acquisition in acquisitions
+                if len(acquisition.instances) > index]
+
+    position = _image_position(image)
+    if position is None:
+        return list(series.instances)
+    return [instance for instance in series.instances if _image_position(instance) == position]
+
+
+class MedACRStability(MedACRModule):
+    """
+    Module for the temporal stability of a dynamic series of the medium ACR phantom.
+
+    The frames are read from the files one at a time through `read_frame`,
+    so the analysis only needs the memory of a few frames whatever the length of the series.
+    """
+    context_manager = MedACRContextManager()
+    show_draw_rois_button = True
+    show_analyse_button = True
+    title = "Temporal Stability"
+
+    viewer = MonochromeDicomViewerField(row=0, column=0)
+
+    size = PercField(70, verbose_name="Size (%)")
+
+    slice_used = IntField(read_only=True)
+    num_frames = IntField(verbose_name="Number of Frames",
+                          reset_on_analysis=True,
+                          read_only=True)
+    repetition_time = FloatField(verbose_name="Repetition Time (s)",
+                                 reset_on_analysis=True,
+                                 read_only=True)
+    signal = FloatField(reset_on_analysis=True,
+                        read_only=True)
+    sfnr = FloatField(verbose_name="Mean tSNR (SFNR)",
+                      reset_on_analysis=True,
+                      read_only=True)
+    fluctuation = FloatField(verbose_name="Fluctuation (%)",
+                             reset_on_analysis=True,
+                             read_only=True)
+    peak_to_peak = FloatField(verbose_name="Peak to Peak (%)",
+                              reset_on_analysis=True,
+                              read_only=True)
+    linear_drift = FloatField(verbose_name="Linear Drift (%)",
+                              reset_on_analysis=True,
+                              read_only=True)
+    quadratic_drift = FloatField(verbose_name="Quadratic Drift (%)",
+                                 reset_on_analysis=True,
+                                 read_only=True)
+    peak_frequency = FloatField(verbose_name="Spectrum Peak Frequency (Hz)",
+                                reset_on_analysis=True,
+                                read_only=True)
+    peak_amplitude = FloatField(verbose_name="Spectrum Peak Amplitude (%)",
+                                reset_on_analysis=True,
+                                read_only=True)
+
+    signal_roi = EllipseROIField("Stability ROI")
+
+    stability_data: StabilityData | None = None
+    _stability_key: str | None = None
+
+    def draw_rois(self, context: MedACRContext, batch: bool = False) -> None:
+        if isinstance(self.viewer.image, Instance):
+            image = self.viewer.image
+        elif isinstance(self.viewer.image, Series):
+            self.slice_used = uniform_slice(context)
+            image = self.viewer.image.instances[self.slice_used]
+        else:
+            return
+
+        self.viewer.load_image(image)
+        self.signal_roi.register_roi(snr_roi(image, context, self.size))
+
+    def link_rois_viewers(self):
+        self.signal_roi.viewer = self.viewer
+
+    def get_analysis(self,
+                     progress: AnalysisProgress | None = None
+                     ) -> Callable[[], tuple[dict[str, float], StabilityData]] | None:
+        roi = self.signal_roi.roi
+        if roi is None or not isinstance(roi.image, Instance):
+            return None
+
+        instances = time_series_instances(roi.image)
+        frame_time = acquisition_parameters(roi.image).repetition_time
+        if frame_time is None:
+            self.logger.warning("Repetition time not found, frequencies are per frame")
+            frame_time = 1
+        return partial(stability_from_files,
+                       [instance.filepath for instance in instances],
+                       roi.mask,
+                       frame_time,
+                       progress)
+
+    def set_results(self, results: tuple[dict[str, float], StabilityData]) -> None:
+        stability, self.stability_data = results
+        self._stability_key = self.cache_key()
+        super().set_results(stability)
+
+    def cache_key(self) -> str | None:
+        key = super().cache_key()
+        if (key is None
+            or self.signal_roi.roi is None
+                or not isinstance(self.signal_roi.roi.image, Instance)):
+            return key
+        # hashing the pixel data of every frame would read the series again, so the frames are identified instead
+        frames = [instance.id_string for instance in time_series_instances(self.signal_roi.roi.image)]
+        return hashlib.sha256(json.dumps([key, frames]).encode()).hexdigest()
+
+    def load_commands(self):
+        super().load_commands()
+        self.register_command("Show tSNR Map", self.show_tsnr_map)
+        self.register_command("Show Time Course", self.show_time_course)
+        self.register_command("Show Spectrum", self.show_spectrum)
+
+    def _get_stability_data(self) -> StabilityData | None:
+        """
+        Returns the maps and curves of the last analysis, calculating them if the results were cached.
+        """
+        if self.signal_roi.roi is None:
+            self.create_rois()
+        if self.stability_data is None or self._stability_key != self.cache_key():
+            analysis = self.get_analysis()
+            if analysis is None:
+                return None
+            _, self.stability_data = analysis()
+            self._stability_key = self.cache_key()
+        return self.stability_data
+
+    def show_tsnr_map(self):
+        """
+        Shows the temporal SNR of each pixel.
+        """
+        data = self._get_stability_data()
+        if data is not None:
+            plt.clf()
+            plt.imshow(data.tsnr_map, cmap='grey')
+            plt.colorbar()
+            plt.title("tSNR Map")
+            plt.show()
+
+    def show_time_course(self):
+        """
+        Shows the ROI mean of each frame and the linear and quadratic fits.
+        """
+        data = self._get_stability_data()
+        if data is not None:
+            plt.clf()
+            plt.plot(data.times, data.roi_means, label="ROI Mean")
+            plt.plot(data.times, data.linear_fit, label="Linear Fit")
+            plt.plot(data.times, data.quadratic_fit, label="Quadratic Fit")
+            plt.legend()
+            plt.xlabel("Time (s)")
+            plt.ylabel("Value")
+            plt.title("Time Course")
+            plt.show()
+
+    def show_spectrum(self):
+        """
+        Shows the amplitude spectrum of the ROI mean after removing the quadratic fit.
+        """
+        data = self._get_stability_data()
+        if data is not None:
+            plt.clf()
+            plt.plot(data.frequencies[1:], data.spectrum[1:])
+            plt.xlabel("Frequency (Hz)")
+            plt.ylabel("Amplitude (% of signal)")
+            plt.title("Spectrum")
+            plt.show()
@@ -1,11 +1,14 @@
 """
 Subtraction SNR module for medium ACR phantom
 """
+from collections.abc import Callable, Iterable, Sequence
+from functools import partial
+import hashlib
+import json
 import math
 import numpy as np
 import matplotlib.pyplot as plt
 
-from pumpia.module_handling.modules import PhantomModule
 from pumpia.module_handling.fields.roi_fields import EllipseROIField
 from pumpia.module_handling.fields.viewer_fields import MonochromeDicomViewerField
 from pumpia.module_handling.fields.simple import (PercField,
@@ -14,14 +17,389 @@ from pumpia.module_handling.fields.simple import (PercField,
                                                   IntField)
 from pumpia.image_handling.roi_structures import EllipseROI
 from pumpia.file_handling.dicom_structures import Series, Instance
-from pumpia.file_handling.dicom_tags import MRTags
 
+from pumpia_acr_med.acquisition import AcquisitionParameters, acquisition_parameters
+from pumpia_acr_med.med_acr_module import AnalysisProgress, MedACRModule, pixel_hash
 from pumpia_acr_med.med_acr_context import MedACRContextManager, MedACRContext
+from pumpia_acr_med.context_utils import uniform_slice, window_sums
+from pumpia_acr_med.stats_utils import RunningStats
 
+DEFAULT_SIZE = 70
+DEFAULT_REF_BANDWIDTH = 1
+DEFAULT_CORRECTION = True
 
-class MedACRSubSNR(PhantomModule):
+
+def snr_roi(image: Instance, context: MedACRContext, size: float) -> EllipseROI:
+    """
+    Returns the SNR ROI on `image`, an ellipse `size` percent of the phantom.
+    """
+    factor = size / 100
+    a = round(factor * context.x_length / 2)
+    b = round(factor * context.y_length / 2)
+    return EllipseROI(image,
+                      round(context.xcent),
+                      round(context.ycent),
+                      a,
+                      b,
+                      slice_num=image.current_slice)
+
+
+def _parameter_values(parameters: Sequence[AcquisitionParameters], name: str) -> np.ndarray:
+    """
+    Returns an attribute of each parameters as an array of floats, NaN where it is None.
+    """
+    return np.array([np.nan if getattr(p, name) is None else getattr(p, name) for p in parameters],
+                    dtype=float)
+
+
+def snr_correction_factors(parameters: Sequence[AcquisitionParameters],
+                           ref_bandwidth: float = 1,
+                           pix_size_bool: bool = True,
+                           bw_cor_bool: bool = True,
+                           avg_cor_bool: bool = True,
+                           pe_cor_bool: bool = True) -> dict[str, np.ndarray]:
+    """
+    Finds the SNR corrections for any number of series at once from their acquisition parameters.
+    See `subtraction_snr` for the parameters.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        The corrections of each series keyed by `MedACRSubSNR` field name,
+        and the product of the corrections keyed by "correction".
+        The pixel size correction is NaN where the slice thickness or pixel spacing are missing.
+    """
+    correction = np.ones(len(parameters))
+    factors: dict[str, np.ndarray] = {}
+
+    if pix_size_bool:
+        pixel_spacing = np.array([(np.nan, np.nan) if p.pixel_spacing is None else p.pixel_spacing
+                                  for p in parameters],
+                                 dtype=float).reshape(-1, 2)
+        px_cor = 1 / (_parameter_values(parameters, "slice_thickness") * np.prod(pixel_spacing, axis=1))
+        factors["pixel_size_cor"] = px_cor
+        correction *= np.where(np.isnan(px_cor), 1, px_cor)
+
+    if bw_cor_bool:
+        im_bw = _parameter_values(parameters, "pixel_bandwidth")
+        im_bw = np.where(np.isnan(im_bw), ref_bandwidth, im_bw)
+        factors["im_bw"] = im_bw
+        correction *= np.sqrt(im_bw / ref_bandwidth)
+
+    if avg_cor_bool:
+        im_av = _parameter_values(parameters, "averages")
+        avg_cor = 1 / np.sqrt(np.where(np.isnan(im_av), 1, im_av))
+        factors["avg_cor"] = avg_cor
+        correction *= avg_cor
+
+    if pe_cor_bool:
+        rows = np.array([p.phase_encoding_direction == "ROW" for p in parameters], dtype=bool)
+        num = np.where(rows,
+                       _parameter_values(parameters, "rows"),
+                       _parameter_values(parameters, "columns"))
+        im_pe = _parameter_values(parameters, "phase_encoding_steps")
+        sampled_pe = _parameter_values(parameters, "percent_sampling") * num
+        im_pe = np.where(np.isnan(im_pe), np.where(np.isnan(sampled_pe), 1, sampled_pe), im_pe)
+        pe_cor = 1 / np.sqrt(im_pe)
+        factors["pe_cor"] = pe_cor
+        correction *= pe_cor
+
+    factors["correction"] = correction
+    return factors
+
+
+def series_corrections(factors: dict[str, np.ndarray], index: int) -> tuple[dict[str, float], float]:
+    """
+    Returns the corrections of one series from `snr_correction_factors`.
+
+    Returns
+    -------
+    tuple[dict[str, float], float]
+        The correction results keyed by `MedACRSubSNR` field name, without those which are NaN,
+        and the product of the corrections.
+    """
+    corrections = {name: float(values[index])
+                   for name, values in factors.items()
+                   if name != "correction" and not np.isnan(values[index])}
+    return corrections, float(factors["correction"][index])
+
+
+def snr_corrections(image: Instance,
+                    ref_bandwidth: float = 1,
+                    pix_size_bool: bool = True,
+                    bw_cor_bool: bool = True,
+                    avg_cor_bool: bool = True,
+                    pe_cor_bool: bool = True) -> tuple[dict[str, float], float]:
+    """
+    Finds the SNR corrections for an image from the acquisition parameters of its series.
+    See `subtraction_snr` for the parameters and `series_corrections` for the return.
+    """
+    factors = snr_correction_factors([acquisition_parameters(image)],
+                                     ref_bandwidth,
+                                     pix_size_bool,
+                                     bw_cor_bool,
+                                     avg_cor_bool,
+                                     pe_cor_bool)
+    return series_corrections(factors, 0)
+
+
+def subtraction_snr(roi1: EllipseROI,
+                    roi2: EllipseROI,
+                    ref_bandwidth: float = 1,
+                    pix_size_bool: bool = True,
+                    bw_cor_bool: bool = True,
+                    avg_cor_bool: bool = True,
+                    pe_cor_bool: bool = True,
+                    corrections: tuple[dict[str, float], float] | None = None) -> dict[str, float]:
+    """
+    Calculates the subtraction method SNR from the same ROI on two repeated images.
+
+    Parameters
+    ----------
+    roi1 : EllipseROI
+        The ROI on the first image.
+    roi2 : EllipseROI
+        The ROI on the second image.
+    ref_bandwidth : float, optional
+        The reference bandwidth in Hz/px for the bandwidth correction (default is 1).
+    pix_size_bool : bool, optional
+        Apply the pixel size correction (default is True).
+    bw_cor_bool : bool, optional
+        Apply the bandwidth correction (default is True).
+    avg_cor_bool : bool, optional
+        Apply the averages correction (default is True).
+    pe_cor_bool : bool, optional
+        Apply the phase encode correction (default is True).
+    corrections : tuple[dict[str, float], float] | None, optional
+        The corrections from `snr_corrections` or `series_corrections`,
+        if None they are found from the image of `roi1` (default is None).
+
+    Returns
+    -------
+    dict[str, float]
+        The results, keyed by `MedACRSubSNR` field name.
+    """
+    results: dict[str, float] = {}
+    roi_sum = roi1.pixel_values + roi2.pixel_values
+    roi_sub = np.array(roi1.pixel_values) - np.array(roi2.pixel_values)
+    sum_roi = np.mean(roi_sum)
+    if isinstance(sum_roi, float):
+        results["signal"] = sum_roi
+    roi_noise = np.std(roi_sub) / math.sqrt(2)
+    if isinstance(roi_noise, float):
+        results["noise"] = roi_noise
+    snr = sum_roi / roi_noise
+    if isinstance(snr, float):
+        results["snr"] = snr
+
+    cor_snr = snr
+
+    image = roi1.image
+    if corrections is None and isinstance(image, Instance):
+        corrections = snr_corrections(image,
+                                      ref_bandwidth,
+                                      pix_size_bool,
+                                      bw_cor_bool,
+                                      avg_cor_bool,
+                                      pe_cor_bool)
+    if corrections is not None:
+        results.update(corrections[0])
+        cor_snr = snr * corrections[1]
+
+    results["cor_snr"] = float(cor_snr)
+    return results
+
+
+def subtraction_image(roi1: EllipseROI, roi2: EllipseROI) -> np.ndarray[tuple[int, int], np.dtype]:
+    """
+    Returns the difference of the slices of the two repeated images the ROIs are on.
+    """
+    return (np.asarray(roi1.image.array[roi1.slice_num], dtype=float)
+            - roi2.image.array[roi2.slice_num])
+
+
+def window_pixels(window_size: float, pixel_size: tuple[float, float]) -> tuple[int, int]:
+    """
+    Returns the height and width in pixels of a window `window_size` mm across,
+    rounded to the nearest odd number so it is centred on a pixel.
+    """
+    return (2 * round((window_size / pixel_size[0] - 1) / 2) + 1,
+            2 * round((window_size / pixel_size[1] - 1) / 2) + 1)
+
+
+def phantom_mask(roi: EllipseROI, size: float) -> np.ndarray[tuple[int, int], np.dtype[np.bool]]:
+    """
+    Returns the mask of the phantom from an ROI drawn `size` percent of the phantom by `snr_roi`.
+    """
+    factor = 100 / size
+    rows, columns = np.indices(roi.image.shape[1:])
+    return (((columns - roi.x) / (roi.a * factor)) ** 2
+            + ((rows - roi.y) / (roi.b * factor)) ** 2) <= 1
+
+
+def local_snr(array1: np.ndarray[tuple[int, int], np.dtype],
+              array2: np.ndarray[tuple[int, int], np.dtype],
+              mask: np.ndarray[tuple[int, int], np.dtype[np.bool]],
+              window: tuple[int, int]) -> tuple[dict[str, float], np.ndarray[tuple[int, int], np.dtype]]:
+    """
+    Calculates the subtraction SNR in a window around each pixel of the phantom.
+
+    The signal is the mean of the two images and the noise the standard deviation of the difference
+    divided by root 2, as in `subtraction_snr`.
+    The moving window sums are found with `window_sums` so the time taken does not depend on the window size.
+    Only windows entirely inside `mask` are used, the map is NaN elsewhere.
+
+    Parameters
+    ----------
+    array1 : np.ndarray[tuple[int, int], np.dtype]
+    array2 : np.ndarray[tuple[int, int], np.dtype]
+        The two repeated images.
+    mask : np.ndarray[tuple[int, int], np.dtype[np.bool]]
+        The phantom.
+    window : tuple[int, int]
+        The height and width of the window in pixels, see `window_pixels`.
+
+    Returns
+    -------
+    tuple[dict[str, float], np.ndarray[tuple[int, int], np.dtype]]
+        The minimum and maximum local SNR keyed by `MedACRSubSNR` field name, and the local SNR map.
+    """
+    num = window[0] * window[1]
+    inside = window_sums(mask.astype(float), window) > num - 0.5
+    signal = window_sums((np.asarray(array1, dtype=float) + array2) / 2, window) / num
+    difference = np.asarray(array1, dtype=float) - array2
+    difference_mean = window_sums(difference, window) / num
+    difference_variance = np.maximum(window_sums(difference ** 2, window) / num - difference_mean ** 2, 0)
+    noise = np.sqrt(difference_variance / 2)
+
+    snr_map = np.full(signal.shape, np.nan)
+    valid = inside & (noise > 0)
+    snr_map[valid] = signal[valid] / noise[valid]
+    if not np.any(valid):
+        raise ValueError("Local SNR window is larger than the phantom")
+    return ({"min_local_snr": float(np.min(snr_map[valid])),
+             "max_local_snr": float(np.max(snr_map[valid]))},
+            snr_map)
+
+
+def with_local_snr(analysis: Callable[[], dict[str, float]],
+                   local: Callable[[], tuple[dict[str, float], np.ndarray]] | None = None
+                   ) -> tuple[dict[str, float], np.ndarray | None]:
+    """
+    Runs an SNR calculation and, if given, the `local_snr` calculation.
+
+    Returns
+    -------
+    tuple[dict[str, float], np.ndarray | None]
+        The results of both and the local SNR map, None if `local` is not given.
+    """
+    results = analysis()
+    if local is None:
+        return results, None
+    local_results, snr_map = local()
+    results.update(local_results)
+    return results, snr_map
+
+
+def repeat_instances(image: Instance) -> list[Instance]:
+    """
+    Returns the same slice as `image` from each repeat of its series, starting with `image`.
+    Repeats are the series in the same study with the same description and number of slices,
+    the others are in series number order.
+    """
+    series = image.series
+    index = series.instances.index(image)
+    repeats = sorted((s for s in series.study.series
+                      if s is not series
+                      and s.series_description == series.series_description
+                      and s.num_slices == series.num_slices),
+                     key=lambda s: (s.series_number, s.acquisition_number))
+    return [image] + [s.instances[index] for s in repeats]
+
+
+def repeat_snr(roi: EllipseROI,
+               images: Iterable[Instance],
+               ref_bandwidth: float = 1,
+               pix_size_bool: bool = True,
+               bw_cor_bool: bool = True,
+               avg_cor_bool: bool = True,
+               pe_cor_bool: bool = True,
+               corrections: tuple[dict[str, float], float] | None = None) -> dict[str, float]:
+    """
+    Calculates the SNR from the same ROI on any number of repeated images.
+
+    The signal is the mean of the ROI over all repeats and the noise the root mean square
+    of the temporal standard deviation of each pixel in the ROI.
+    The repeats are read one at a time into a `RunningStats`,
+    so only one ROI of values is kept whatever the number of repeats.
+    The subtraction SNR of the first two repeats is also given as a cross check.
+
+    Parameters
+    ----------
+    roi : EllipseROI
+        The ROI, its mask is used on each image.
+    images : Iterable[Instance]
+        The repeated images, at least 2.
+        The corrections are found from the first.
+    ref_bandwidth : float, optional
+    pix_size_bool : bool, optional
+    bw_cor_bool : bool, optional
+    avg_cor_bool : bool, optional
+    pe_cor_bool : bool, optional
+    corrections : tuple[dict[str, float], float] | None, optional
+        See `subtraction_snr`.
+
+    Returns
+    -------
+    dict[str, float]
+        The results, keyed by `MedACRSubSNR` field name.
+    """
+    stats = RunningStats()
+    first_image: Instance | None = None
+    first_values: np.ndarray | None = None
+    pair_snr: float | None = None
+    for image in images:
+        values = np.asarray(image[roi.slice_num], dtype=float)[roi.mask]
+        stats.add(values)
+        if first_values is None:
+            first_image = image
+            first_values = values
+        elif pair_snr is None:
+            pair_noise = np.std(first_values - values) / math.sqrt(2)
+            pair_snr = float(np.mean((first_values + values) / 2) / pair_noise)
+
+    if first_image is None or pair_snr is None:
+        raise ValueError("At least 2 repeats are needed")
+
+    signal = float(np.mean(stats.mean))
+    noise = math.sqrt(float(np.mean(stats.variance())))
+    snr = signal / noise
+    results: dict[str, float] = {"signal": signal,
+                                 "noise": noise,
+                                 "snr": snr,
+                                 "pair_snr": pair_snr,
+                                 "num_repeats": stats.count}
+
+    if corrections is None:
+        corrections = snr_corrections(first_image,
+                                      ref_bandwidth,
+                                      pix_size_bool,
+                                      bw_cor_bool,
+                                      avg_cor_bool,
+                                      pe_cor_bool)
+    results.update(corrections[0])
+    results["cor_snr"] = snr * corrections[1]
+    return results
+
+
+class MedACRSubSNR(MedACRModule):
     """
     Module for subtraction method SNR on medium ACR phantom.
+
+    If `Use All Repeats` is selected the SNR is found from every repeat of the series in the first viewer
+    using `repeat_snr`, the subtraction SNR of the first two is given as the pairwise SNR.
+    If `Local SNR Map` is selected the SNR is also found in a window around each pixel of the phantom
+    using `local_snr`, the phantom is the SNR ROI scaled to 100%.
     """
     context_manager = MedACRContextManager()
     show_draw_rois_button = True
@@ -31,12 +409,15 @@ class MedACRSubSNR(PhantomModule):
     viewer1 = MonochromeDicomViewerField(row=0, column=0)
     viewer2 = MonochromeDicomViewerField(row=0, column=1, allow_changing_rois=False)
 
-    size = PercField(70, verbose_name="Size (%)")
-    ref_bandwidth = FloatField(1, verbose_name="Reference Bandwidth (Hz/px)")
-    bw_cor_bool = BoolField(verbose_name="Bandwidth Correction")
-    pix_size_bool = BoolField(verbose_name="Pixel Size Correction")
-    avg_cor_bool = BoolField(verbose_name="Averages Correction")
-    pe_cor_bool = BoolField(verbose_name="Phase Encode Correction")
+    size = PercField(DEFAULT_SIZE, verbose_name="Size (%)")
+    ref_bandwidth = FloatField(DEFAULT_REF_BANDWIDTH, verbose_name="Reference Bandwidth (Hz/px)")
+    bw_cor_bool = BoolField(DEFAULT_CORRECTION, verbose_name="Bandwidth Correction")
+    pix_size_bool = BoolField(DEFAULT_CORRECTION, verbose_name="Pixel Size Correction")
+    avg_cor_bool = BoolField(DEFAULT_CORRECTION, verbose_name="Averages Correction")
+    pe_cor_bool = BoolField(DEFAULT_CORRECTION, verbose_name="Phase Encode Correction")
+    all_repeats_bool = BoolField(False, verbose_name="Use All Repeats")
+    local_snr_bool = BoolField(False, verbose_name="Local SNR Map")
+    window_size = FloatField(15, verbose_name="Local SNR Window (mm)")
 
     slice_used = IntField(read_only=True)
     im_bw = FloatField(verbose_name="Image Bandwidth (Hz/px)",
@@ -61,33 +442,36 @@ class MedACRSubSNR(PhantomModule):
     cor_snr = FloatField(verbose_name="Corrected SNR",
                          reset_on_analysis=True,
                          read_only=True)
+    num_repeats = IntField(verbose_name="Repeats",
+                           reset_on_analysis=True,
+                           read_only=True)
+    pair_snr = FloatField(verbose_name="Pairwise SNR",
+                          reset_on_analysis=True,
+                          read_only=True)
+    min_local_snr = FloatField(verbose_name="Minimum Local SNR",
+                               reset_on_analysis=True,
+                               read_only=True)
+    max_local_snr = FloatField(verbose_name="Maximum Local SNR",
+                               reset_on_analysis=True,
+                               read_only=True)
 
     signal_roi1 = EllipseROIField("SNR ROI1")
     signal_roi2 = EllipseROIField("SNR ROI2", allow_manual_draw=False)
 
+    local_snr_map: np.ndarray | None = None
+    _local_snr_key: str | None = None
+
     def draw_rois(self, context: MedACRContext, batch: bool = False) -> None:
         if isinstance(self.viewer1.image, Instance):
             image = self.viewer1.image
         elif isinstance(self.viewer1.image, Series):
-            if context.inserts_slice == 10:
-                self.slice_used = 4
-                image = self.viewer1.image.instances[4]
-            else:
-                self.slice_used = 6
-                image = self.viewer1.image.instances[6]
+            self.slice_used = uniform_slice(context)
+            image = self.viewer1.image.instances[self.slice_used]
         else:
             return
 
         self.viewer1.load_image(image)
-        factor = self.size / 100
-        a = round(factor * context.x_length / 2)
-        b = round(factor * context.y_length / 2)
-        self.signal_roi1.register_roi(EllipseROI(image,
-                                                 round(context.xcent),
-                                                 round(context.ycent),
-                                                 a,
-                                                 b,
-                                                 slice_num=image.current_slice))
+        self.signal_roi1.register_roi(snr_roi(image, context, self.size))
 
     def post_roi_register(self, roi_input: EllipseROIField):
         if (roi_input == self.signal_roi1
@@ -116,96 +500,87 @@ class MedACRSubSNR(PhantomModule):
         self.signal_roi1.viewer = self.viewer1
         self.signal_roi2.viewer = self.viewer2
 
-    def analyse(self, batch: bool = False):
-        if self.signal_roi1.roi is not None and self.signal_roi2.roi is not None:
-            roi1 = self.signal_roi1.roi
-            roi2 = self.signal_roi2.roi
-            roi_sum = roi1.pixel_values + roi2.pixel_values
-            roi_sub = np.array(roi1.pixel_values) - np.array(roi2.pixel_values)
-            sum_roi = np.mean(roi_sum)
-            if isinstance(sum_roi, float):
-                self.signal = sum_roi
-            roi_noise = np.std(roi_sub) / math.sqrt(2)
-            if isinstance(roi_noise, float):
-                self.noise = roi_noise
-            snr = sum_roi / roi_noise
-            if isinstance(snr, float):
-                self.snr = snr
-
-            cor_snr = snr
-
-            image = roi1.image
-            if isinstance(image, Instance):
-                px_cor = 1
-                bw_cor = 1
-                avg_cor = 1
-                pe_cor = 1
-
-                if (self.pix_size_bool
-                    and not (image.slice_thickness is None
-                             or image.pixel_spacing is None)):
-                    pix_size = image.slice_thickness, *image.pixel_spacing
-                    self.logger.info("pixel size = %s", pix_size)
-                    px_cor = 1 / math.prod(pix_size)
-                    self.pixel_size_cor = px_cor
-
-                if self.bw_cor_bool:
-                    ref_bw = self.ref_bandwidth
-                    try:
-                        im_bw = image.get_value(MRTags.PixelBandwidth, True)
-                        self.logger.info("image bandwidth = %s", im_bw)
-                        try:
-                            im_bw = float(im_bw)
-                        except (ValueError, TypeError):
-                            im_bw = ref_bw
-                    except KeyError:
-                        self.logger.info("image bandwidth not found")
-                        im_bw = ref_bw
-                    self.im_bw = im_bw
-                    bw_cor = math.sqrt(im_bw / ref_bw)
-
-                if self.avg_cor_bool:
-                    try:
-                        im_av = image.get_value(MRTags.NumberOfAverages, True)
-                        self.logger.info("image averages = %s", im_av)
-                        try:
-                            im_av = float(im_av)
-                        except (ValueError, TypeError):
-                            im_av = 1
-                    except KeyError:
-                        im_av = 1
-                        self.logger.info("image averages not found")
-                    avg_cor = 1 / math.sqrt(im_av)
-                    self.avg_cor = avg_cor
-
-                if self.pe_cor_bool:
-                    try:
-                        im_pe = float(
-                            image.get_value(MRTags.NumberOfPhaseEncodingSteps, True))
-                        self.logger.info("phase encode steps = %s", im_pe)
-                    except (KeyError, ValueError, TypeError):
-                        try:
-                            if image.get_value(MRTags.InPlanePhaseEncodingDirection, True) == "ROW":
-                                num = int(
-                                    image.get_value(MRTags.Rows, True))
-                            else:
-                                num = int(
-                                    image.get_value(MRTags.Columns, True))
-                            im_pe = float(
-                                image.get_value(MRTags.PercentSampling, True)) * num
-                            self.logger.info("phase encode steps = %s", im_pe)
-                        except (KeyError, ValueError, TypeError):
-                            im_pe = 1
-                            self.logger.info("phase encode steps not found")
-                    pe_cor = 1 / math.sqrt(im_pe)
-                    self.pe_cor = pe_cor
-
-                cor_snr = snr * px_cor * bw_cor * avg_cor * pe_cor
-
-            self.cor_snr = float(cor_snr)
+    def _snr_analysis(self) -> tuple[Callable[[], dict[str, float]], Instance] | None:
+        """
+        Returns the SNR calculation and the second image used for the local SNR map.
+        """
+        roi1 = self.signal_roi1.roi
+        if (self.all_repeats_bool
+            and roi1 is not None
+                and isinstance(roi1.image, Instance)):
+            images = repeat_instances(roi1.image)
+            if len(images) < 2:
+                self.logger.warning("%s has no repeats", roi1.image.series.id_string)
+                return None
+            return (partial(repeat_snr,
+                            roi1,
+                            images,
+                            self.ref_bandwidth,
+                            self.pix_size_bool,
+                            self.bw_cor_bool,
+                            self.avg_cor_bool,
+                            self.pe_cor_bool),
+                    images[1])
+        if (roi1 is not None
+            and self.signal_roi2.roi is not None
+                and isinstance(self.signal_roi2.roi.image, Instance)):
+            return (partial(subtraction_snr,
+                            roi1,
+                            self.signal_roi2.roi,
+                            self.ref_bandwidth,
+                            self.pix_size_bool,
+                            self.bw_cor_bool,
+                            self.avg_cor_bool,
+                            self.pe_cor_bool),
+                    self.signal_roi2.roi.image)
+        return None
+
+    def _local_snr_analysis(self, image2: Instance
+                            ) -> Callable[[], tuple[dict[str, float], np.ndarray]] | None:
+        roi1 = self.signal_roi1.roi
+        if roi1 is None or not isinstance(roi1.image, Instance):
+            return None
+        pixel_size = acquisition_parameters(roi1.image).pixel_spacing
+        if pixel_size is None:
+            self.logger.warning("Pixel spacing not found, local SNR map not calculated")
+            return None
+        return partial(local_snr,
+                       roi1.image.array[0],
+                       image2.array[0],
+                       phantom_mask(roi1, self.size),
+                       window_pixels(self.window_size, pixel_size))
+
+    def get_analysis(self,
+                     progress: AnalysisProgress | None = None
+                     ) -> Callable[[], tuple[dict[str, float], np.ndarray | None]] | None:
+        snr_analysis = self._snr_analysis()
+        if snr_analysis is None:
+            return None
+        analysis, image2 = snr_analysis
+        if self.local_snr_bool:
+            return partial(with_local_snr, analysis, self._local_snr_analysis(image2))
+        return partial(with_local_snr, analysis)
+
+    def set_results(self, results: tuple[dict[str, float], np.ndarray | None]) -> None:
+        snr_results, self.local_snr_map = results
+        self._local_snr_key = self.cache_key()
+        super().set_results(snr_results)
+
+    def cache_key(self) -> str | None:
+        key = super().cache_key()
+        if (key is None
+            or not self.all_repeats_bool
+            or self.signal_roi1.roi is None
+                or not isinstance(self.signal_roi1.roi.image, Instance)):
+            return key
+        # the repeats other than those in the viewers do not have ROIs so are added here
+        hashes = [pixel_hash(image) for image in repeat_instances(self.signal_roi1.roi.image)]
+        return hashlib.sha256(json.dumps([key, hashes]).encode()).hexdigest()
 
     def load_commands(self):
+        super().load_commands()
         self.register_command("Show Subtraction Image", self.show_sub_image)
+        self.register_command("Show Local SNR Map", self.show_local_snr_map)
 
     def show_sub_image(self):
         """
@@ -215,9 +590,30 @@ class MedACRSubSNR(PhantomModule):
             self.create_rois()
 
         if self.signal_roi1.roi is not None and self.signal_roi2.roi is not None:
-            roi1 = self.signal_roi1.roi
-            roi2 = self.signal_roi2.roi
-            sub_array = roi1.image.array[0] - roi2.image.array[0]
+            sub_array = subtraction_image(self.signal_roi1.roi, self.signal_roi2.roi)
             plt.imshow(sub_array, cmap='grey')
             plt.colorbar()
             plt.show()
+
+    def show_local_snr_map(self):
+        """
+        Shows the local SNR map, calculating it if the results were cached.
+        """
+        if self.signal_roi1.roi is None or self.signal_roi2.roi is None:
+            self.create_rois()
+
+        if self.local_snr_map is None or self._local_snr_key != self.cache_key():
+            snr_analysis = self._snr_analysis()
+            if snr_analysis is None:
+                return
+            local = self._local_snr_analysis(snr_analysis[1])
+            if local is None:
+                return
+            _, self.local_snr_map = local()
+            self._local_snr_key = self.cache_key()
+
+        plt.clf()
+        plt.imshow(self.local_snr_map, cmap='viridis')
+        plt.colorbar()
+        plt.title("Local SNR")
+        plt.show()
@@ -1,10 +1,11 @@
 """
 Integral uniformity module for medium ACR phantom
 """
+from collections.abc import Callable
+from functools import partial
 import numpy as np
 from scipy.signal import convolve2d
 
-from pumpia.module_handling.modules import PhantomModule
 from pumpia.module_handling.fields.roi_fields import EllipseROIField
 from pumpia.module_handling.fields.viewer_fields import MonochromeDicomViewerField
 from pumpia.module_handling.fields.simple import (PercField,
@@ -14,12 +15,61 @@ from pumpia.module_handling.fields.simple import (PercField,
 from pumpia.image_handling.roi_structures import EllipseROI
 from pumpia.file_handling.dicom_structures import Series, Instance
 
+from pumpia_acr_med.med_acr_module import AnalysisProgress, MedACRModule
 from pumpia_acr_med.med_acr_context import MedACRContextManager, MedACRContext
+from pumpia_acr_med.context_utils import uniform_slice
 
 LOW_PASS_KERNEL = np.array([[1, 2, 1], [2, 4, 2], [1, 2, 1]]) / 16
+DEFAULT_SIZE = 70
+DEFAULT_KERNEL = True
 
 
-class MedACRUniformity(PhantomModule):
+def uniformity_roi(image: Instance, context: MedACRContext, size: float) -> EllipseROI:
+    """
+    Returns the uniformity ROI on `image`, an ellipse `size` percent of the phantom.
+    """
+    factor = size / 100
+    a = round(factor * context.x_length / 2)
+    b = round(factor * context.y_length / 2)
+    return EllipseROI(image,
+                      round(context.xcent),
+                      round(context.ycent),
+                      a,
+                      b,
+                      slice_num=image.current_slice)
+
+
+def integral_uniformity(roi: EllipseROI, kernel_bool: bool = True) -> dict[str, float]:
+    """
+    Calculates the integral uniformity within `roi`.
+
+    Parameters
+    ----------
+    roi : EllipseROI
+        The uniformity ROI.
+    kernel_bool : bool, optional
+        Apply a low pass kernel to the image before finding the maximum and minimum (default is True).
+
+    Returns
+    -------
+    dict[str, float]
+        The results, keyed by `MedACRUniformity` field name.
+    """
+    if kernel_bool:
+        array = roi.image.array[0]
+        array = convolve2d(array, LOW_PASS_KERNEL, mode="same")
+        mask = roi.mask
+        pixel_values = list(array[mask])
+    else:
+        pixel_values = roi.pixel_values
+
+    max_val = max(pixel_values)
+    min_val = min(pixel_values)
+    uniformity = 100 * (1 - ((max_val - min_val) / (max_val + min_val)))  # pyright: ignore[reportOperatorIssue]
+    return {"uniformity": uniformity}
+
+
+class MedACRUniformity(MedACRModule):
     """
     Integral uniformity module for medium ACR phantom.
     """
@@ -30,8 +80,8 @@ class MedACRUniformity(PhantomModule):
 
     viewer = MonochromeDicomViewerField(row=0, column=0)
 
-    size = PercField(70, verbose_name="Size (%)")
-    kernel_bool = BoolField(verbose_name="Apply Low Pass Kernel")
+    size = PercField(DEFAULT_SIZE, verbose_name="Size (%)")
+    kernel_bool = BoolField(DEFAULT_KERNEL, verbose_name="Apply Low Pass Kernel")
 
     slice_used = IntField(read_only=True)
     uniformity = FloatField(verbose_name="Uniformity (%)",
@@ -44,25 +94,13 @@ class MedACRUniformity(PhantomModule):
         if isinstance(self.viewer.image, Instance):
             image = self.viewer.image
         elif isinstance(self.viewer.image, Series):
-            if context.inserts_slice == 10:
-                self.slice_used = 4
-                image = self.viewer.image.instances[4]
-            else:
-                self.slice_used = 6
-                image = self.viewer.image.instances[6]
+            self.slice_used = uniform_slice(context)
+            image = self.viewer.image.instances[self.slice_used]
         else:
             return
 
         self.viewer.load_image(image)
-        factor = self.size / 100
-        a = round(factor * context.x_length / 2)
-        b = round(factor * context.y_length / 2)
-        self.uniformity_roi.register_roi(EllipseROI(image,
-                                                    round(context.xcent),
-                                                    round(context.ycent),
-                                                    a,
-                                                    b,
-                                                    slice_num=image.current_slice))
+        self.uniformity_roi.register_roi(uniformity_roi(image, context, self.size))
 
     def post_roi_register(self, roi_input: EllipseROIField):
         if (roi_input == self.uniformity_roi
@@ -73,18 +111,9 @@ class MedACRUniformity(PhantomModule):
     def link_rois_viewers(self):
         self.uniformity_roi.viewer = self.viewer
 
-    def analyse(self, batch: bool = False):
+    def get_analysis(self,
+                     progress: AnalysisProgress | None = None
+                     ) -> Callable[[], dict[str, float]] | None:
         if self.uniformity_roi.roi is not None:
-            roi = self.uniformity_roi.roi
-            if self.kernel_bool:
-                array = roi.image.array[0]
-                array = convolve2d(array, LOW_PASS_KERNEL, mode="same")
-                mask = roi.mask
-                pixel_values = list(array[mask])
-            else:
-                pixel_values = roi.pixel_values
-
-            max_val = max(pixel_values)
-            min_val = min(pixel_values)
-            uniformity = 100 * (1 - ((max_val - min_val) / (max_val + min_val)))  # pyright: ignore[reportOperatorIssue]
-            self.uniformity = uniformity
+            return partial(integral_uniformity, self.uniformity_roi.roi, self.kernel_bool)
+        return None
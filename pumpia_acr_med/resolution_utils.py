@@ -0,0 +1,1126 @@
+"""
+Shared functions for the 1 mm resolution insert.
+
+Contains the line contrast functions, the square wave model used for the theoretical maximum
+and the batched search and refinement used to auto-position the resolution lines.
+"""
+import itertools
+import math
+from collections.abc import Callable, Sequence
+from functools import lru_cache
+from pathlib import Path
+from typing import Literal
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import map_coordinates
+from scipy.optimize import minimize_scalar
+
+from pumpia.utilities.array_utils import nth_max_bounds
+
+ResolutionMethod = Literal["FFT", "contrast"]
+PinGating = Literal["ends", "count"]
+
+BEST_CONTRAST_TABLE = Path(__file__).resolve().parent / "best_contrast_table.npz"
+TABLE_WAVE_PEAK_WIDTH = 1
+TABLE_NUM_PEAKS = 4
+TABLE_SAMPLE_LENGTH = 8
+TABLE_CONTRAST_FREQUENCY = 0.5
+TABLE_MAX_STEP = 0.02
+# number of candidate lines between progress reports of `search_lines`
+SEARCH_PROGRESS_LINES = 256
+# the (x, y, angle) steps to the lines around the current line in `refine_line`
+STENCIL = np.array([step for step in itertools.product((-1, 0, 1), repeat=3) if any(step)])
+
+
+def get_contrast(profile: np.ndarray[tuple[int], np.dtype]) -> float:
+    """
+    Get the contrast for a line profile from the 1mm ACR resolution insert
+    """
+    bounds = nth_max_bounds(profile, 2)
+    if profile[math.floor(bounds.minimum)] > profile[math.floor(bounds.minimum)]:
+        start = math.floor(bounds.minimum)
+    else:
+        start = math.floor(bounds.minimum)
+
+    if profile[math.floor(bounds.maximum)] > profile[math.floor(bounds.maximum)]:
+        end = math.floor(bounds.maximum)
+    else:
+        end = math.floor(bounds.maximum)
+
+    new_prof = profile[start:end + 1]
+    minimum = np.min(new_prof)
+    maximum = np.max(new_prof)
+    half_maximum = (maximum + minimum) / 2
+    mins = list(np.argwhere(new_prof < half_maximum)[:, 0])
+
+    if end - start in mins:
+        mins.remove(end - start)
+    if 0 in mins:
+        mins.remove(0)
+
+    if len(mins) == 0:
+        return 0
+
+    troughs: list[list[int]] = [[mins[0]]]
+    prev_min = mins[0]
+
+    for m in mins[1:]:
+        if m == prev_min + 1:
+            troughs[-1].append(m)
+        else:
+            troughs.append([m])
+        prev_min = m
+
+    contrasts = []
+    prev_t = 0
+    for trough_num, trough in enumerate(troughs):
+        if trough_num + 1 < len(troughs):
+            next_t = min(troughs[trough_num + 1])
+        else:
+            next_t = len(new_prof)
+        left_peak_val = np.mean(new_prof[prev_t:min(trough)])
+        right_peak_val = np.mean(new_prof[max(trough) + 1:next_t])
+        peak_val = (left_peak_val + right_peak_val) / 2
+        trough_val = np.mean(new_prof[min(trough):max(trough) + 1])
+        contrasts.append((peak_val - trough_val) / (peak_val + trough_val))
+
+    return min(contrasts)
+
+
+def _segment_means(values: np.ndarray[tuple[int], np.dtype],
+                   starts: np.ndarray,
+                   lengths: np.ndarray) -> np.ndarray:
+    """
+    Means of the segments `values[start:start + length]`, `lengths` must be at least 1.
+
+    Segments of the same length are gathered into rows and averaged together with `np.mean`
+    so that each result is identical to calling `np.mean` on the segment.
+    `np.add.reduceat` is not used as it sums in a different order to `np.mean`.
+    """
+    means = np.zeros(starts.shape)
+    for seg_length in np.unique(lengths):
+        selected = lengths == seg_length
+        segments = values[starts[selected][:, np.newaxis] + np.arange(seg_length)]
+        means[selected] = np.mean(segments, axis=1)
+    return means
+
+
+def get_contrasts(profiles: np.ndarray[tuple[int, int], np.dtype]) -> np.ndarray[tuple[int], np.dtype]:
+    """
+    Batched version of `get_contrast` for a stack of line profiles.
+
+    The below half maximum pixels of every profile are run length encoded into troughs
+    and the peak and trough means are calculated for all troughs at once using `_segment_means`.
+    Profiles with no half maximum crossings, where `get_contrast` raises a ValueError,
+    are given a contrast of 0.
+
+    Parameters
+    ----------
+    profiles : np.ndarray
+        2 dimensional array, each row is a line profile.
+
+    Returns
+    -------
+    np.ndarray
+        The contrast for each profile.
+    """
+    profiles = np.asarray(profiles, dtype=float)
+    num_profiles, length = profiles.shape
+    rows = np.arange(num_profiles)
+    indices = np.arange(length)
+    results = np.zeros(num_profiles)
+    if num_profiles == 0 or length < 2:
+        return results
+
+    # bounds of the half maximum crossings, as in nth_max_bounds
+    half_maximum = (np.max(profiles, axis=1) + np.min(profiles, axis=1)) / 2
+    gte_half_maximum = profiles >= half_maximum[:, np.newaxis]
+    lt_half_maximum = profiles < half_maximum[:, np.newaxis]
+    crossings = ((lt_half_maximum[:, :-1] & gte_half_maximum[:, 1:])
+                 | (gte_half_maximum[:, :-1] & lt_half_maximum[:, 1:]))
+    has_crossing = np.any(crossings, axis=1)
+    first = np.argmax(crossings, axis=1)
+    last = length - 2 - np.argmax(crossings[:, ::-1], axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        start_pos = first + np.abs((half_maximum - profiles[rows, first])
+                                   / (profiles[rows, first + 1] - profiles[rows, first]))
+        end_pos = last + np.abs((half_maximum - profiles[rows, last])
+                                / (profiles[rows, last + 1] - profiles[rows, last]))
+    start = np.where(has_crossing, np.floor(start_pos), 0).astype(int)
+    end = np.where(has_crossing, np.floor(end_pos), 0).astype(int)
+
+    # pixels below half maximum within the bounds, excluding the ends
+    in_segment = ((indices >= start[:, np.newaxis])
+                  & (indices <= end[:, np.newaxis])
+                  & has_crossing[:, np.newaxis])
+    seg_minimum = np.min(np.where(in_segment, profiles, np.inf), axis=1)
+    seg_maximum = np.max(np.where(in_segment, profiles, -np.inf), axis=1)
+    with np.errstate(invalid="ignore"):
+        # rows with no crossings are empty and are removed by in_segment below
+        seg_half_maximum = (seg_maximum + seg_minimum) / 2
+    below = (in_segment
+             & (profiles < seg_half_maximum[:, np.newaxis])
+             & (indices != start[:, np.newaxis])
+             & (indices != end[:, np.newaxis]))
+
+    # run length encode the troughs
+    padded = np.pad(below, ((0, 0), (1, 1)))
+    run_starts = padded[:, 1:-1] & ~padded[:, :-2]
+    run_ends = padded[:, 1:-1] & ~padded[:, 2:]
+    trough_rows, trough_starts = np.nonzero(run_starts)
+    trough_ends = np.nonzero(run_ends)[1]
+    if trough_rows.shape[0] == 0:
+        return results
+
+    next_starts = np.empty_like(trough_starts)
+    next_starts[:-1] = trough_starts[1:]
+    same_row = np.zeros(trough_rows.shape[0], dtype=bool)
+    same_row[:-1] = trough_rows[1:] == trough_rows[:-1]
+    next_starts = np.where(same_row, next_starts, end[trough_rows] + 1)
+
+    # left peak, trough and right peak segments of the flattened profiles
+    offsets = trough_rows * length
+    seg_starts = np.stack([offsets + start[trough_rows],
+                           offsets + trough_starts,
+                           offsets + trough_ends + 1],
+                          axis=1)
+    seg_ends = np.stack([offsets + trough_starts,
+                         offsets + trough_ends + 1,
+                         offsets + next_starts],
+                        axis=1)
+    means = _segment_means(profiles.reshape(-1), seg_starts, seg_ends - seg_starts)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        peak_vals = (means[:, 0] + means[:, 2]) / 2
+        contrasts = (peak_vals - means[:, 1]) / (peak_vals + means[:, 1])
+
+    has_trough = np.zeros(num_profiles, dtype=bool)
+    has_trough[trough_rows] = True
+    results[has_trough] = np.inf
+    np.minimum.at(results, trough_rows, contrasts)
+    return results
+
+
+@lru_cache(maxsize=32)
+def dft_basis(num_points: int,
+              pixel_width: float,
+              frequency: float) -> np.ndarray[tuple[int, int], np.dtype[np.complex128]]:
+    """
+    Complex DFT basis for the DC and `frequency` components of a profile.
+
+    Results are cached as the same profile length and pixel width is used for every line
+    of a search, the returned array should not be modified.
+
+    Parameters
+    ----------
+    num_points : int
+        The number of points in the profile.
+    pixel_width : float
+        The distance between points in the profile.
+    frequency : float
+        The frequency of the second column of the basis.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (num_points, 2), column 0 is the DC basis and column 1 the `frequency` basis.
+    """
+    positions = np.arange(num_points) * pixel_width
+    basis = np.exp(-2j * np.pi * np.outer(positions, [0, frequency]))
+    basis.flags.writeable = False
+    return basis
+
+
+def fft_contrast(profile: np.ndarray[tuple[int], np.dtype],
+                 pixel_width: float,
+                 contrast_frequency: float) -> float:
+    """
+    Get the contrast for a line profile using the fourier transform at `contrast_frequency`
+    """
+    dft = np.abs(profile @ dft_basis(profile.shape[0], pixel_width, contrast_frequency))
+    return dft[1] / dft[0]
+
+
+def fft_contrasts(profiles: np.ndarray[tuple[int, int], np.dtype],
+                  pixel_width: float,
+                  contrast_frequency: float) -> np.ndarray[tuple[int], np.dtype]:
+    """
+    Batched version of `fft_contrast` for a stack of line profiles.
+
+    Parameters
+    ----------
+    profiles : np.ndarray
+        2 dimensional array, each row is a line profile.
+    pixel_width : float
+        The distance between points in the profiles.
+    contrast_frequency : float
+        The frequency the contrast is calculated at.
+
+    Returns
+    -------
+    np.ndarray
+        The contrast for each profile.
+    """
+    dft = np.abs(profiles @ dft_basis(profiles.shape[-1], pixel_width, contrast_frequency))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return dft[:, 1] / dft[:, 0]
+
+
+def profile_contrasts(profiles: np.ndarray[tuple[int, int], np.dtype],
+                      pixel_width: float,
+                      contrast_frequency: float,
+                      method: ResolutionMethod = "FFT") -> np.ndarray[tuple[int], np.dtype]:
+    """
+    Get the contrast of each line profile in a stack using the given method.
+    """
+    if profiles.shape[0] == 0:
+        return np.zeros(0)
+    if method == "FFT":
+        return fft_contrasts(profiles, pixel_width, contrast_frequency)
+    return get_contrasts(profiles)
+
+
+def pin_gate(profiles: np.ndarray[tuple[int, ...], np.dtype],
+             line_min_val: float,
+             gating: PinGating,
+             within_loc: int = 1,
+             num_pins: int = 4) -> np.ndarray[tuple[int, ...], np.dtype[np.bool]]:
+    """
+    Boolean mask of the line profiles that cross the resolution pins.
+
+    Parameters
+    ----------
+    profiles : np.ndarray
+        Array of line profiles, the profiles are along the last axis.
+    line_min_val : float
+        Pixels greater or equal to this are counted as being part of a pin.
+    gating : PinGating
+        "ends" requires a pin pixel within `within_loc` pixels of both ends of the line.
+        "count" requires at least `num_pins` pin pixels on the line.
+    within_loc : int, optional
+        Used by "ends" gating (default is 1).
+    num_pins : int, optional
+        Used by "count" gating (default is 4).
+    """
+    pin_locs = profiles >= line_min_val
+    if gating == "ends":
+        return (np.any(pin_locs[..., :within_loc], axis=-1)
+                & np.any(pin_locs[..., -within_loc:], axis=-1))
+    return np.count_nonzero(pin_locs, axis=-1) >= num_pins
+
+
+def search_lines(array: np.ndarray[tuple[int, int], np.dtype],
+                 line_length: int,
+                 direction: Literal["horizontal", "vertical"],
+                 pixel_width: float,
+                 line_min_val: float,
+                 method: ResolutionMethod = "FFT",
+                 contrast_frequency: float = 0.5,
+                 gating: PinGating = "ends",
+                 within_loc: int = 1,
+                 num_pins: int = 4,
+                 progress: Callable[[float], None] | None = None,
+                 step: tuple[int, int] = (1, 1)) -> tuple[float, tuple[int, int]]:
+    """
+    Finds the line position in `array` with the highest contrast.
+
+    Every candidate line is built at once as a strided view,
+    lines which do not cross the pins are removed using `pin_gate`
+    and the contrast of the remaining lines is calculated in one batch.
+    If `progress` is given the batch is split into `SEARCH_PROGRESS_LINES` lines
+    and `progress` is called with the fraction of candidate lines done after each.
+
+    Positions are searched in the same order as a loop over x then y,
+    so ties resolve to the same position as the loop.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        The 2 dimensional array to search.
+    line_length : int
+        The number of pixels in a line.
+    direction : Literal["horizontal", "vertical"]
+        The direction of the lines.
+    pixel_width : float
+        The pixel size along the direction of the lines.
+    line_min_val : float
+        The minimum value of a pin pixel, see `pin_gate`.
+    method : ResolutionMethod, optional
+        The contrast method (default is "FFT").
+    contrast_frequency : float, optional
+        The frequency used by the FFT method (default is 0.5).
+    gating : PinGating, optional
+        The pin gating used, see `pin_gate` (default is "ends").
+    within_loc : int, optional
+        Used by "ends" gating (default is 1).
+    num_pins : int, optional
+        Used by "count" gating (default is 4).
+    progress : Callable[[float], None] | None, optional
+        Called with the fraction of candidate lines done (default is None).
+    step : tuple[int, int], optional
+        The (x, y) spacing of the candidate line starts,
+        the default of (1, 1) searches every position.
+
+    Returns
+    -------
+    tuple[float, tuple[int, int]]
+        The maximum contrast and the (x, y) position of the start of the line.
+        Returns a contrast of 0 at (0, 0) if no line has a positive contrast.
+    """
+    if direction == "horizontal":
+        axis = 1
+    else:
+        axis = 0
+
+    if line_length < 1 or array.shape[axis] < line_length:
+        return 0, (0, 0)
+
+    # indexed (x, y, point) so that a flat argmax follows the loop order
+    profiles = sliding_window_view(array, line_length, axis=axis).transpose(1, 0, 2)[::step[0], ::step[1]]
+
+    valid = pin_gate(profiles, line_min_val, gating, within_loc, num_pins)
+    contrasts = np.full(valid.shape, -np.inf)
+    if progress is None:
+        contrasts[valid] = profile_contrasts(profiles[valid],
+                                             pixel_width,
+                                             contrast_frequency,
+                                             method)
+    else:
+        valid_profiles = profiles[valid]
+        num_lines = len(valid_profiles)
+        valid_contrasts = np.empty(num_lines)
+        for start in range(0, num_lines, SEARCH_PROGRESS_LINES):
+            stop = min(start + SEARCH_PROGRESS_LINES, num_lines)
+            valid_contrasts[start:stop] = profile_contrasts(valid_profiles[start:stop],
+                                                            pixel_width,
+                                                            contrast_frequency,
+                                                            method)
+            progress(stop / num_lines)
+        contrasts[valid] = valid_contrasts
+        progress(1)
+    contrasts[np.isnan(contrasts)] = -np.inf
+
+    best = int(np.argmax(contrasts))
+    best_contrast = float(contrasts.flat[best])
+    if best_contrast <= 0:
+        return 0, (0, 0)
+
+    x, y = np.unravel_index(best, contrasts.shape)
+    return best_contrast, (int(x) * step[0], int(y) * step[1])
+
+
+def line_ends(position: tuple[float, float],
+              angle: float,
+              line_length: int,
+              direction: Literal["horizontal", "vertical"]) -> tuple[float, float, float, float]:
+    """
+    The end points of a line of `line_length` pixels.
+
+    Parameters
+    ----------
+    position : tuple[float, float]
+        The (x, y) position of the start of the line.
+    angle : float
+        The anticlockwise rotation of the line in degrees from horizontal or vertical.
+    line_length : int
+        The number of pixels in the line, the ends are included.
+    direction : Literal["horizontal", "vertical"]
+        The direction of the line before rotation.
+
+    Returns
+    -------
+    tuple[float, float, float, float]
+        The (x1, y1, x2, y2) ends of the line.
+    """
+    radians = math.radians(angle)
+    if direction == "horizontal":
+        x_step = math.cos(radians)
+        y_step = -math.sin(radians)
+    else:
+        x_step = math.sin(radians)
+        y_step = math.cos(radians)
+    return (position[0],
+            position[1],
+            position[0] + (line_length - 1) * x_step,
+            position[1] + (line_length - 1) * y_step)
+
+
+def line_spacing(angle: float,
+                 direction: Literal["horizontal", "vertical"],
+                 pixel_size: tuple[float, float]) -> float:
+    """
+    The distance between the points of a line rotated by `angle` degrees, see `line_ends`.
+    `pixel_size` is the (row, column) pixel size.
+    """
+    radians = math.radians(angle)
+    if direction == "horizontal":
+        return math.hypot(math.cos(radians) * pixel_size[1], math.sin(radians) * pixel_size[0])
+    return math.hypot(math.sin(radians) * pixel_size[1], math.cos(radians) * pixel_size[0])
+
+
+def sample_lines(array: np.ndarray[tuple[int, int], np.dtype],
+                 positions: np.ndarray[tuple[int, int], np.dtype],
+                 angle: float,
+                 line_length: int,
+                 direction: Literal["horizontal", "vertical"]) -> np.ndarray[tuple[int, int], np.dtype]:
+    """
+    Samples the line profiles starting at each (x, y) row of `positions` from `array`
+    using bilinear interpolation, see `line_ends`.
+    Points outside the array are 0.
+    """
+    _, _, x2, y2 = line_ends((0, 0), angle, line_length, direction)
+    xs = positions[:, 0:1] + np.linspace(0, x2, line_length)
+    ys = positions[:, 1:2] + np.linspace(0, y2, line_length)
+    return map_coordinates(array,
+                           [ys.ravel(), xs.ravel()],
+                           order=1,
+                           mode="constant",
+                           cval=0).reshape(xs.shape)
+
+
+def sampled_contrasts(array: np.ndarray[tuple[int, int], np.dtype],
+                      positions: np.ndarray[tuple[int, int], np.dtype],
+                      angle: float,
+                      line_length: int,
+                      direction: Literal["horizontal", "vertical"],
+                      pixel_size: tuple[float, float],
+                      line_min_val: float,
+                      method: ResolutionMethod = "FFT",
+                      contrast_frequency: float = 0.5,
+                      gating: PinGating = "ends",
+                      within_loc: int = 1,
+                      num_pins: int = 4) -> np.ndarray[tuple[int], np.dtype]:
+    """
+    The contrast of the lines starting at each (x, y) row of `positions` and rotated by `angle` degrees,
+    sampled with `sample_lines`.
+    Lines that do not pass `pin_gate` or do not have a finite contrast have a contrast of 0.
+    See `refine_line` for the parameters.
+    """
+    profiles = sample_lines(array, positions, angle, line_length, direction)
+    valid = pin_gate(profiles, line_min_val, gating, within_loc, num_pins)
+    contrasts = np.zeros(positions.shape[0])
+    contrasts[valid] = profile_contrasts(profiles[valid],
+                                         line_spacing(angle, direction, pixel_size),
+                                         contrast_frequency,
+                                         method)
+    contrasts[~np.isfinite(contrasts)] = 0
+    return contrasts
+
+
+def search_angled_lines(array: np.ndarray[tuple[int, int], np.dtype],
+                        line_length: int,
+                        direction: Literal["horizontal", "vertical"],
+                        pixel_size: tuple[float, float],
+                        line_min_val: float,
+                        angles: Sequence[float],
+                        method: ResolutionMethod = "FFT",
+                        contrast_frequency: float = 0.5,
+                        gating: PinGating = "ends",
+                        within_loc: int = 1,
+                        num_pins: int = 4,
+                        progress: Callable[[float], None] | None = None) -> tuple[float, tuple[int, int], float]:
+    """
+    Finds the line in `array` with the highest contrast from every whole pixel start position
+    and each of `angles`.
+
+    Lines at an angle of 0 are searched with `search_lines`,
+    so the line found is never worse than the line `search_lines` finds.
+    Lines at other angles start from the same positions and are sampled with `sample_lines`,
+    a line at another angle is only used if its contrast is higher.
+    If `progress` is given it is called with the fraction of `angles` searched.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        The 2 dimensional array to search.
+    line_length : int
+        The number of pixels in a line.
+    direction : Literal["horizontal", "vertical"]
+        The direction of the lines before rotation.
+    pixel_size : tuple[float, float]
+        The (row, column) pixel size.
+    line_min_val : float
+        The minimum value of a pin pixel, see `pin_gate`.
+    angles : Sequence[float]
+        The anticlockwise rotations of the lines in degrees, see `line_ends`.
+    method : ResolutionMethod, optional
+        The contrast method (default is "FFT").
+    contrast_frequency : float, optional
+        The frequency used by the FFT method (default is 0.5).
+    gating : PinGating, optional
+        The pin gating used, see `pin_gate` (default is "ends").
+    within_loc : int, optional
+        Used by "ends" gating (default is 1).
+    num_pins : int, optional
+        Used by "count" gating (default is 4).
+    progress : Callable[[float], None] | None, optional
+        Called with the fraction of `angles` searched (default is None).
+
+    Returns
+    -------
+    tuple[float, tuple[int, int], float]
+        The maximum contrast, the (x, y) position of the start of the line and its angle.
+        Returns a contrast of 0 at (0, 0) and an angle of 0 if no line has a positive contrast.
+    """
+    if direction == "horizontal":
+        pixel_width = pixel_size[1]
+        xs = np.arange(array.shape[1] - line_length + 1)
+        ys = np.arange(array.shape[0])
+    else:
+        pixel_width = pixel_size[0]
+        xs = np.arange(array.shape[1])
+        ys = np.arange(array.shape[0] - line_length + 1)
+
+    best_contrast, best_position = search_lines(array,
+                                                line_length,
+                                                direction,
+                                                pixel_width,
+                                                line_min_val,
+                                                method,
+                                                contrast_frequency,
+                                                gating,
+                                                within_loc,
+                                                num_pins)
+    best_contrast = float(best_contrast)
+    best_angle = 0.0
+    if xs.shape[0] < 1 or ys.shape[0] < 1:
+        return best_contrast, best_position, best_angle
+
+    # in the same x then y order as `search_lines`
+    positions = np.stack(np.meshgrid(xs, ys, indexing="ij"), axis=-1).reshape(-1, 2).astype(float)
+    for num, angle in enumerate(angles):
+        if angle != 0:
+            contrasts = sampled_contrasts(array,
+                                          positions,
+                                          angle,
+                                          line_length,
+                                          direction,
+                                          pixel_size,
+                                          line_min_val,
+                                          method,
+                                          contrast_frequency,
+                                          gating,
+                                          within_loc,
+                                          num_pins)
+            best = int(np.argmax(contrasts))
+            if contrasts[best] > best_contrast:
+                best_contrast = float(contrasts[best])
+                best_position = int(positions[best, 0]), int(positions[best, 1])
+                best_angle = float(angle)
+        if progress is not None:
+            progress((num + 1) / len(angles))
+    return best_contrast, best_position, best_angle
+
+
+def refine_line(array: np.ndarray[tuple[int, int], np.dtype],
+                position: tuple[float, float],
+                line_length: int,
+                direction: Literal["horizontal", "vertical"],
+                pixel_size: tuple[float, float],
+                line_min_val: float,
+                method: ResolutionMethod = "FFT",
+                contrast_frequency: float = 0.5,
+                gating: PinGating = "ends",
+                within_loc: int = 1,
+                num_pins: int = 4,
+                angle: float = 0,
+                search_radius: float = 1,
+                angle_radius: float = 2.5,
+                max_angle: float = 5,
+                tolerance: float = 0.05) -> tuple[float, tuple[float, float], float]:
+    """
+    Refines a line found by `search_lines` or `search_angled_lines` to a sub-pixel position and angle.
+
+    The contrast is maximised with a pattern search: the lines a step either way in any of x, y and angle,
+    see `STENCIL`, are sampled with `sampled_contrasts` and the line moves to the best of them if it is higher,
+    otherwise the steps are halved until the position step is below `tolerance` pixels.
+    The first steps are `search_radius` pixels and half of `angle_radius` degrees.
+    The search is bounded to `search_radius` pixels from `position`
+    and `angle_radius` degrees from `angle`, within `max_angle` degrees.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        The 2 dimensional array containing the line.
+    position : tuple[float, float]
+        The (x, y) start position of the line to refine.
+    line_length : int
+        The number of pixels in the line.
+    direction : Literal["horizontal", "vertical"]
+        The direction of the line before rotation.
+    pixel_size : tuple[float, float]
+        The (row, column) pixel size.
+    line_min_val : float
+        The minimum value of a pin pixel, see `pin_gate`.
+    method : ResolutionMethod, optional
+        The contrast method (default is "FFT").
+    contrast_frequency : float, optional
+        The frequency used by the FFT method (default is 0.5).
+    gating : PinGating, optional
+        The pin gating used, see `pin_gate` (default is "ends").
+    within_loc : int, optional
+        Used by "ends" gating (default is 1).
+    num_pins : int, optional
+        Used by "count" gating (default is 4).
+    angle : float, optional
+        The angle in degrees of the line to refine (default is 0).
+    search_radius : float, optional
+        The maximum distance in pixels from `position` in x and y (default is 1).
+    angle_radius : float, optional
+        The maximum change in degrees from `angle` (default is 2.5).
+    max_angle : float, optional
+        The maximum rotation of the line in degrees (default is 5).
+    tolerance : float, optional
+        The smallest position step in pixels (default is 0.05).
+
+    Returns
+    -------
+    tuple[float, tuple[float, float], float]
+        The contrast, (x, y) start position and angle of the refined line.
+        If refinement does not improve on the contrast of the initial line then the initial line is returned.
+    """
+    params = np.array([position[0], position[1], angle], dtype=float)
+    lower = params - [search_radius, search_radius, angle_radius]
+    upper = params + [search_radius, search_radius, angle_radius]
+    lower[2] = max(lower[2], -max_angle)
+    upper[2] = min(upper[2], max_angle)
+    steps = np.array([search_radius, search_radius, angle_radius / 2])
+
+    def contrasts(candidates: np.ndarray) -> np.ndarray:
+        results = np.zeros(candidates.shape[0])
+        for candidate_angle in np.unique(candidates[:, 2]):
+            same_angle = candidates[:, 2] == candidate_angle
+            results[same_angle] = sampled_contrasts(array,
+                                                    candidates[same_angle, :2],
+                                                    candidate_angle,
+                                                    line_length,
+                                                    direction,
+                                                    pixel_size,
+                                                    line_min_val,
+                                                    method,
+                                                    contrast_frequency,
+                                                    gating,
+                                                    within_loc,
+                                                    num_pins)
+        return results
+
+    best_contrast = float(contrasts(params[np.newaxis])[0])
+    while steps[0] >= tolerance:
+        candidates = np.clip(params + STENCIL * steps, lower, upper)
+        candidates = candidates[np.any(candidates != params, axis=1)]
+        if candidates.shape[0] > 0:
+            candidate_contrasts = contrasts(candidates)
+            best = int(np.argmax(candidate_contrasts))
+            if candidate_contrasts[best] > best_contrast:
+                best_contrast = float(candidate_contrasts[best])
+                params = candidates[best]
+                continue
+        steps /= 2
+
+    return best_contrast, (float(params[0]), float(params[1])), float(params[2])
+
+
+def square_wave_integral(x: np.ndarray | float, width: float = 1, offset: float = 0):
+    """
+    The integral of a square wave from 0 to x.
+    The square wave is defined by
+
+    1 (0 < x mod 2*width < width)
+    0 (width < x mod 2*width < 2*width)
+
+
+    Parameters
+    ----------
+    x : np.ndarray | float
+    width : float, optional
+        Width of a peak of the square wave.
+        The wavelength is 2*width.
+    offset : float, optional
+        The offset of the square wave.
+        If a mutiple of 2*width then it is equivelant to 0.
+
+    Returns
+    -------
+    The integral of the square wave up to x.
+    """
+    x = ((x - offset) / (2 * width)) - 0.5
+    zero_pt = ((0 - offset) / (2 * width)) - 0.5
+    integral = (width
+                * ((np.abs(0.5 + (x % 1))
+                    + np.abs(0.5 - (x % 1))
+                    + np.floor(x))
+                    + (np.abs(0.5 + (zero_pt % 1))
+                       + np.abs(0.5 - (zero_pt % 1))
+                       + np.floor(zero_pt))))
+    return integral
+
+
+def model_signal(offset: float,
+                 pixel_width: float,
+                 wave_peak_width: float,
+                 num_peaks: int,
+                 num_samples: int) -> np.ndarray:
+    points = np.arange(0, num_samples + 1, 1) * pixel_width
+    raw_signal = square_wave_integral(points, wave_peak_width, offset)
+    raw_signal[points < offset] = square_wave_integral(offset, wave_peak_width, offset)
+    max_point = offset + 2 * wave_peak_width * num_peaks
+    raw_signal[points > max_point] = square_wave_integral(max_point, wave_peak_width, offset)
+    signal = np.diff(raw_signal)
+    return signal
+
+
+def model_neg_signal_contrast(offset: float,
+                              pixel_width: float,
+                              wave_peak_width: float,
+                              num_peaks: int,
+                              num_samples: int,) -> float:
+    signal = model_signal(offset,
+                          pixel_width,
+                          wave_peak_width,
+                          num_peaks,
+                          num_samples)
+    return -get_contrast(signal)
+
+
+def maximum_contrast_ratio(pixel_width: float,
+                           wave_peak_width: float,
+                           num_peaks: int,
+                           num_samples: int) -> float:
+    optimum = minimize_scalar(model_neg_signal_contrast,
+                              args=(pixel_width,
+                                    wave_peak_width,
+                                    num_peaks,
+                                    num_samples),
+                              bounds=(0, pixel_width))
+    return -optimum.fun  # pyright: ignore[reportAttributeAccessIssue]
+
+
+def model_neg_signal_fft_contrast(offset: float,
+                                  pixel_width: float,
+                                  wave_peak_width: float,
+                                  num_peaks: int,
+                                  num_samples: int,
+                                  contrast_frequency: float) -> float:
+    signal = model_signal(offset,
+                          pixel_width,
+                          wave_peak_width,
+                          num_peaks,
+                          num_samples)
+    return -fft_contrast(signal,
+                         pixel_width,
+                         contrast_frequency)
+
+
+def maximum_frequency_ratio(pixel_width: float,
+                            wave_peak_width: float,
+                            num_peaks: int,
+                            num_samples: int,
+                            contrast_frequency: float) -> float:
+    optimum = minimize_scalar(model_neg_signal_fft_contrast,
+                              args=(pixel_width,
+                                    wave_peak_width,
+                                    num_peaks,
+                                    num_samples,
+                                    contrast_frequency),
+                              bounds=(0, pixel_width))
+    return -optimum.fun  # pyright: ignore[reportAttributeAccessIssue]
+
+
+def model_signals(offsets: np.ndarray[tuple[int], np.dtype],
+                  pixel_widths: np.ndarray[tuple[int], np.dtype],
+                  wave_peak_width: float,
+                  num_peaks: int,
+                  num_samples: np.ndarray[tuple[int], np.dtype]) -> np.ndarray[tuple[int, int, int], np.dtype]:
+    """
+    Batched version of `model_signal` on a (pixel width, offset, sample) grid.
+
+    Signals are zero padded to the largest value of `num_samples`.
+
+    Parameters
+    ----------
+    offsets : np.ndarray
+        The offsets of the square wave.
+    pixel_widths : np.ndarray
+        The pixel widths, must be greater than 0.
+    wave_peak_width : float
+        Width of a peak of the square wave.
+    num_peaks : int
+        The number of peaks in the square wave.
+    num_samples : np.ndarray
+        The number of samples for each pixel width.
+
+    Returns
+    -------
+    np.ndarray
+        Array of signals indexed (pixel width, offset, sample).
+    """
+    max_samples = int(np.max(num_samples))
+    points = np.arange(0, max_samples + 1, 1) * pixel_widths[:, np.newaxis, np.newaxis]
+    offsets = offsets[np.newaxis, :, np.newaxis]
+    max_points = offsets + 2 * wave_peak_width * num_peaks
+
+    raw_signals = square_wave_integral(points, wave_peak_width, offsets)
+    raw_signals = np.where(points < offsets,
+                           square_wave_integral(offsets, wave_peak_width, offsets),
+                           raw_signals)
+    raw_signals = np.where(points > max_points,
+                           square_wave_integral(max_points, wave_peak_width, offsets),
+                           raw_signals)
+    signals = np.diff(raw_signals, axis=-1)
+    signals = np.where(np.arange(max_samples) < num_samples[:, np.newaxis, np.newaxis], signals, 0)
+    return signals
+
+
+def offset_sweep(pixel_widths: np.ndarray[tuple[int], np.dtype],
+                 offsets: np.ndarray[tuple[int], np.dtype],
+                 wave_peak_width: float,
+                 num_peaks: int,
+                 num_samples: np.ndarray[tuple[int], np.dtype],
+                 method: ResolutionMethod = "FFT",
+                 contrast_frequency: float = 0.5,
+                 chunk_size: int = 2**22) -> np.ndarray[tuple[int, int], np.dtype]:
+    """
+    Contrast of the modelled square wave signal for every combination of pixel width and offset.
+
+    The signals are modelled on a (pixel width, offset, sample) grid using `model_signals`.
+    For the FFT method the transform at DC and `contrast_frequency` is taken along the sample axis
+    for the whole grid at once, the zero padding of shorter signals does not change these values.
+    Pixel widths are processed in chunks of at most `chunk_size` grid points to limit memory use.
+
+    Parameters
+    ----------
+    pixel_widths : np.ndarray
+        The pixel widths to model, widths less than or equal to 0 are given a contrast of 0.
+    offsets : np.ndarray
+        The offsets of the square wave to model.
+    wave_peak_width : float
+        Width of a peak of the square wave.
+    num_peaks : int
+        The number of peaks in the square wave.
+    num_samples : np.ndarray
+        The number of samples in the line for each pixel width.
+    method : ResolutionMethod, optional
+        The contrast method (default is "FFT").
+    contrast_frequency : float, optional
+        The frequency used by the FFT method (default is 0.5).
+    chunk_size : int, optional
+        The maximum number of grid points modelled at once (default is 2**22).
+
+    Returns
+    -------
+    np.ndarray
+        Array of contrasts indexed (pixel width, offset).
+    """
+    results = np.zeros((pixel_widths.shape[0], offsets.shape[0]))
+    valid_indices = np.flatnonzero((pixel_widths > 0) & (num_samples > 0))
+
+    start = 0
+    while start < valid_indices.shape[0]:
+        # add widths to the chunk until it is full, always at least one width
+        end = start + 1
+        chunk_samples = num_samples[valid_indices[start]]
+        while end < valid_indices.shape[0]:
+            chunk_samples = max(chunk_samples, num_samples[valid_indices[end]])
+            if (end + 1 - start) * offsets.shape[0] * (chunk_samples + 1) > chunk_size:
+                break
+            end += 1
+
+        indices = valid_indices[start:end]
+        widths = pixel_widths[indices]
+        samples = num_samples[indices]
+        signals = model_signals(offsets, widths, wave_peak_width, num_peaks, samples)
+
+        if method == "FFT":
+            positions = np.arange(signals.shape[-1]) * widths[:, np.newaxis]
+            basis = np.exp(-2j * np.pi * contrast_frequency * positions)
+            freq_vals = np.abs(np.einsum("wos,ws->wo", signals, basis))
+            dc_vals = np.abs(np.sum(signals, axis=-1))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                results[indices] = freq_vals / dc_vals
+        else:
+            for w_i, width_signals in enumerate(signals):
+                results[indices[w_i]] = get_contrasts(width_signals[:, :samples[w_i]])
+        start = end
+
+    results[~np.isfinite(results)] = 0
+    return results
+
+
+def sweep_best_contrast(pixel_width: float,
+                        wave_peak_width: float,
+                        num_peaks: int,
+                        num_samples: int,
+                        method: ResolutionMethod = "FFT",
+                        contrast_frequency: float = 0.5,
+                        num_offsets: int = 200) -> float:
+    """
+    The theoretical best contrast for a line found by sweeping the offset of the square wave.
+
+    The offsets between 0 and `pixel_width` are swept using `offset_sweep`
+    and the best offset is then refined with `minimize_scalar`.
+    Unlike `maximum_frequency_ratio` and `maximum_contrast_ratio` this finds the global maximum
+    when the contrast has more than one peak across offsets.
+
+    Parameters
+    ----------
+    pixel_width : float
+        The distance between points in the line.
+    wave_peak_width : float
+        Width of a peak of the square wave.
+    num_peaks : int
+        The number of peaks in the square wave.
+    num_samples : int
+        The number of points in the line.
+    method : ResolutionMethod, optional
+        The contrast method (default is "FFT").
+    contrast_frequency : float, optional
+        The frequency used by the FFT method (default is 0.5).
+    num_offsets : int, optional
+        The number of offsets in the sweep (default is 200).
+
+    Returns
+    -------
+    float
+        The best contrast as a ratio.
+    """
+    offsets = np.linspace(0, pixel_width, num_offsets)
+    contrasts = offset_sweep(np.array([pixel_width]),
+                             offsets,
+                             wave_peak_width,
+                             num_peaks,
+                             np.array([num_samples]),
+                             method,
+                             contrast_frequency)[0]
+    best = int(np.argmax(contrasts))
+    if contrasts[best] <= 0:
+        return 0
+
+    if method == "FFT":
+        func = model_neg_signal_fft_contrast
+        args = (pixel_width, wave_peak_width, num_peaks, num_samples, contrast_frequency)
+    else:
+        func = model_neg_signal_contrast
+        args = (pixel_width, wave_peak_width, num_peaks, num_samples)
+    optimum = minimize_scalar(func,
+                              args=args,
+                              bounds=(offsets[max(best - 1, 0)],
+                                      offsets[min(best + 1, num_offsets - 1)]))
+    return max(float(contrasts[best]), -optimum.fun)  # pyright: ignore[reportAttributeAccessIssue]
+
+
+def build_best_contrast_table(path: Path | str = BEST_CONTRAST_TABLE,
+                              min_width: float = 0.25,
+                              max_width: float = 1.5,
+                              num_widths: int = 501) -> None:
+    """
+    Builds the table of theoretical best contrasts used by `best_contrast_ratio` and saves it to `path`.
+
+    Parameters
+    ----------
+    path : Path | str, optional
+        The file the table is saved to (default is `BEST_CONTRAST_TABLE`).
+    min_width : float, optional
+        The minimum pixel width in the table (default is 0.25).
+    max_width : float, optional
+        The maximum pixel width in the table (default is 1.5).
+    num_widths : int, optional
+        The number of pixel widths in the table (default is 501).
+    """
+    pixel_widths = np.linspace(min_width, max_width, num_widths)
+    num_samples = np.floor(TABLE_SAMPLE_LENGTH / pixel_widths).astype(int)
+
+    tables: dict[str, np.ndarray] = {}
+    for method in ("FFT", "contrast"):
+        tables[method] = np.array([sweep_best_contrast(pixel_width,
+                                                       TABLE_WAVE_PEAK_WIDTH,
+                                                       TABLE_NUM_PEAKS,
+                                                       samples,
+                                                       method,  # pyright: ignore[reportArgumentType]
+                                                       TABLE_CONTRAST_FREQUENCY)
+                                   for pixel_width, samples in zip(pixel_widths, num_samples)])
+
+    np.savez(path,
+             pixel_widths=pixel_widths,
+             num_samples=num_samples,
+             fft=tables["FFT"],
+             contrast=tables["contrast"])
+    load_best_contrast_table.cache_clear()
+    best_contrast_ratio.cache_clear()
+
+
+@lru_cache(maxsize=4)
+def load_best_contrast_table(path: Path | str = BEST_CONTRAST_TABLE) -> dict[str, np.ndarray] | None:
+    """
+    Loads the table saved by `build_best_contrast_table`.
+    Returns None if the file does not exist.
+    """
+    try:
+        with np.load(path) as table:
+            return {key: table[key] for key in table.files}
+    except FileNotFoundError:
+        return None
+
+
+@lru_cache(maxsize=128)
+def best_contrast_ratio(pixel_width: float,
+                        wave_peak_width: float,
+                        num_peaks: int,
+                        num_samples: int,
+                        method: ResolutionMethod = "FFT",
+                        contrast_frequency: float = 0.5) -> float:
+    """
+    The theoretical best contrast for a line, see `sweep_best_contrast`.
+
+    Results are memoized. If the parameters match the table saved by `build_best_contrast_table`
+    and `pixel_width` lies between two table widths with the same number of samples
+    and similar values the result is interpolated from the table,
+    otherwise it is calculated using `sweep_best_contrast`.
+
+    Parameters
+    ----------
+    pixel_width : float
+        The distance between points in the line.
+    wave_peak_width : float
+        Width of a peak of the square wave.
+    num_peaks : int
+        The number of peaks in the square wave.
+    num_samples : int
+        The number of points in the line.
+    method : ResolutionMethod, optional
+        The contrast method (default is "FFT").
+    contrast_frequency : float, optional
+        The frequency used by the FFT method (default is 0.5).
+
+    Returns
+    -------
+    float
+        The best contrast as a ratio.
+    """
+    table = load_best_contrast_table()
+    if (table is not None
+        and wave_peak_width == TABLE_WAVE_PEAK_WIDTH
+        and num_peaks == TABLE_NUM_PEAKS
+            and (method != "FFT" or contrast_frequency == TABLE_CONTRAST_FREQUENCY)):
+        widths = table["pixel_widths"]
+        upper = int(np.searchsorted(widths, pixel_width))
+        lower = upper - 1
+        if upper < widths.shape[0] and widths[upper] == pixel_width:
+            lower = upper
+        if (0 <= lower and upper < widths.shape[0]
+                and table["num_samples"][lower] == num_samples == table["num_samples"][upper]):
+            if method == "FFT":
+                values = table["fft"][lower:upper + 1]
+            else:
+                values = table["contrast"][lower:upper + 1]
+            # the best contrast can jump between widths, these are not interpolated
+            if abs(values[-1] - values[0]) <= TABLE_MAX_STEP:
+                return float(np.interp(pixel_width, widths[lower:upper + 1], values))
+
+    return sweep_best_contrast(pixel_width,
+                               wave_peak_width,
+                               num_peaks,
+                               num_samples,
+                               method,
+                               contrast_frequency)
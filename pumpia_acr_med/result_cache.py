@@ -0,0 +1,109 @@
+"""
+Persistent cache of module results.
+"""
+import json
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Any
+
+DEFAULT_MAX_ENTRIES = 200000
+# increase when a change to the analysis means cached results should no longer be used
+CACHE_VERSION = 2
+
+
+def default_cache_path() -> Path:
+    """
+    Returns the default location of the cache, in the users home directory.
+    """
+    return Path.home() / ".pumpia_acr_med" / "results_cache.sqlite3"
+
+
+class ResultCache:
+    """
+    Least recently used cache of module results stored in an SQLite database.
+
+    Results are dictionaries of JSON serialisable values stored against a key,
+    see `MedACRModule.cache_key` for how the key is made for a module.
+    When there are more than `max_entries` results the least recently used are removed.
+    A connection is opened for each call so the cache can be used from any thread.
+
+    Parameters
+    ----------
+    path : Path | None, optional
+        The database file, created if it does not exist.
+        If None `default_cache_path` is used (default is None).
+    max_entries : int, optional
+        The maximum number of results kept (default is DEFAULT_MAX_ENTRIES).
+    """
+
+    def __init__(self, path: Path | None = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        if path is None:
+            path = default_cache_path()
+        self.path: Path = path
+        self.max_entries: int = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS results "
+                               "(key TEXT PRIMARY KEY, results TEXT NOT NULL, last_used INTEGER NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def _next_use(connection: sqlite3.Connection) -> int:
+        """
+        Returns a counter for the last use, a timestamp may not be distinct for calls close together.
+        """
+        return connection.execute("SELECT COALESCE(MAX(last_used), 0) + 1 FROM results").fetchone()[0]
+
+    def __len__(self) -> int:
+        with closing(self._connect()) as connection:
+            return connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        """
+        Returns the results stored against `key` and marks them as used.
+
+        Parameters
+        ----------
+        key : str
+
+        Returns
+        -------
+        dict[str, Any] | None
+            The results, None if they are not in the cache.
+        """
+        with closing(self._connect()) as connection, connection:
+            row = connection.execute("SELECT results FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE results SET last_used = ? WHERE key = ?",
+                               (self._next_use(connection), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, results: dict[str, Any]) -> None:
+        """
+        Stores `results` against `key`, removing the least recently used results if the cache is full.
+
+        Parameters
+        ----------
+        key : str
+        results : dict[str, Any]
+            The results, must be JSON serialisable.
+        """
+        text = json.dumps(results)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("INSERT OR REPLACE INTO results (key, results, last_used) VALUES (?, ?, ?)",
+                               (key, text, self._next_use(connection)))
+            connection.execute("DELETE FROM results WHERE key IN "
+                               "(SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                               (self.max_entries,))
+
+    def clear(self) -> None:
+        """
+        Removes all results from the cache.
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM results")
@@ -0,0 +1,74 @@
+"""
+Streaming statistics of repeated measurements.
+"""
+import numpy as np
+
+
+class RunningStats:
+    """
+    Single pass mean and variance of equally shaped arrays using Welford's algorithm.
+    Only the running mean and the sum of squared differences from it are kept,
+    so the memory used is that of one array however many are added.
+
+    Attributes
+    ----------
+    count : int
+        The number of arrays added.
+    mean : np.ndarray
+    """
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self._mean: np.ndarray | None = None
+        self._m2: np.ndarray | None = None
+
+    def add(self, array: np.ndarray) -> None:
+        """
+        Adds an array, it must have the same shape as those already added.
+        """
+        values = np.asarray(array, dtype=float)
+        self.count += 1
+        if self._mean is None or self._m2 is None:
+            self._mean = values.copy()
+            self._m2 = np.zeros_like(self._mean)
+            return
+        if values.shape != self._mean.shape:
+            raise ValueError(f"Array shape {values.shape} does not match {self._mean.shape}")
+        delta = values - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (values - self._mean)
+
+    @property
+    def mean(self) -> np.ndarray:
+        """
+        The element wise mean of the arrays added.
+        """
+        if self._mean is None:
+            raise ValueError("No arrays added")
+        return self._mean
+
+    def variance(self, ddof: int = 1) -> np.ndarray:
+        """
+        Returns the element wise variance of the arrays added.
+
+        Parameters
+        ----------
+        ddof : int, optional
+            Delta degrees of freedom, the divisor is `count - ddof` (default is 1).
+
+        Returns
+        -------
+        np.ndarray
+        """
+        if self._m2 is None:
+            raise ValueError("No arrays added")
+        if self.count <= ddof:
+            raise ValueError(f"At least {ddof + 1} arrays are needed")
+        return self._m2 / (self.count - ddof)
+
+    def std(self, ddof: int = 1) -> np.ndarray:
+        """
+        Returns the element wise standard deviation of the arrays added.
+        See `variance`.
+        """
+        return np.sqrt(self.variance(ddof))
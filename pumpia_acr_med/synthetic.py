@@ -0,0 +1,561 @@
+"""
+Generates synthetic medium ACR phantom series with known results.
+
+The phantom is drawn in a canonical frame, with the resolution insert at the bottom
+and the circle insert on the right, then mirrored and rotated to the requested orientation.
+Each pixel is the mean of a supersampled grid so edges are partial volumed.
+Distances are in mm from the centre of the phantom with y down, as in the image.
+
+The ground truth is written next to the series as `ground_truth.json`,
+keyed by the column names of the batch results where there is one.
+"""
+import argparse
+import json
+import math
+from collections.abc import Sequence
+from datetime import datetime
+from pathlib import Path
+from typing import Literal
+
+import numpy as np
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+from pumpia.utilities.typing import SideType
+
+NUM_SLICES = 11
+SLICE_GAP = 5
+PHANTOM_DIAMETER = 165
+DEFAULT_FOV = 250
+# inserts slice features
+RING_RADII = (16, 28)
+RING_WINDOW = 35
+RAMP_BLOCK = (65, -5, 4)
+TOP_RAMP = (-4, -1)
+BOTTOM_RAMP = (0, 3)
+TAN_THETA = 0.1
+WEDGE_U = ((-6, -1), (1, 6))
+WEDGE_END = -55
+WEDGE_START = -40
+RES_BOX = (-14, 5, 28, 47)
+RES_BOX_SIGNAL = 0.1
+PIN_SIZE = 1
+PIN_PITCH = 2
+NUM_PINS = 4
+CIRCLE_CENTRE = (30.5, -30.5)
+CIRCLE_RADIUS = 5
+# grid slice features
+GRID_PITCH = 15
+GRID_LINE_WIDTH = 2
+GRID_RADIUS = 75
+
+# quarter turns anticlockwise from the canonical frame for each resolution insert side
+res_insert_turns: dict[SideType, int] = {"bottom": 0, "right": 1, "top": 2, "left": 3}
+# the circle insert side of the canonical frame after each number of quarter turns
+circle_insert_sides: list[SideType] = ["right", "top", "left", "bottom"]
+circle_insert_mirror_sides: dict[SideType, SideType] = {"right": "left",
+                                                        "top": "bottom",
+                                                        "left": "right",
+                                                        "bottom": "top"}
+
+
+def canonical_coordinates(matrix: int,
+                          pixel_spacing: tuple[float, float],
+                          res_insert_side: SideType = "bottom",
+                          circle_insert_side: SideType = "right",
+                          rotation: float = 0,
+                          supersample: int = 2) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the position in the canonical frame of each supersampled point of the image.
+
+    Parameters
+    ----------
+    matrix : int
+        The number of rows and columns.
+    pixel_spacing : tuple[float, float]
+        The (row, column) pixel size.
+    res_insert_side : SideType, optional
+        (default is "bottom")
+    circle_insert_side : SideType, optional
+        Must be on the other axis to `res_insert_side` (default is "right").
+    rotation : float, optional
+        The anticlockwise rotation in degrees (default is 0).
+    supersample : int, optional
+        The number of points along each side of a pixel (default is 2).
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The canonical x and y of each point with shape (matrix * supersample, matrix * supersample).
+
+    Raises
+    ------
+    ValueError
+        If the insert sides are on the same axis.
+    """
+    turns = res_insert_turns[res_insert_side]
+    if circle_insert_side == circle_insert_sides[turns]:
+        mirrored = False
+    elif circle_insert_side == circle_insert_mirror_sides[circle_insert_sides[turns]]:
+        mirrored = True
+    else:
+        raise ValueError("resolution/circle insert sides must not be on the same axis")
+
+    pixel_height, pixel_width = pixel_spacing
+    offsets = (np.arange(matrix * supersample) + 0.5) / supersample - matrix / 2
+    x, y = np.meshgrid(offsets * pixel_width, offsets * pixel_height)
+
+    # undo the anticlockwise rotation, y is down so the signs are swapped from the usual matrix
+    angle = math.radians(90 * turns + rotation)
+    u = x * math.cos(angle) - y * math.sin(angle)
+    v = x * math.sin(angle) + y * math.cos(angle)
+    if mirrored:
+        u = -u
+    return u, v
+
+
+def _box(u: np.ndarray, v: np.ndarray, umin: float, umax: float, vmin: float, vmax: float) -> np.ndarray:
+    return (u >= umin) & (u < umax) & (v >= vmin) & (v < vmax)
+
+
+def _wedges(u: np.ndarray, v: np.ndarray, offset: float) -> np.ndarray:
+    """
+    Returns the wedges for a canonical slice offset, the bar lengths differ by twice the offset.
+    """
+    (left_min, left_max), (right_min, right_max) = WEDGE_U
+    return (_box(u, v, left_min, left_max, WEDGE_END - offset, WEDGE_START)
+            | _box(u, v, right_min, right_max, WEDGE_END + offset, WEDGE_START))
+
+
+def inserts_slice(u: np.ndarray,
+                  v: np.ndarray,
+                  slice_width: float,
+                  slice_offset: float) -> np.ndarray:
+    """
+    Returns the fraction of signal at each point of the inserts slice.
+
+    Parameters
+    ----------
+    u : np.ndarray
+        The canonical x of each point.
+    v : np.ndarray
+        The canonical y of each point.
+    slice_width : float
+        The FWHM of the slice profile, the ramps have a FWHM of `slice_width / TAN_THETA`.
+    slice_offset : float
+        The canonical slice offset shown by the wedges.
+
+    Returns
+    -------
+    np.ndarray
+    """
+    radius = np.hypot(u, v)
+    signal = (radius <= PHANTOM_DIAMETER / 2).astype(float)
+
+    # dark ring around the centre, open opposite the resolution insert
+    angle = np.degrees(np.arctan2(-v, u))
+    ring = (radius >= RING_RADII[0]) & (radius < RING_RADII[1]) & (np.abs(angle - 90) > RING_WINDOW)
+    signal[ring] = 0
+
+    half_length, block_min, block_max = RAMP_BLOCK
+    signal[_box(u, v, -half_length, half_length, block_min, block_max)] = 0
+    # flat topped ramps with edges placed so the FWHM is exact
+    ramp_fwhm = slice_width / TAN_THETA
+    ramp = np.exp(-math.log(2) * (2 * u / ramp_fwhm) ** 4)
+    for ramp_min, ramp_max in (TOP_RAMP, BOTTOM_RAMP):
+        in_ramp = _box(u, v, -half_length, half_length, ramp_min, ramp_max)
+        signal[in_ramp] = ramp[in_ramp]
+
+    signal[_wedges(u, v, slice_offset)] = 0
+
+    xmin, xmax, ymin, ymax = RES_BOX
+    signal[_box(u, v, xmin, xmax, ymin, ymax)] = RES_BOX_SIGNAL
+    pins_length = (NUM_PINS - 1) * PIN_PITCH + PIN_SIZE
+    pins_xmin = (xmin + xmax - pins_length) / 2
+    pins_ymin = (ymin + ymax - pins_length) / 2
+    for column in range(NUM_PINS):
+        for row in range(NUM_PINS):
+            pin_x = pins_xmin + column * PIN_PITCH
+            pin_y = pins_ymin + row * PIN_PITCH
+            signal[_box(u, v, pin_x, pin_x + PIN_SIZE, pin_y, pin_y + PIN_SIZE)] = 1
+
+    signal[np.hypot(u - CIRCLE_CENTRE[0], v - CIRCLE_CENTRE[1]) < CIRCLE_RADIUS] = 0
+    return signal
+
+
+def grid_slice(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """
+    Returns the fraction of signal at each point of the grid slice.
+    """
+    radius = np.hypot(u, v)
+    signal = (radius <= PHANTOM_DIAMETER / 2).astype(float)
+    half_width = GRID_LINE_WIDTH / 2
+    lines = ((np.abs((u + half_width) % GRID_PITCH - half_width) < half_width)
+             | (np.abs((v + half_width) % GRID_PITCH - half_width) < half_width))
+    signal[lines & (radius < GRID_RADIUS)] = 0
+    return signal
+
+
+def wedges_slice(u: np.ndarray, v: np.ndarray, slice_offset: float) -> np.ndarray:
+    """
+    Returns the fraction of signal at each point of the slice at the other end of the phantom.
+    """
+    signal = (np.hypot(u, v) <= PHANTOM_DIAMETER / 2).astype(float)
+    signal[_wedges(u, v, slice_offset)] = 0
+    return signal
+
+
+def _downsample(array: np.ndarray, supersample: int) -> np.ndarray:
+    rows = array.shape[0] // supersample
+    columns = array.shape[1] // supersample
+    return array.reshape(rows, supersample, columns, supersample).mean(axis=(1, 3))
+
+
+def _wedge_sign(res_insert_side: SideType, circle_insert_side: SideType) -> int:
+    """
+    Returns the sign between the canonical slice offset and the one found by the slice position module.
+    The wedge ROIs for the resolution insert on the left or right are mirrored compared to top or bottom.
+    """
+    turns = res_insert_turns[res_insert_side]
+    sign = 1 if circle_insert_side == circle_insert_sides[turns] else -1
+    if res_insert_side in ["left", "right"]:
+        sign = -sign
+    return sign
+
+
+def phantom_volume(matrix: int = 256,
+                   pixel_spacing: tuple[float, float] | None = None,
+                   inserts_slice_pos: Literal["first", "last"] = "first",
+                   res_insert_side: SideType = "bottom",
+                   circle_insert_side: SideType = "right",
+                   rotation: float = 0,
+                   slice_width: float = 5,
+                   slice_1_pos: float = 0,
+                   slice_11_pos: float = 0,
+                   signal: float = 1000,
+                   ghost_level: float = 0,
+                   phase_direction: Literal["ROW", "COL"] = "ROW",
+                   supersample: int = 2) -> np.ndarray:
+    """
+    Returns the noise free volume of a medium ACR series.
+
+    Parameters
+    ----------
+    matrix : int, optional
+        The number of rows and columns (default is 256).
+    pixel_spacing : tuple[float, float] | None, optional
+        The (row, column) pixel size, None for a 250mm field of view (default is None).
+    inserts_slice_pos : Literal["first", "last"], optional
+        Whether the inserts are on the first or last slice (default is "first").
+    res_insert_side : SideType, optional
+        (default is "bottom")
+    circle_insert_side : SideType, optional
+        (default is "right")
+    rotation : float, optional
+        The anticlockwise rotation in degrees (default is 0).
+    slice_width : float, optional
+        The slice width shown by the ramps (default is 5).
+    slice_1_pos : float, optional
+        The slice position found on the inserts slice (default is 0).
+    slice_11_pos : float, optional
+        The slice position found on the slice at the other end (default is 0).
+    signal : float, optional
+        The signal of the phantom (default is 1000).
+    ghost_level : float, optional
+        The fraction of the signal in the phase encode ghost (default is 0).
+    phase_direction : Literal["ROW", "COL"], optional
+        The phase encode direction, as InPlanePhaseEncodingDirection (default is "ROW").
+    supersample : int, optional
+        The number of points along each side of a pixel (default is 2).
+
+    Returns
+    -------
+    np.ndarray
+        The volume with shape (slices, rows, columns).
+    """
+    if pixel_spacing is None:
+        pixel_spacing = (DEFAULT_FOV / matrix, DEFAULT_FOV / matrix)
+    u, v = canonical_coordinates(matrix,
+                                 pixel_spacing,
+                                 res_insert_side,
+                                 circle_insert_side,
+                                 rotation,
+                                 supersample)
+    sign = _wedge_sign(res_insert_side, circle_insert_side)
+
+    uniform = _downsample((np.hypot(u, v) <= PHANTOM_DIAMETER / 2).astype(float), supersample)
+    volume = np.repeat(uniform[np.newaxis], NUM_SLICES, axis=0)
+    volume[0] = _downsample(inserts_slice(u, v, slice_width, sign * slice_1_pos), supersample)
+    volume[4] = _downsample(grid_slice(u, v), supersample)
+    volume[10] = _downsample(wedges_slice(u, v, sign * slice_11_pos), supersample)
+    if inserts_slice_pos == "last":
+        volume = volume[::-1]
+    volume = volume * signal
+
+    if ghost_level:
+        axis = 2 if phase_direction == "ROW" else 1
+        volume = volume + ghost_level * np.roll(volume, matrix // 2, axis=axis)
+    return volume
+
+
+def add_noise(volume: np.ndarray, noise: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Returns a magnitude image of `volume` with complex Gaussian noise of standard deviation `noise`,
+    so the background follows a Rayleigh distribution.
+    """
+    if noise == 0:
+        return volume
+    real = volume + rng.normal(0, noise, volume.shape)
+    imaginary = rng.normal(0, noise, volume.shape)
+    return np.hypot(real, imaginary)
+
+
+def write_series(folder: Path,
+                 volume: np.ndarray,
+                 pixel_spacing: tuple[float, float],
+                 study_uid: str,
+                 series_number: int,
+                 slice_thickness: float = 5,
+                 pixel_bandwidth: float = 130,
+                 num_averages: float = 1,
+                 phase_direction: Literal["ROW", "COL"] = "ROW",
+                 percent_sampling: float = 100,
+                 patient_id: str = "SYNTHETIC",
+                 study_datetime: datetime | None = None) -> list[Path]:
+    """
+    Writes a volume as a series of unsigned 16 bit MR DICOM files.
+
+    Parameters
+    ----------
+    folder : Path
+        The folder for the series, created if it does not exist.
+    volume : np.ndarray
+        The volume with shape (slices, rows, columns).
+    pixel_spacing : tuple[float, float]
+        The (row, column) pixel size.
+    study_uid : str
+        The StudyInstanceUID shared by the series of a study.
+    series_number : int
+    slice_thickness : float, optional
+        (default is 5)
+    pixel_bandwidth : float, optional
+        (default is 130)
+    num_averages : float, optional
+        (default is 1)
+    phase_direction : Literal["ROW", "COL"], optional
+        (default is "ROW")
+    percent_sampling : float, optional
+        (default is 100)
+    patient_id : str, optional
+        (default is "SYNTHETIC")
+    study_datetime : datetime | None, optional
+        None for now (default is None).
+
+    Returns
+    -------
+    list[Path]
+        The files written.
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    if study_datetime is None:
+        study_datetime = datetime.now()
+    series_uid = generate_uid()
+    rows, columns = volume.shape[1:]
+    phase_steps = columns if phase_direction == "ROW" else rows
+    pixels = np.clip(np.rint(volume), 0, np.iinfo(np.uint16).max).astype(np.uint16)
+
+    files: list[Path] = []
+    for index, array in enumerate(pixels):
+        file = folder / f"IM{index + 1:04d}.dcm"
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = MRImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+        ds = FileDataset(file, {}, file_meta=meta, preamble=b"\0" * 128)
+        ds.SOPClassUID = MRImageStorage
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.Modality = "MR"
+        ds.PatientID = patient_id
+        ds.PatientName = "Synthetic^Medium ACR"
+        ds.StudyInstanceUID = study_uid
+        ds.StudyID = "1"
+        ds.StudyDate = study_datetime.strftime("%Y%m%d")
+        ds.StudyTime = study_datetime.strftime("%H%M%S")
+        ds.StudyDescription = "Synthetic Medium ACR"
+        ds.SeriesInstanceUID = series_uid
+        ds.SeriesNumber = series_number
+        ds.SeriesDescription = "ACR T1"
+        ds.AcquisitionNumber = 1
+        ds.InstanceNumber = index + 1
+
+        ds.Rows = rows
+        ds.Columns = columns
+        ds.PixelSpacing = list(pixel_spacing)
+        ds.SliceThickness = slice_thickness
+        ds.SpacingBetweenSlices = slice_thickness + SLICE_GAP
+        ds.SliceLocation = index * (slice_thickness + SLICE_GAP)
+        ds.ImagePositionPatient = [-columns * pixel_spacing[1] / 2,
+                                   -rows * pixel_spacing[0] / 2,
+                                   ds.SliceLocation]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelBandwidth = pixel_bandwidth
+        ds.NumberOfAverages = num_averages
+        ds.InPlanePhaseEncodingDirection = phase_direction
+        ds.NumberOfPhaseEncodingSteps = phase_steps
+        ds.PercentSampling = percent_sampling
+        ds.PercentPhaseFieldOfView = 100
+
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 0
+        ds.PixelData = array.tobytes()
+        ds.save_as(file, enforce_file_format=True)
+        files.append(file)
+    return files
+
+
+def generate_study(folder: Path,
+                   matrix: int = 256,
+                   pixel_spacing: tuple[float, float] | None = None,
+                   num_repeats: int = 2,
+                   inserts_slice_pos: Literal["first", "last"] = "first",
+                   res_insert_side: SideType = "bottom",
+                   circle_insert_side: SideType = "right",
+                   rotation: float = 0,
+                   slice_width: float = 5,
+                   slice_1_pos: float = 0,
+                   slice_11_pos: float = 0,
+                   signal: float = 1000,
+                   noise: float = 10,
+                   ghost_level: float = 0,
+                   phase_direction: Literal["ROW", "COL"] = "ROW",
+                   supersample: int = 2,
+                   seed: int | None = None) -> dict[str, str | float | int]:
+    """
+    Writes a synthetic medium ACR study and its ground truth to `folder`.
+
+    Each repeat is a series with the same phantom and its own noise.
+    See `phantom_volume` for the phantom parameters.
+
+    The ground truth is of the phantom drawn, measurements can differ from it.
+    The ghosting is biased low when the ghost is not well above the noise floor of the background.
+
+    Parameters
+    ----------
+    folder : Path
+        The folder for the study, each series is written to a sub folder.
+    num_repeats : int, optional
+        The number of series (default is 2).
+    noise : float, optional
+        The standard deviation of the complex noise (default is 10).
+    seed : int | None, optional
+        The seed for the noise (default is None).
+
+    Returns
+    -------
+    dict[str, str | float | int]
+        The ground truth.
+    """
+    if pixel_spacing is None:
+        pixel_spacing = (DEFAULT_FOV / matrix, DEFAULT_FOV / matrix)
+    volume = phantom_volume(matrix,
+                            pixel_spacing,
+                            inserts_slice_pos,
+                            res_insert_side,
+                            circle_insert_side,
+                            rotation,
+                            slice_width,
+                            slice_1_pos,
+                            slice_11_pos,
+                            signal,
+                            ghost_level,
+                            phase_direction,
+                            supersample)
+
+    rng = np.random.default_rng(seed)
+    study_uid = generate_uid()
+    study_datetime = datetime.now()
+    for repeat in range(num_repeats):
+        write_series(folder / f"series_{repeat + 1}",
+                     add_noise(volume, noise, rng),
+                     pixel_spacing,
+                     study_uid,
+                     repeat + 1,
+                     phase_direction=phase_direction,
+                     study_datetime=study_datetime)
+
+    ground_truth: dict[str, str | float | int] = {
+        "study_instance_uid": study_uid,
+        "matrix": matrix,
+        "pixel_spacing_row": pixel_spacing[0],
+        "pixel_spacing_column": pixel_spacing[1],
+        "num_repeats": num_repeats,
+        "inserts_slice": 1 if inserts_slice_pos == "first" else NUM_SLICES,
+        "res_insert_side": res_insert_side,
+        "circle_insert_side": circle_insert_side,
+        "rotation": rotation,
+        "average_width": PHANTOM_DIAMETER,
+        "linearity": 0,
+        "slice_width": slice_width,
+        "slice_1_pos": slice_1_pos,
+        "slice_11_pos": slice_11_pos,
+        "ghosting": 100 * ghost_level,
+        "signal": signal,
+        "noise": noise,
+        "snr": signal / noise if noise else math.inf,
+        "pin_size": PIN_SIZE,
+        "pin_pitch": PIN_PITCH}
+    with open(folder / "ground_truth.json", "w", encoding="utf-8") as file:
+        json.dump(ground_truth, file, indent=4)
+    return ground_truth
+
+
+def main(argv: Sequence[str] | None = None):
+    """
+    Command line entry point for generating a synthetic study.
+    """
+    sides = list(res_insert_turns)
+    parser = argparse.ArgumentParser(description="Generate a synthetic medium ACR study with known results.")
+    parser.add_argument("folder", type=Path, help="folder to write the study to")
+    parser.add_argument("-m", "--matrix", type=int, default=256, help="number of rows and columns")
+    parser.add_argument("-p", "--pixel-spacing", type=float, default=None,
+                        help=f"pixel size in mm, defaults to a {DEFAULT_FOV}mm field of view")
+    parser.add_argument("-r", "--repeats", type=int, default=2, help="number of series")
+    parser.add_argument("--inserts-slice", choices=["first", "last"], default="first")
+    parser.add_argument("--res-insert-side", choices=sides, default="bottom")
+    parser.add_argument("--circle-insert-side", choices=sides, default="right")
+    parser.add_argument("--rotation", type=float, default=0, help="anticlockwise rotation in degrees")
+    parser.add_argument("--slice-width", type=float, default=5)
+    parser.add_argument("--slice-1-pos", type=float, default=0)
+    parser.add_argument("--slice-11-pos", type=float, default=0)
+    parser.add_argument("--signal", type=float, default=1000)
+    parser.add_argument("--noise", type=float, default=10, help="standard deviation of the complex noise")
+    parser.add_argument("--ghost", type=float, default=0, help="fraction of the signal in the ghost")
+    parser.add_argument("--phase-direction", choices=["ROW", "COL"], default="ROW")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    pixel_spacing = None
+    if args.pixel_spacing is not None:
+        pixel_spacing = (args.pixel_spacing, args.pixel_spacing)
+    generate_study(args.folder,
+                   args.matrix,
+                   pixel_spacing,
+                   args.repeats,
+                   args.inserts_slice,
+                   args.res_insert_side,
+                   args.circle_insert_side,
+                   args.rotation,
+                   args.slice_width,
+                   args.slice_1_pos,
+                   args.slice_11_pos,
+                   args.signal,
+                   args.noise,
+                   args.ghost,
+                   args.phase_direction,
+                   seed=args.seed)
+    print(f"Study written to {args.folder}")
@@ -0,0 +1,4 @@
+from pumpia_acr_med.benchmark import main
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+from pumpia_acr_med.med_acr_module import MedACRModule
 from pumpia_acr_med.med_acr_rpt_collection import MedACRrptCollection
+from pumpia_acr_med.result_cache import ResultCache
 
+MedACRModule.result_cache = ResultCache()
 MedACRrptCollection.run()
@@ -0,0 +1,6 @@
+from pumpia_acr_med.med_acr_module import MedACRModule
+from pumpia_acr_med.modules.stability import MedACRStability
+from pumpia_acr_med.result_cache import ResultCache
+
+MedACRModule.result_cache = ResultCache()
+MedACRStability.run()